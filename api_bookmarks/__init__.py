@@ -2,6 +2,12 @@
 # -*- coding: utf-8 -*-
 """api_bookmarks."""
 
+from api_bookmarks.database import Memory
 from api_bookmarks.database import SQLite
+from api_bookmarks.job import JobQueue
+from api_bookmarks.maintenance import Maintainer
 from api_bookmarks.route import Route
+from api_bookmarks.scheduler import Scheduler
+from api_bookmarks.service import AsyncService
+from api_bookmarks.service import Cached
 from api_bookmarks.service import Live
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.checker.
+
+This module runs the link checks concurrently. URLs are grouped by host, so
+that the requests to the same host share one session (and hence one pool of
+keep-alive connections), and the number of simultaneous requests is limited
+both globally and per host, across all the checks running at once.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from threading import Lock
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+from typing import TypeVar
+from urllib.parse import urlparse
+
+import requests
+
+
+T = TypeVar("T")  # pylint: disable=invalid-name
+U = TypeVar("U")  # pylint: disable=invalid-name
+
+
+class Checker:
+    """Concurrent, host-aware link checking engine.
+
+    `concurrency` is the maximum number of requests in flight at any time, and
+    `concurrency_per_host` is the maximum number of requests in flight to a
+    single host. The limits are shared by all the calls to `map` on the
+    checker, e.g., by a check requested through the API and a scheduled one
+    running at the same time.
+    """
+
+    def __init__(self, concurrency: int = 16, concurrency_per_host: int = 2) -> None:
+        if concurrency < 1 or concurrency_per_host < 1:
+            raise ValueError("Concurrency limits must be positive.")
+
+        self.concurrency = concurrency
+        self.concurrency_per_host = concurrency_per_host
+        self._slots = BoundedSemaphore(concurrency)
+        # The slots of each host being checked, and the number of calls
+        # checking it. The slots are dropped when no call checks the host.
+        self._host_slots: Dict[str, Tuple[BoundedSemaphore, int]] = {}
+        self._lock = Lock()
+
+    def map(
+        self, function: Callable[[requests.Session, str], T], urls: List[str]
+    ) -> List[T]:
+        """Apply `function` to every URL, and return the results in order.
+
+        `function` receives the session shared by all the URLs on the same
+        host, in addition to the URL itself. It is expected to handle the
+        failure of each URL itself: an exception stops the rest of its lane,
+        and is raised once the other lanes are done.
+        """
+        return self.map_items(function, urls, lambda url: url)
+
+    def map_items(
+        self,
+        function: Callable[[requests.Session, U], T],
+        items: List[U],
+        get_url: Callable[[U], str],
+    ) -> List[T]:
+        """Apply `function` to every item, and return the results in order.
+
+        As `map`, with the URL of each item given by `get_url`, so that the
+        items with the same URL are told apart.
+        """
+        lanes = self._make_lanes([get_url(item) for item in items])
+        results: List[T] = [None] * len(items)  # type: ignore
+
+        sessions = {host: requests.Session() for host, _ in lanes}
+        host_slots = self._acquire_hosts(sessions)
+
+        def run(host: str, lane: List[Tuple[int, str]]) -> None:
+            # Requests in one lane are sent one after another, so that each
+            # lane keeps reusing its keep-alive connection. The slot of the
+            # host is taken before the global one, so that no global slot is
+            # held while waiting for a busy host.
+            for index, _ in lane:
+                with host_slots[host], self._slots:
+                    results[index] = function(sessions[host], items[index])
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                futures = [executor.submit(run, host, lane) for host, lane in lanes]
+                for future in futures:
+                    future.result()
+        finally:
+            self._release_hosts(sessions)
+            for session in sessions.values():
+                session.close()
+
+        return results
+
+    def _acquire_hosts(self, hosts: Iterable[str]) -> Dict[str, BoundedSemaphore]:
+        """Get the slots of the hosts, shared with the other calls."""
+        with self._lock:
+            host_slots = {}
+            for host in hosts:
+                slots, n_users = self._host_slots.get(
+                    host, (BoundedSemaphore(self.concurrency_per_host), 0)
+                )
+                self._host_slots[host] = (slots, n_users + 1)
+                host_slots[host] = slots
+            return host_slots
+
+    def _release_hosts(self, hosts: Iterable[str]) -> None:
+        with self._lock:
+            for host in hosts:
+                slots, n_users = self._host_slots[host]
+                if n_users == 1:
+                    del self._host_slots[host]
+                else:
+                    self._host_slots[host] = (slots, n_users - 1)
+
+    def _make_lanes(self, urls: List[str]) -> List[Tuple[str, List[Tuple[int, str]]]]:
+        """Group the URLs by host, and split each group into lanes.
+
+        The number of lanes per host does not exceed `concurrency_per_host`.
+        The lanes are interleaved across hosts, so that the first lanes to be
+        scheduled are spread over as many hosts as possible.
+        """
+        groups: Dict[str, List[Tuple[int, str]]] = OrderedDict()
+        for index, url in enumerate(urls):
+            groups.setdefault(self._get_host(url), []).append((index, url))
+
+        lanes_per_host = []
+        for host, group in groups.items():
+            n_lanes = min(self.concurrency_per_host, len(group))
+            lanes_per_host.append(
+                [(host, group[i::n_lanes]) for i in range(n_lanes)]
+            )
+
+        max_lanes = max((len(lanes) for lanes in lanes_per_host), default=0)
+        return [
+            lanes[i]
+            for i in range(max_lanes)
+            for lanes in lanes_per_host
+            if i < len(lanes)
+        ]
+
+    @staticmethod
+    def _get_host(url: str) -> str:
+        if not url.startswith("http://") and not url.startswith("https://"):
+            url = "http://" + url
+        return urlparse(url).netloc.lower()
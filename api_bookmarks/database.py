@@ -7,39 +7,95 @@ This module hosts all the oprations with the database.
 
 from abc import ABC
 from abc import abstractmethod
+from bisect import bisect_left
+from bisect import bisect_right
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
+from queue import Empty
+from queue import LifoQueue
+from sys import intern
+from threading import Lock
+from threading import RLock
+from time import perf_counter
 from typing import Any
+from typing import BinaryIO
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Set
+from typing import Tuple
 from uuid import UUID
+import heapq
 import logging
+import mmap
+import os
+import re
 import sqlite3
+import unicodedata
+
+import orjson
 
 from api_bookmarks.model import Bookmark
+from api_bookmarks.model import BookmarkChanges
+from api_bookmarks.model import BookmarkQuery
+from api_bookmarks.model import BookmarkRecord
+from api_bookmarks.model import CheckResult
+from api_bookmarks.model import MaintenanceReport
+from api_bookmarks.model import Validator
 
 
 class Database(ABC):
     """Abstract class for database management."""
 
+    # Migration scripts are named "v<version>__<description>.sql".
+    MIGRATION_DIR = Path(__file__).parent.joinpath("sql")
+
     def __init__(self) -> None:
+        self.migration_seconds = 0.0
         self._migrate()
 
     def _migrate(self) -> None:
-        """Apply the migration scripts to the database.
+        """Apply the pending migration scripts to the database.
 
-        The migration may create and incrementally alter tables.
+        The migration may create and incrementally alter tables. The scripts
+        already applied are skipped, and the pending scripts are applied in
+        the order of their versions. The time taken is kept in
+        `migration_seconds`.
         """
-        migration_scripts = Path(__file__).parent.joinpath("sql").glob("*.sql")
-        for script in sorted(migration_scripts):
-            self._execute_sql_file(script)
+        start = perf_counter()
+        applied = self._get_applied_versions()
+        pending = sorted(
+            (
+                script
+                for script in self.MIGRATION_DIR.glob("*.sql")
+                if get_migration_version(script) not in applied
+            ),
+            key=get_migration_version,
+        )
+        if pending:
+            self._apply_migrations(pending)
+        self.migration_seconds = perf_counter() - start
+
+        logging.info(
+            "Applied %i migration script(s) in %.3f s: %s",
+            len(pending),
+            self.migration_seconds,
+            ", ".join(script.name for script in pending),
+        )
+
+    @abstractmethod
+    def _get_applied_versions(self) -> Set[int]:
+        """Retrieve the versions of the migration scripts already applied."""
 
     @abstractmethod
-    def _execute_sql_file(self, script: Path) -> None:
-        """Execute one sql script."""
+    def _apply_migrations(self, scripts: List[Path]) -> None:
+        """Apply the migration scripts, all or nothing, in the given order."""
 
     @abstractmethod
-    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[Bookmark]:
+    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[BookmarkRecord]:
         """Retrieve bookmarks by their ids from the database.
 
         If None or an empty list is provided as bookmark ids, all the bookmarks
@@ -47,36 +103,328 @@ class Database(ABC):
         """
 
     @abstractmethod
-    def add_bookmarks(self, bookmarks: List[Bookmark]) -> None:
-        """Insert a new bookmark to the database."""
+    def query_bookmarks(self, query: BookmarkQuery) -> List[BookmarkRecord]:
+        """Retrieve a page of bookmarks, sorted as queried.
+
+        The fields not listed in the query are left at their default values.
+        """
+
+    @abstractmethod
+    def get_bookmarks_json(self, query: Optional[BookmarkQuery] = None) -> bytes:
+        """Retrieve all the bookmarks, or the page of bookmarks queried,
+        serialized as a JSON array of Bookmark.
+
+        The records are serialized as they are read, without constructing (and
+        validating) a Bookmark for each of them.
+        """
+
+    @abstractmethod
+    def iter_bookmarks(self) -> Iterator[BookmarkRecord]:
+        """Iterate over all the bookmarks, reading them as they are consumed.
+
+        The bookmarks are read from one snapshot of the database, however long
+        the iteration takes.
+        """
+
+    @abstractmethod
+    def add_bookmarks(
+        self, bookmarks: List[Bookmark], skip_existing: bool = False
+    ) -> List[Bookmark]:
+        """Insert new bookmarks to the database, in one transaction.
+
+        If `skip_existing`, the bookmarks whose urls are already in the
+        database (or earlier in `bookmarks`) are skipped, instead of failing
+        the insert. The inserted bookmarks are returned.
+        """
 
     @abstractmethod
-    def update_bookmarks(self, bookmarks: List[Bookmark], fields: List[str]) -> None:
-        """Update Bookmarks' fields.
+    def update_bookmarks(
+        self, bookmarks: List[Bookmark], fields: List[str]
+    ) -> List[BookmarkRecord]:
+        """Update Bookmarks' fields, in one transaction.
 
-        Only the listed fields are updated in the database."""
+        Only the listed fields are updated in the database. The updated
+        bookmarks are returned as stored, and the ones not in the database are
+        left out."""
 
     @abstractmethod
     def delete_bookmarks(self, bookmark_ids: List[UUID]) -> None:
         """Drop the bookmark from the database."""
 
+    @abstractmethod
+    def add_visits(self, visits: Dict[UUID, Tuple[int, datetime]]) -> None:
+        """Increment the visit counts, and update the last visit dates.
+
+        `visits` maps the bookmark ids to the numbers of visits to add and the
+        dates of the last visits. A last visit date is updated only if later.
+        """
+
+    @abstractmethod
+    def get_changes(self, since: int) -> BookmarkChanges:
+        """Retrieve the changes to the bookmarks after the version `since`.
+
+        Only the latest state of each changed bookmark is returned.
+        """
+
+    @abstractmethod
+    def search_bookmarks(self, query: str, limit: int) -> List[BookmarkRecord]:
+        """Search the bookmarks by the words in their url, title, description
+        and tags.
+
+        Every word in the query must match, as a prefix of a word in the
+        bookmark. At most `limit` bookmarks are returned, the best match
+        first.
+        """
+
+    @abstractmethod
+    def get_validators(self, bookmark_ids: List[UUID]) -> Dict[UUID, Validator]:
+        """Retrieve the validators of the bookmarks.
+
+        Bookmarks without stored validators are not included.
+        """
+
+    @abstractmethod
+    def update_validators(self, validators: Dict[UUID, Validator]) -> None:
+        """Replace the validators of the bookmarks."""
+
+    @abstractmethod
+    def add_check_results(self, results: List[CheckResult]) -> None:
+        """Append the outcomes of the link checks to the history."""
+
+    @abstractmethod
+    def compact_check_results(self, before: datetime) -> int:
+        """Downsample the checks before the datetime into daily summaries.
+
+        Returns the number of checks downsampled.
+        """
+
+    @abstractmethod
+    def get_response_times(
+        self, start: datetime, end: datetime, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        """Retrieve the response times of the checks in the time window.
+
+        The response times are in milliseconds, sorted in ascending order. If
+        None or an empty list is provided as bookmark ids, the checks of all
+        the bookmarks are retrieved.
+        """
+
+    @abstractmethod
+    def get_statuses(
+        self, limit: int, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        """Retrieve the status codes of the last `limit` checks of each
+        bookmark, the latest first.
+
+        Only the checks not yet downsampled are included. If None or an empty
+        list is provided as bookmark ids, the checks of all the bookmarks are
+        retrieved.
+        """
+
+    @abstractmethod
+    def maintain(self, vacuum: bool = False) -> MaintenanceReport:
+        """Purge the tags no bookmark has, refresh the statistics of the query
+        planner, and return the unused pages to the file system.
+
+        The unused pages are returned as far as the database allows without
+        rewriting it. If `vacuum`, the whole database is rewritten instead,
+        which takes longer, and blocks the other writes meanwhile.
+        """
+
+    def close(self) -> None:
+        """Release the connections and the files held open."""
+
+
+TAG_DENOMINATOR = "__;;__"
+SEARCH_TOKEN = re.compile(r"\w+")
+# The words as split by the unicode61 tokenizer of SQLite.
+SEARCH_WORD = re.compile(r"[^\W_]+")
+# The positions of the fields in the encoded records of Memory.
+ID, TAGS, LAST_VISIT, VISIT_COUNT = (
+    BookmarkRecord.FIELDS.index(field)
+    for field in ["id", "tags", "lastVisitDatetime", "visitCount"]
+)
+# The limit on the number of parameters of a statement, before SQLite 3.32.
+MAX_PARAMETERS = 999
+
+
+def get_migration_version(script: Path) -> int:
+    """Extract the version from the name of the migration script."""
+    match = re.match(r"v(\d+)__", script.name)
+    if match is None:
+        raise ValueError("Invalid migration script name: %s" % script.name)
+    return int(match.group(1))
+
+
+def make_match_expression(query: str) -> str:
+    """Make the FTS5 query that matches every word in the query as a prefix.
+
+    Only the words are kept, so the operators and punctuation of the FTS5
+    query syntax in the query are ignored. An empty string is returned if the
+    query has no words.
+    """
+    return " ".join('"%s"*' % token for token in SEARCH_TOKEN.findall(query))
+
 
 class SQLite(Database):
-    """SQLite database management."""
+    """SQLite database management.
+
+    Connections are kept open in a pool of up to `pool_size` connections, and
+    each connection is used by one thread at a time. If `pool_size` is zero, a
+    new connection is opened (and closed) for every operation.
+    """
 
-    def __init__(self, database: str) -> None:
+    # Applied to every new connection. The auto vacuum and the journal mode
+    # are persistent in the database file, but the others only last as long as
+    # the connection. The auto vacuum only takes effect on a new database (so
+    # it comes first), or on the next VACUUM.
+    PRAGMAS = (
+        "PRAGMA auto_vacuum = INCREMENTAL",
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA foreign_keys = ON",
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA cache_size = -16000",  # in KiB
+        "PRAGMA mmap_size = 67108864",  # in bytes
+    )
+    # Applied to the read-only connections outside the pool.
+    READER_PRAGMAS = (
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA cache_size = -16000",  # in KiB
+        "PRAGMA mmap_size = 67108864",  # in bytes
+    )
+    # The number of rows of each index sampled by ANALYZE.
+    ANALYSIS_LIMIT = 1000
+    # The number of runs of the query timed by the maintenance.
+    TIMING_RUNS = 3
+
+    def __init__(self, database: str, pool_size: int = 4) -> None:
         self.database = database
+        self.pool_size = pool_size
+        self._pool: "LifoQueue[sqlite3.Connection]" = LifoQueue()
+        self._n_connections = 0
+        self._lock = Lock()
         super().__init__()
 
-    def _execute_sql_file(self, script: Path) -> None:
-        with open(script, "r") as handler:
-            content = handler.read()
+    def close(self) -> None:
+        """Close all the connections in the pool.
 
-        logging.info("Executing %s:\n%s", script, content)
+        The statistics of the query planner are refreshed before closing, as
+        far as the queries run on each connection would benefit.
+        """
+        with self._lock:
+            while True:
+                try:
+                    conn = self._pool.get_nowait()
+                except Empty:
+                    break
+                conn.execute("PRAGMA optimize")
+                conn.close()
+                self._n_connections -= 1
 
-        with sqlite3.connect(self.database) as conn:
-            conn.executescript(content)
-            conn.commit()
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Check out a connection, and commit (or roll back) on return."""
+        conn = self._acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._release(conn)
+
+    def _acquire(self) -> sqlite3.Connection:
+        if self.pool_size <= 0:
+            return self._open()
+
+        try:
+            return self._pool.get_nowait()
+        except Empty:
+            pass
+
+        with self._lock:
+            if self._n_connections < self.pool_size:
+                self._n_connections += 1
+                return self._open()
+        return self._pool.get()
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        if self.pool_size <= 0:
+            conn.close()
+        else:
+            self._pool.put(conn)
+
+    def _open(self) -> sqlite3.Connection:
+        # A pooled connection is handed from one thread to another, but never
+        # used by two threads at the same time.
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _open_reader(self) -> sqlite3.Connection:
+        """Open a read-only connection outside the pool.
+
+        The journal mode is persistent, so the connection reads in WAL mode
+        too, and only the pragmas of the connection are set.
+        """
+        conn = sqlite3.connect(
+            "%s?mode=ro" % Path(self.database).resolve().as_uri(),
+            uri=True,
+            check_same_thread=False,
+        )
+        for pragma in self.READER_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _get_applied_versions(self) -> Set[int]:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    script TEXT NOT NULL,
+                    appliedDatetime TEXT NOT NULL,
+                    durationMs REAL NOT NULL
+                )
+            """
+            )
+            records = conn.execute("SELECT version FROM schema_version").fetchall()
+        return {record[0] for record in records}
+
+    def _apply_migrations(self, scripts: List[Path]) -> None:
+        # `executescript` would commit after each script, so the statements
+        # are executed one by one inside a single transaction.
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            for script in scripts:
+                start = perf_counter()
+                with open(script, "r") as handler:
+                    for statement in self._split_statements(handler.read()):
+                        conn.execute(statement)
+
+                conn.execute(
+                    """
+                    INSERT INTO schema_version (
+                        version, script, appliedDatetime, durationMs
+                    ) VALUES (?, ?, ?, ?)
+                """,
+                    (
+                        get_migration_version(script),
+                        script.name,
+                        datetime.now().isoformat(),
+                        (perf_counter() - start) * 1000,
+                    ),
+                )
+
+    @staticmethod
+    def _split_statements(content: str) -> Iterator[str]:
+        """Split the SQL script into complete statements."""
+        statement = ""
+        for line in content.splitlines(keepends=True):
+            statement += line
+            if sqlite3.complete_statement(statement):
+                yield statement
+                statement = ""
 
     @staticmethod
     def _decode_datetime(value: Optional[datetime]) -> str:
@@ -85,79 +433,299 @@ class SQLite(Database):
         return value.isoformat()
 
     @staticmethod
-    def _encode_datetime(value: str) -> Optional[datetime]:
-        if value == "":
-            return None
-        return datetime.fromisoformat(value)
-
-    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[Bookmark]:
-        tag_denominator = "__;;__"
-        with sqlite3.connect(self.database) as conn:
-            conn.row_factory = sqlite3.Row
+    def _decode_timestamp(value: datetime) -> int:
+        return int(value.timestamp())
+
+    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[BookmarkRecord]:
+        with self._connect() as conn:
             cursor = conn.cursor()
-            records = self._execute_select_query(cursor, bookmark_ids, tag_denominator)
-        conn.close()
+            if bookmark_ids:
+                return self._select_bookmarks(cursor, bookmark_ids)
+            records = self._execute_select_query(cursor, None, TAG_DENOMINATOR)
+            return list(self._make_records(cursor, records))
+
+    def _select_bookmarks(
+        self, cursor: sqlite3.Cursor, bookmark_ids: List[UUID]
+    ) -> List[BookmarkRecord]:
+        """Select the bookmarks by their ids, in that order.
 
+        The ids are bound in chunks, within the limit on the parameters of a
+        query (one of which is the tag denominator).
+        """
+        selected: Dict[UUID, BookmarkRecord] = {}
+        unique_ids = list(dict.fromkeys(bookmark_ids))
+        for start in range(0, len(unique_ids), MAX_PARAMETERS - 1):
+            chunk = unique_ids[start : start + MAX_PARAMETERS - 1]
+            records = self._execute_select_query(cursor, chunk, TAG_DENOMINATOR)
+            for record in self._make_records(cursor, records):
+                assert record.id is not None
+                selected[record.id] = record
         return [
-            Bookmark(
-                id=record["id"],
-                url=record["url"],
-                title=record["title"],
-                description=record["description"],
-                tags=sorted(record["tags"].split(tag_denominator)),
-                checkedDatetime=self._encode_datetime(record["checkedDatetime"]),
-                lastVisitDatetime=self._encode_datetime(record["lastVisitDatetime"]),
-                visitCount=record["visitCount"],
-                statusCode=record["statusCode"],
-            )
-            for record in records
+            selected[bookmark_id]
+            for bookmark_id in unique_ids
+            if bookmark_id in selected
         ]
 
+    def query_bookmarks(self, query: BookmarkQuery) -> List[BookmarkRecord]:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            records = self._execute_select_query(
+                cursor, None, TAG_DENOMINATOR, page=query
+            )
+            return list(self._make_records(cursor, records))
+
+    def get_bookmarks_json(self, query: Optional[BookmarkQuery] = None) -> bytes:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                *self._make_select_query(None, TAG_DENOMINATOR, page=query)
+            )
+            fields = [column[0] for column in cursor.description]
+            records = cursor.fetchall()
+        return orjson.dumps(self._make_json_items(fields, records))
+
+    @staticmethod
+    def _make_json_items(fields: List[str], records: List[Any]) -> List[Any]:
+        """Make the items of the JSON array, as Bookmark.json() would write.
+
+        The datetimes are stored in the ISO format, and are written as they are.
+        """
+        items = [dict(zip(fields, record)) for record in records]
+        for field in fields:
+            if field == "tags":
+                for item in items:
+                    tags = item["tags"]
+                    item["tags"] = sorted(tags.split(TAG_DENOMINATOR)) if tags else []
+            elif "datetime" in field.lower():
+                for item in items:
+                    item[field] = item[field] or None
+        return items
+
+    def iter_bookmarks(self) -> Iterator[BookmarkRecord]:
+        # The iteration lasts as long as the consumer takes (e.g., a client
+        # downloading an export), so it has a read-only connection of its own,
+        # rather than holding one of the pool meanwhile.
+        conn = self._open_reader()
+        try:
+            # The read transaction pins the snapshot until the iteration ends,
+            # while the writers carry on in the WAL.
+            conn.execute("BEGIN")
+            cursor = conn.cursor()
+            cursor.execute(*self._make_select_query(None, TAG_DENOMINATOR))
+            yield from self._make_records(cursor, cursor)
+        finally:
+            conn.close()
+
     @staticmethod
+    def _make_records(
+        cursor: sqlite3.Cursor, records: Iterable[Tuple[Any, ...]]
+    ) -> Iterator[BookmarkRecord]:
+        """Make the records of the selected rows.
+
+        Only the selected columns are set, and the others are left at their
+        default values. The tags of each distinct set are split once, and the
+        records with the same set share one tuple of interned tags. The
+        datetimes are left in the ISO format, for the records to decode them
+        when read.
+        """
+        fields = [column[0] for column in cursor.description]
+        id_index = fields.index("id")
+        tags_index = fields.index("tags") if "tags" in fields else None
+        tag_sets: Dict[Optional[str], Tuple[str, ...]] = {None: (), "": ()}
+        # All the columns are selected in the order of the fields, unless the
+        # query asks for only some fields.
+        positional = tuple(fields) == BookmarkRecord.FIELDS
+        for record in records:
+            values = list(record)
+            values[id_index] = UUID(values[id_index])
+            if tags_index is not None:
+                tags = values[tags_index]
+                if tags not in tag_sets:
+                    tag_sets[tags] = tuple(
+                        sorted(intern(tag) for tag in tags.split(TAG_DENOMINATOR))
+                    )
+                values[tags_index] = tag_sets[tags]
+            if positional:
+                yield BookmarkRecord(*values)
+            else:
+                yield BookmarkRecord(**dict(zip(fields, values)))
+
+    # The expression to select each field of the bookmark. The tags are
+    # aggregated per selected bookmark, so that selecting a few bookmarks by
+    # id only reads their own tags. The separator is bound as a parameter.
+    SELECT_COLUMNS = {
+        "id": "b.id",
+        "url": "b.url",
+        "title": "b.title",
+        "description": "b.description",
+        "tags": """(
+            SELECT GROUP_CONCAT(t.name, ?)
+            FROM bookmark_tag AS bt
+            JOIN tag AS t ON t.id = bt.tagId
+            WHERE bt.bookmarkId = b.id
+        ) AS tags""",
+        "checkedDatetime": "b.checkedDatetime",
+        "lastVisitDatetime": "b.lastVisitDatetime",
+        "visitCount": "b.visitCount",
+        "statusCode": "b.statusCode",
+    }
+
+    @classmethod
     def _execute_select_query(
+        cls,
         cursor: sqlite3.Cursor,
         bookmark_ids: Optional[List[UUID]],
         tag_denominator: str,
+        since: Optional[int] = None,
+        match: Optional[str] = None,
+        limit: Optional[int] = None,
+        page: Optional[BookmarkQuery] = None,
     ) -> List[Any]:
-        query = (
-            """
-            SELECT
-                b.id,
-                b.url,
-                b.title,
-                b.description,
-                t.tags,
-                b.checkedDatetime,
-                b.lastVisitDatetime,
-                b.visitCount,
-                b.statusCode
-            FROM bookmark AS b
-            LEFT JOIN (
-                SELECT bookmarkId, GROUP_CONCAT(name, "%s") AS tags
-                FROM tag
-                GROUP BY bookmarkId
-            ) AS t
-            ON b.id = t.bookmarkId
+        cursor.execute(
+            *cls._make_select_query(
+                bookmark_ids, tag_denominator, since, match, limit, page
+            )
+        )
+        return cursor.fetchall()
+
+    @classmethod
+    def _make_select_query(  # pylint: disable=too-many-arguments
+        cls,
+        bookmark_ids: Optional[List[UUID]],
+        tag_denominator: str,
+        since: Optional[int] = None,
+        match: Optional[str] = None,
+        limit: Optional[int] = None,
+        page: Optional[BookmarkQuery] = None,
+    ) -> Tuple[str, List[Any]]:
+        """Make the query to select bookmarks, together with its parameters.
+
+        If `since` is given, only the bookmarks changed after that version are
+        selected.
+
+        If `match` (an FTS5 query) is given, only the best `limit` matches are
+        selected, in the order of their rank.
+
+        If `page` is given, only the fields and the page of bookmarks it asks
+        for are selected. The fields not asked for (notably, the tags) are not
+        computed at all.
         """
-            % tag_denominator
+        fields = page.fields if page is not None and page.fields else cls.SELECT_COLUMNS
+        query = "SELECT %s FROM bookmark AS b " % ", ".join(
+            cls.SELECT_COLUMNS[field] for field in fields
         )
+        parameters: List[Any] = [tag_denominator] if "tags" in fields else []
         if bookmark_ids:
             query += "WHERE b.id IN (%s)" % ",".join(["?"] * len(bookmark_ids))
-            cursor.execute(query, [str(bid) for bid in bookmark_ids])
-        else:
-            cursor.execute(query)
-        return cursor.fetchall()
+            parameters += [str(bid) for bid in bookmark_ids]
+        elif since is not None:
+            query += """
+                WHERE b.id IN (
+                    SELECT bookmarkId FROM change_log WHERE version > ?
+                )
+            """
+            parameters.append(since)
+        elif match is not None:
+            # The index is ranked and limited before joining the bookmarks, so
+            # only the returned bookmarks are read.
+            query += """
+                JOIN (
+                    SELECT rowid, rank FROM bookmark_fts
+                    WHERE bookmark_fts MATCH ?
+                    ORDER BY rank
+                    LIMIT ?
+                ) AS f ON f.rowid = b.rowid
+                ORDER BY f.rank
+            """
+            parameters += [match, limit if limit is not None else -1]
+        elif page is not None:
+            page_query, page_parameters = cls._make_page_query(page)
+            query += page_query
+            parameters += page_parameters
+        return query, parameters
+
+    @staticmethod
+    def _make_page_query(page: BookmarkQuery) -> Tuple[str, List[Any]]:
+        """Make the clauses to select the page, together with their parameters.
+
+        The page is read from the index on (sort field, id), seeking to the
+        bookmark `after`. If that bookmark no longer exists, the page is empty.
+        """
+        keys = ["b.id"]
+        if page.sort_field != "id":
+            keys.insert(0, "b.%s" % page.sort_field)
+        direction = " DESC" if page.descending else ""
+
+        query = ""
+        parameters: List[Any] = []
+        if page.after is not None:
+            query += "WHERE (%s) %s (SELECT %s FROM bookmark WHERE id = ?) " % (
+                ", ".join(keys),
+                "<" if page.descending else ">",
+                ", ".join(key[2:] for key in keys),
+            )
+            parameters.append(str(page.after))
+        query += "ORDER BY %s " % ", ".join(key + direction for key in keys)
+        if page.limit is not None:
+            query += "LIMIT ?"
+            parameters.append(page.limit)
+        return query, parameters
+
+    def get_changes(self, since: int) -> BookmarkChanges:
+        with self._connect() as conn:
+            # The version and the changes are read in one transaction, so that
+            # they are consistent with each other.
+            conn.execute("BEGIN")
+            cursor = conn.cursor()
+            version = conn.execute(
+                "SELECT COALESCE(MAX(version), 0) FROM change_log"
+            ).fetchone()[0]
+            records = self._execute_select_query(cursor, None, TAG_DENOMINATOR, since)
+            bookmarks = list(self._make_records(cursor, records))
+            deleted = conn.execute(
+                "SELECT bookmarkId FROM change_log WHERE version > ? AND deleted",
+                (since,),
+            ).fetchall()
+
+        return BookmarkChanges(
+            version=version,
+            bookmarks=bookmarks,
+            deleted=[record[0] for record in deleted],
+        )
 
-    def add_bookmarks(self, bookmarks: List[Bookmark]) -> None:
-        with sqlite3.connect(self.database) as conn:
+    def search_bookmarks(self, query: str, limit: int) -> List[BookmarkRecord]:
+        match = make_match_expression(query)
+        if not match:
+            return []
+
+        with self._connect() as conn:
             cursor = conn.cursor()
+            records = self._execute_select_query(
+                cursor, None, TAG_DENOMINATOR, match=match, limit=limit
+            )
+            return list(self._make_records(cursor, records))
+
+    def add_bookmarks(
+        self, bookmarks: List[Bookmark], skip_existing: bool = False
+    ) -> List[Bookmark]:
+        query = """
+            INSERT INTO bookmark (
+                id, url, title, description, checkedDatetime,
+                lastVisitDatetime, visitCount, statusCode
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            # The write lock is taken up front, so that no url is added by
+            # another writer after it is looked up below.
+            cursor.execute("BEGIN IMMEDIATE")
+            if skip_existing:
+                bookmarks = self._drop_existing(cursor, bookmarks)
+            # The tags are inserted first, so that each bookmark is indexed
+            # for search once, with its tags. See v8__index_tags_on_insert.sql.
+            cursor.execute("PRAGMA defer_foreign_keys = ON")
+            self._insert_tags(cursor, bookmarks)
             cursor.executemany(
-                """
-                INSERT INTO bookmark (
-                    id, url, title, description, checkedDatetime,
-                    lastVisitDatetime, visitCount, statusCode
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
+                query,
                 [
                     (
                         str(bookmark.id),
@@ -172,19 +740,34 @@ class SQLite(Database):
                     for bookmark in bookmarks
                 ],
             )
+        return bookmarks
 
-            tag_insert_args = [
-                (tag, str(bookmark.id))
-                for bookmark in bookmarks
-                for tag in bookmark.tags
-            ]
-            if tag_insert_args:
-                cursor.executemany(
-                    "INSERT INTO tag (name, bookmarkId) VALUES (?, ?)", tag_insert_args,
-                )
-        conn.close()
+    @staticmethod
+    def _drop_existing(
+        cursor: sqlite3.Cursor, bookmarks: List[Bookmark]
+    ) -> List[Bookmark]:
+        """Drop the bookmarks whose urls are in the database, or repeated."""
+        urls = list({bookmark.url for bookmark in bookmarks})
+        existing: Set[str] = set()
+        for start in range(0, len(urls), MAX_PARAMETERS):
+            chunk = urls[start : start + MAX_PARAMETERS]
+            cursor.execute(
+                "SELECT url FROM bookmark WHERE url IN (%s)"
+                % ",".join(["?"] * len(chunk)),
+                chunk,
+            )
+            existing.update(url for url, in cursor)
+
+        new = []
+        for bookmark in bookmarks:
+            if bookmark.url not in existing:
+                existing.add(bookmark.url)
+                new.append(bookmark)
+        return new
 
-    def update_bookmarks(self, bookmarks: List[Bookmark], fields: List[str]) -> None:
+    def update_bookmarks(
+        self, bookmarks: List[Bookmark], fields: List[str]
+    ) -> List[BookmarkRecord]:
         bookmark_table_fields = list(set(fields) - set(["tags"]))
         query = (
             "UPDATE bookmark SET "
@@ -200,41 +783,1101 @@ class SQLite(Database):
             for bookmark in bookmarks
         ]
 
-        with sqlite3.connect(self.database) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
-            cursor.executemany(query, parameters)
+            cursor.execute("BEGIN IMMEDIATE")
+            if bookmark_table_fields:
+                cursor.executemany(query, parameters)
 
             if "tags" in fields:
                 self._update_tags(cursor, bookmarks)
 
+            # Read back in the same transaction, so that the bookmarks are as
+            # written here, whatever is written next.
+            return self._select_bookmarks(
+                cursor, [bookmark.id for bookmark in bookmarks if bookmark.id]
+            )
+
     def _get_field(self, bookmark: Bookmark, field: str) -> str:
         value = getattr(bookmark, field)
         if "datetime" in field.lower():
             return self._decode_datetime(value)
         return value
 
-    @staticmethod
-    def _update_tags(cursor: sqlite3.Cursor, bookmarks: List[Bookmark]) -> None:
-        for bookmark in bookmarks:
+    @classmethod
+    def _update_tags(cls, cursor: sqlite3.Cursor, bookmarks: List[Bookmark]) -> None:
+        """Replace the tags of the bookmarks, writing only the differences.
+
+        The current tags of all the bookmarks are read at once, and the links
+        to remove and to add are written in a batch each. The bookmarks not in
+        the database are skipped.
+        """
+        new_tags = {str(bookmark.id): set(bookmark.tags) for bookmark in bookmarks}
+        old_tags: Dict[str, Set[str]] = {}
+        bookmark_ids = list(new_tags)
+        for start in range(0, len(bookmark_ids), MAX_PARAMETERS):
+            chunk = bookmark_ids[start : start + MAX_PARAMETERS]
             cursor.execute(
-                "SELECT name FROM tag WHERE bookmarkId IS ?", (str(bookmark.id),),
+                """
+                SELECT b.id, t.name
+                FROM bookmark AS b
+                LEFT JOIN bookmark_tag AS bt ON bt.bookmarkId = b.id
+                LEFT JOIN tag AS t ON t.id = bt.tagId
+                WHERE b.id IN (%s)
+            """
+                % ",".join(["?"] * len(chunk)),
+                chunk,
             )
-            old_tags = cursor.fetchall()
-            if old_tags and {tag[0] for tag in old_tags} != set(bookmark.tags):
-                cursor.execute(
-                    "DELETE FROM tag WHERE bookmarkId IS ?", (str(bookmark.id),),
-                )
+            for bookmark_id, name in cursor.fetchall():
+                tags = old_tags.setdefault(bookmark_id, set())
+                if name is not None:
+                    tags.add(name)
 
-                cursor.executemany(
-                    "INSERT INTO tag (name, bookmarkId) VALUES (?, ?)",
-                    [(tag, str(bookmark.id)) for tag in bookmark.tags],
-                )
+        cursor.executemany(
+            """
+            DELETE FROM bookmark_tag
+            WHERE bookmarkId = ? AND tagId = (SELECT id FROM tag WHERE name = ?)
+        """,
+            [
+                (bookmark_id, name)
+                for bookmark_id, tags in old_tags.items()
+                for name in tags - new_tags[bookmark_id]
+            ],
+        )
+        cls._link_tags(
+            cursor,
+            [
+                (bookmark_id, name)
+                for bookmark_id, tags in old_tags.items()
+                for name in new_tags[bookmark_id] - tags
+            ],
+        )
+
+    @classmethod
+    def _insert_tags(cls, cursor: sqlite3.Cursor, bookmarks: List[Bookmark]) -> None:
+        cls._link_tags(
+            cursor,
+            [
+                (str(bookmark.id), tag)
+                for bookmark in bookmarks
+                for tag in bookmark.tags
+            ],
+        )
+
+    @staticmethod
+    def _link_tags(cursor: sqlite3.Cursor, links: List[Tuple[str, str]]) -> None:
+        """Link the (bookmark id, tag name) pairs, adding the new tag names."""
+        if not links:
+            return
+
+        cursor.executemany(
+            "INSERT OR IGNORE INTO tag (name) VALUES (?)",
+            [(tag,) for tag in {tag for _, tag in links}],
+        )
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO bookmark_tag (bookmarkId, tagId)
+            SELECT ?, id FROM tag WHERE name = ?
+        """,
+            links,
+        )
 
     def delete_bookmarks(self, bookmark_ids: List[UUID]) -> None:
-        with sqlite3.connect(self.database) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.executemany(
                 "DELETE FROM bookmark WHERE id = ?",
                 [(str(bookmark_id),) for bookmark_id in bookmark_ids],
             )
-        conn.close()
+
+    def add_visits(self, visits: Dict[UUID, Tuple[int, datetime]]) -> None:
+        with self._connect() as conn:
+            # Incremented in the database, so that no visit is lost to a
+            # concurrent update. The ISO dates compare as strings.
+            conn.executemany(
+                """
+                UPDATE bookmark SET
+                    visitCount = visitCount + ?,
+                    lastVisitDatetime = MAX(COALESCE(lastVisitDatetime, ''), ?)
+                WHERE id = ?
+            """,
+                [
+                    (count, self._decode_datetime(last_visit), str(bookmark_id))
+                    for bookmark_id, (count, last_visit) in visits.items()
+                ],
+            )
+
+    def get_validators(self, bookmark_ids: List[UUID]) -> Dict[UUID, Validator]:
+        if not bookmark_ids:
+            return {}
+
+        ids = list({str(bookmark_id) for bookmark_id in bookmark_ids})
+        records: List[Tuple[str, str, str]] = []
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(ids), MAX_PARAMETERS):
+                chunk = ids[start : start + MAX_PARAMETERS]
+                cursor.execute(
+                    "SELECT bookmarkId, etag, lastModified FROM validator "
+                    "WHERE bookmarkId IN (%s)" % ",".join(["?"] * len(chunk)),
+                    chunk,
+                )
+                records.extend(cursor)
+
+        return {
+            UUID(bookmark_id): Validator(etag=etag, lastModified=last_modified)
+            for bookmark_id, etag, last_modified in records
+        }
+
+    def update_validators(self, validators: Dict[UUID, Validator]) -> None:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                INSERT OR REPLACE INTO validator (bookmarkId, etag, lastModified)
+                SELECT id, ?, ? FROM bookmark WHERE id = ?
+            """,
+                [
+                    (validator.etag, validator.lastModified, str(bookmark_id))
+                    for bookmark_id, validator in validators.items()
+                ],
+            )
+
+    def add_check_results(self, results: List[CheckResult]) -> None:
+        with self._connect() as conn:
+            # A second check within the same second replaces the first.
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO check_result (
+                    bookmarkId, checkedAt, statusCode, responseMs, bytesRead,
+                    finalUrl
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            """,
+                [
+                    (
+                        str(result.bookmarkId),
+                        self._decode_timestamp(result.checkedDatetime),
+                        result.statusCode,
+                        result.responseMs,
+                        result.bytesRead,
+                        result.finalUrl or None,
+                    )
+                    for result in results
+                ],
+            )
+
+    def compact_check_results(self, before: datetime) -> int:
+        timestamp = self._decode_timestamp(before)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO check_summary (
+                    bookmarkId, day, nChecks, nFailures, sumResponseMs,
+                    maxResponseMs
+                )
+                SELECT
+                    bookmarkId,
+                    checkedAt / 86400,
+                    COUNT(*),
+                    SUM(statusCode NOT BETWEEN 200 AND 399),
+                    SUM(responseMs),
+                    MAX(responseMs)
+                FROM check_result
+                WHERE checkedAt < ?
+                GROUP BY bookmarkId, checkedAt / 86400
+                ON CONFLICT (bookmarkId, day) DO UPDATE SET
+                    nChecks = nChecks + excluded.nChecks,
+                    nFailures = nFailures + excluded.nFailures,
+                    sumResponseMs = sumResponseMs + excluded.sumResponseMs,
+                    maxResponseMs = MAX(maxResponseMs, excluded.maxResponseMs)
+            """,
+                (timestamp,),
+            )
+            cursor = conn.execute(
+                "DELETE FROM check_result WHERE checkedAt < ?", (timestamp,)
+            )
+        return cursor.rowcount
+
+    def get_response_times(
+        self, start: datetime, end: datetime, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        query = """
+            SELECT bookmarkId, responseMs FROM check_result
+            WHERE checkedAt >= ? AND checkedAt < ? %s
+            ORDER BY bookmarkId, responseMs
+        """
+        window: List[Any] = [
+            self._decode_timestamp(start),
+            self._decode_timestamp(end),
+        ]
+        # The ids are bound in chunks, along with the window. Each bookmark is
+        # in one chunk, so its response times stay sorted.
+        chunks: List[List[str]] = [[]]
+        if bookmark_ids:
+            ids = list({str(bookmark_id) for bookmark_id in bookmark_ids})
+            size = MAX_PARAMETERS - len(window)
+            chunks = [ids[start : start + size] for start in range(0, len(ids), size)]
+
+        records: List[Tuple[str, int]] = []
+        with self._connect() as conn:
+            for chunk in chunks:
+                condition = (
+                    "AND bookmarkId IN (%s)" % ",".join(["?"] * len(chunk))
+                    if chunk
+                    else ""
+                )
+                records.extend(conn.execute(query % condition, window + chunk))
+
+        response_times: Dict[UUID, List[int]] = {}
+        for bookmark_id, response_ms in records:
+            response_times.setdefault(UUID(bookmark_id), []).append(response_ms)
+        return response_times
+
+    def get_statuses(
+        self, limit: int, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        # The checks of each bookmark are adjacent in the primary key, latest
+        # last, so the window reads only the last ones.
+        query = """
+            SELECT bookmarkId, statusCode FROM (
+                SELECT bookmarkId, statusCode, ROW_NUMBER() OVER (
+                    PARTITION BY bookmarkId ORDER BY checkedAt DESC
+                ) AS n
+                FROM check_result %s
+            )
+            WHERE n <= ?
+            ORDER BY bookmarkId, n
+        """
+        chunks: List[List[str]] = [[]]
+        if bookmark_ids:
+            ids = list({str(bookmark_id) for bookmark_id in bookmark_ids})
+            size = MAX_PARAMETERS - 1
+            chunks = [ids[start : start + size] for start in range(0, len(ids), size)]
+
+        records: List[Tuple[str, int]] = []
+        with self._connect() as conn:
+            for chunk in chunks:
+                condition = (
+                    "WHERE bookmarkId IN (%s)" % ",".join(["?"] * len(chunk))
+                    if chunk
+                    else ""
+                )
+                records.extend(conn.execute(query % condition, chunk + [limit]))
+
+        statuses: Dict[UUID, List[int]] = {}
+        for bookmark_id, status_code in records:
+            statuses.setdefault(UUID(bookmark_id), []).append(status_code)
+        return statuses
+
+    def maintain(self, vacuum: bool = False) -> MaintenanceReport:
+        with self._connect() as conn:
+            report = MaintenanceReport(
+                pageSize=conn.execute("PRAGMA page_size").fetchone()[0],
+                queryMsBefore=self._time_listing(conn),
+            )
+
+            # The links to the tags are deleted along with the bookmarks, but
+            # the tags themselves are left behind.
+            report.orphanTags = conn.execute(
+                """
+                DELETE FROM tag WHERE NOT EXISTS (
+                    SELECT 1 FROM bookmark_tag WHERE tagId = tag.id
+                )
+            """
+            ).rowcount
+            conn.commit()
+
+            # The pages reclaimed are counted around the vacuum step only, as
+            # ANALYZE may then add pages for its statistics.
+            n_pages = conn.execute("PRAGMA page_count").fetchone()[0]
+            if vacuum:
+                self._vacuum(conn)
+            else:
+                # Each step of the pragma returns one page, and `execute` only
+                # runs the first step of a statement without result columns,
+                # where `executescript` runs it to completion. Unless the
+                # database was created (or vacuumed) with auto_vacuum =
+                # INCREMENTAL, no page is returned.
+                conn.executescript("PRAGMA incremental_vacuum")
+            report.reclaimedPages = max(
+                n_pages - conn.execute("PRAGMA page_count").fetchone()[0], 0
+            )
+
+            # The analysis is limited to a sample of the rows of each index.
+            conn.execute("PRAGMA analysis_limit = %i" % self.ANALYSIS_LIMIT)
+            conn.execute("ANALYZE")
+
+            report.freePages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            report.queryMsAfter = self._time_listing(conn)
+
+        # The other connections only load the new statistics when opened, so
+        # the idle ones are closed (and reopened on demand).
+        self.close()
+        return report
+
+    def _vacuum(self, conn: sqlite3.Connection) -> None:
+        """Rewrite the database, switching it to incremental vacuum (as set
+        on every connection).
+
+        VACUUM may renumber the rowids of the bookmarks, so the search index
+        is rebuilt after it.
+        """
+        conn.execute("VACUUM")
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM bookmark_fts")
+        conn.execute(
+            """
+            INSERT INTO bookmark_fts (rowid, url, title, description, tags)
+            SELECT
+                b.rowid,
+                b.url,
+                b.title,
+                b.description,
+                (
+                    SELECT GROUP_CONCAT(t.name, ' ')
+                    FROM bookmark_tag AS bt
+                    JOIN tag AS t ON t.id = bt.tagId
+                    WHERE bt.bookmarkId = b.id
+                )
+            FROM bookmark AS b
+        """
+        )
+        conn.commit()
+
+    def _time_listing(self, conn: sqlite3.Connection) -> float:
+        """Time the listing of all the bookmarks, in milliseconds.
+
+        The best of TIMING_RUNS runs is taken, so that the first run reading
+        the pages from the disk does not count.
+        """
+        query = self._make_select_query(None, TAG_DENOMINATOR)
+        timings = []
+        for _ in range(self.TIMING_RUNS):
+            start = perf_counter()
+            conn.execute(*query).fetchall()
+            timings.append((perf_counter() - start) * 1000)
+        return min(timings)
+
+
+class Memory(Database):
+    """In-memory database management, persisted in a journal.
+
+    The whole collection is kept in memory, indexed by id, by url, by tag, and
+    by the words of the bookmarks for the search. So reads never access
+    the disk, which suits deployments where reads far outnumber writes.
+
+    Every write is appended to the journal (the file `path` + "-journal") as
+    one entry, synced to the disk before it is applied, so that a write
+    returned survives a crash of the system. The writes that change nothing
+    are not journaled. Once the
+    journal has `compaction_entries` entries, the whole state is written to
+    the snapshot (the file `path`), and the journal is emptied. On opening,
+    the snapshot is read, and the entries of the journal after it are applied
+    again. A torn entry at the end of the journal (as left by a crash in the
+    middle of a write) is dropped.
+    """
+
+    # The weights of the fields in the ranking of the search, as bm25 weighs
+    # the columns of the search index of SQLite.
+    SEARCH_WEIGHTS = {"url": 1, "title": 10, "description": 2, "tags": 5}
+    # The unit of the sizes in the maintenance report.
+    PAGE_SIZE = mmap.PAGESIZE
+    # The number of runs of the listing timed by the maintenance.
+    TIMING_RUNS = 3
+
+    def __init__(self, path: str, compaction_entries: int = 10000) -> None:
+        self.path = path
+        self.journal_path = path + "-journal"
+        self.compaction_entries = compaction_entries
+        self._lock = RLock()
+        self._bookmarks: Dict[UUID, BookmarkRecord] = {}
+        self._urls: Dict[str, UUID] = {}
+        # The ids of the bookmarks by tag. A tag is dropped along with its last
+        # bookmark, so no tag is ever left orphan.
+        self._tags: Dict[str, Set[UUID]] = {}
+        self._words: Dict[str, Dict[UUID, int]] = {}
+        self._vocabulary: Optional[List[str]] = None
+        self._tag_sets: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        self._sorted: Dict[str, Tuple[List[Tuple[Any, ...]], List[BookmarkRecord]]] = {}
+        # The latest version of each changed bookmark, and whether deleted, in
+        # the order of the versions.
+        self._changes: Dict[UUID, Tuple[int, bool]] = {}
+        self._version = 0
+        self._validators: Dict[UUID, Validator] = {}
+        # The checks of each bookmark by the timestamp, and the daily
+        # summaries of each bookmark by the day, as in the SQLite tables.
+        self._check_results: Dict[UUID, Dict[int, Tuple[Any, ...]]] = {}
+        self._check_summaries: Dict[UUID, Dict[int, List[int]]] = {}
+        self._sequence = 0
+        self._n_entries = 0
+        self._recover()
+        self._journal: BinaryIO = open(self.journal_path, "ab")
+        super().__init__()
+
+    def close(self) -> None:
+        """Close the journal."""
+        with self._lock:
+            self._journal.close()
+
+    def _get_applied_versions(self) -> Set[int]:
+        # The SQL migration scripts do not apply to the records in memory.
+        return {
+            get_migration_version(script)
+            for script in self.MIGRATION_DIR.glob("*.sql")
+        }
+
+    def _apply_migrations(self, scripts: List[Path]) -> None:
+        pass
+
+    def _recover(self) -> None:
+        """Read the snapshot, and apply the journal entries written after it."""
+        if Path(self.path).exists():
+            with open(self.path, "rb") as snapshot:
+                self._load(orjson.loads(snapshot.read()))
+        if not Path(self.journal_path).exists():
+            return
+
+        with open(self.journal_path, "rb+") as journal:
+            offset = 0
+            for line in journal:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Incomplete entry")
+                    sequence, operation, payload = orjson.loads(line)
+                except ValueError:
+                    logging.warning(
+                        "Dropped a torn entry at byte %i of %s",
+                        offset,
+                        self.journal_path,
+                    )
+                    journal.truncate(offset)
+                    break
+                offset += len(line)
+                if sequence <= self._sequence:
+                    continue
+                self._apply(sequence, operation, payload)
+
+    def _write(self, operation: str, payload: Any) -> Any:
+        """Append the entry to the journal, and apply it.
+
+        Returns what the operation returns.
+        """
+        sequence = self._sequence + 1
+        self._journal.write(
+            orjson.dumps(
+                [sequence, operation, payload], option=orjson.OPT_APPEND_NEWLINE
+            )
+        )
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        result = self._apply(sequence, operation, payload)
+        if self._n_entries >= self.compaction_entries:
+            self._compact()
+        return result
+
+    def _apply(self, sequence: int, operation: str, payload: Any) -> Any:
+        self._sequence = sequence
+        self._n_entries += 1
+        return getattr(self, "_apply_" + operation)(payload)
+
+    def _compact(self) -> None:
+        """Write the whole state to the snapshot, and empty the journal.
+
+        The snapshot is written aside and renamed over the previous one, so
+        that a crash leaves either snapshot whole. The journal is emptied
+        after, and the entries left in it by a crash in between are skipped
+        on recovery, by their sequence numbers.
+        """
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as snapshot:
+            snapshot.write(orjson.dumps(self._dump()))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary, self.path)
+        self._journal.truncate(0)
+        self._n_entries = 0
+        # The tag sets no longer used are dropped.
+        self._tag_sets = {
+            bookmark.tags: bookmark.tags for bookmark in self._bookmarks.values()
+        }
+
+    def _dump(self) -> Dict[str, Any]:
+        return {
+            "sequence": self._sequence,
+            "version": self._version,
+            "bookmarks": [
+                self._encode_record(bookmark) for bookmark in self._bookmarks.values()
+            ],
+            "changes": [
+                [str(bookmark_id), version, deleted]
+                for bookmark_id, (version, deleted) in self._changes.items()
+            ],
+            "validators": [
+                [str(bookmark_id), validator.etag, validator.lastModified]
+                for bookmark_id, validator in self._validators.items()
+            ],
+            "checkResults": [
+                [str(bookmark_id), checked_at] + list(result)
+                for bookmark_id, results in self._check_results.items()
+                for checked_at, result in results.items()
+            ],
+            "checkSummaries": [
+                [str(bookmark_id), day] + summary
+                for bookmark_id, summaries in self._check_summaries.items()
+                for day, summary in summaries.items()
+            ],
+        }
+
+    def _load(self, state: Dict[str, Any]) -> None:
+        self._apply_add(state["bookmarks"])
+        self._changes = {
+            UUID(bookmark_id): (version, deleted)
+            for bookmark_id, version, deleted in state["changes"]
+        }
+        self._version = state["version"]
+        self._apply_validate(state["validators"])
+        self._apply_check(state["checkResults"])
+        for bookmark_id, day, *summary in state["checkSummaries"]:
+            self._check_summaries.setdefault(UUID(bookmark_id), {})[day] = summary
+        self._sequence = state["sequence"]
+
+    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[BookmarkRecord]:
+        with self._lock:
+            if not bookmark_ids:
+                return list(self._bookmarks.values())
+            return [
+                self._bookmarks[bookmark_id]
+                for bookmark_id in dict.fromkeys(bookmark_ids)
+                if bookmark_id in self._bookmarks
+            ]
+
+    def query_bookmarks(self, query: BookmarkQuery) -> List[BookmarkRecord]:
+        with self._lock:
+            keys, bookmarks = self._get_sorted(query.sort_field)
+            start, end = 0, len(bookmarks)
+            if query.after is not None:
+                after = self._bookmarks.get(query.after)
+                if after is None:
+                    return []
+                key = self._get_sort_key(after, query.sort_field)
+                if query.descending:
+                    end = bisect_left(keys, key)
+                else:
+                    start = bisect_right(keys, key)
+            if query.limit is not None:
+                if query.descending:
+                    start = max(start, end - query.limit)
+                else:
+                    end = min(end, start + query.limit)
+            page = bookmarks[start:end]
+
+        if query.descending:
+            page.reverse()
+        if query.fields:
+            fields = query.fields
+            return [
+                BookmarkRecord(**{field: getattr(bookmark, field) for field in fields})
+                for bookmark in page
+            ]
+        return page
+
+    def _get_sorted(
+        self, field: str
+    ) -> Tuple[List[Tuple[Any, ...]], List[BookmarkRecord]]:
+        """Sort the bookmarks by the field and the id, or reuse the order,
+        kept sorted through the writes since."""
+        if field not in self._sorted:
+            pairs = sorted(
+                (self._get_sort_key(bookmark, field), bookmark)
+                for bookmark in self._bookmarks.values()
+            )
+            self._sorted[field] = (
+                [key for key, _ in pairs],
+                [bookmark for _, bookmark in pairs],
+            )
+        return self._sorted[field]
+
+    def _get_sort_key(self, bookmark: BookmarkRecord, field: str) -> Tuple[Any, ...]:
+        """Make the key to sort by, comparing as in SQLite.
+
+        The ids (and the datetimes) are compared as stored in SQLite, in text.
+        """
+        if field == "id":
+            return (str(bookmark.id),)
+        return (self._encode_value(field, getattr(bookmark, field)), str(bookmark.id))
+
+    def get_bookmarks_json(self, query: Optional[BookmarkQuery] = None) -> bytes:
+        if query is None:
+            bookmarks = self.get_bookmarks()
+        else:
+            bookmarks = self.query_bookmarks(query)
+        if query is None or query.fields is None:
+            return orjson.dumps([dict(bookmark) for bookmark in bookmarks])
+        fields = query.fields
+        return orjson.dumps(
+            [
+                {field: getattr(bookmark, field) for field in fields}
+                for bookmark in bookmarks
+            ]
+        )
+
+    def iter_bookmarks(self) -> Iterator[BookmarkRecord]:
+        # The records are never modified, so a copy of the list is a snapshot.
+        yield from self.get_bookmarks()
+
+    def add_bookmarks(
+        self, bookmarks: List[Bookmark], skip_existing: bool = False
+    ) -> List[Bookmark]:
+        with self._lock:
+            if skip_existing:
+                urls = set(self._urls)
+                added = []
+                for bookmark in bookmarks:
+                    if bookmark.url not in urls:
+                        urls.add(bookmark.url)
+                        added.append(bookmark)
+                bookmarks = added
+            self._check_unique(bookmarks, check_ids=True)
+            if not bookmarks:
+                return bookmarks
+            self._write(
+                "add",
+                [
+                    [
+                        self._encode_value(field, getattr(bookmark, field))
+                        for field in BookmarkRecord.FIELDS
+                    ]
+                    for bookmark in bookmarks
+                ],
+            )
+        return bookmarks
+
+    def _check_unique(self, bookmarks: List[Bookmark], check_ids: bool) -> None:
+        """Check the ids (if `check_ids`) and the urls are not taken by the
+        other bookmarks, as the constraints of the SQLite tables do.
+
+        The same error as SQLite is raised, so that the callers handle both
+        backends alike.
+        """
+        ids: Set[Optional[UUID]] = set()
+        urls: Set[str] = set()
+        for bookmark in bookmarks:
+            if check_ids and (bookmark.id in self._bookmarks or bookmark.id in ids):
+                raise sqlite3.IntegrityError(
+                    "UNIQUE constraint failed: bookmark.id (%s)" % bookmark.id
+                )
+            owner = self._urls.get(bookmark.url, bookmark.id)
+            if bookmark.url in urls or owner != bookmark.id:
+                raise sqlite3.IntegrityError(
+                    "UNIQUE constraint failed: bookmark.url (%s)" % bookmark.url
+                )
+            ids.add(bookmark.id)
+            urls.add(bookmark.url)
+
+    def update_bookmarks(
+        self, bookmarks: List[Bookmark], fields: List[str]
+    ) -> List[BookmarkRecord]:
+        with self._lock:
+            # As in SQLite, the last update of a bookmark wins.
+            bookmarks = list(
+                {
+                    bookmark.id: bookmark
+                    for bookmark in bookmarks
+                    if bookmark.id in self._bookmarks
+                }.values()
+            )
+            if "url" in fields:
+                self._check_unique(bookmarks, check_ids=False)
+            if not bookmarks:
+                return []
+            return self._write(
+                "update",
+                [
+                    list(fields),
+                    [
+                        [str(bookmark.id)]
+                        + [
+                            self._encode_value(field, getattr(bookmark, field))
+                            for field in fields
+                        ]
+                        for bookmark in bookmarks
+                    ],
+                ],
+            )
+
+    def delete_bookmarks(self, bookmark_ids: List[UUID]) -> None:
+        with self._lock:
+            payload = [
+                str(bookmark_id)
+                for bookmark_id in dict.fromkeys(bookmark_ids)
+                if bookmark_id in self._bookmarks
+            ]
+            if payload:
+                self._write("delete", payload)
+
+    def add_visits(self, visits: Dict[UUID, Tuple[int, datetime]]) -> None:
+        with self._lock:
+            payload = [
+                [str(bookmark_id), count, self._decode_datetime(last_visit)]
+                for bookmark_id, (count, last_visit) in visits.items()
+                if bookmark_id in self._bookmarks
+            ]
+            if payload:
+                self._write("visit", payload)
+
+    def get_changes(self, since: int) -> BookmarkChanges:
+        with self._lock:
+            bookmarks: List[BookmarkRecord] = []
+            deleted: List[UUID] = []
+            # The latest changes are the last ones.
+            for bookmark_id in reversed(list(self._changes)):
+                version, is_deleted = self._changes[bookmark_id]
+                if version <= since:
+                    break
+                if is_deleted:
+                    deleted.append(bookmark_id)
+                else:
+                    bookmarks.append(self._bookmarks[bookmark_id])
+            version = self._version
+
+        return BookmarkChanges(
+            version=version, bookmarks=bookmarks[::-1], deleted=deleted[::-1]
+        )
+
+    def search_bookmarks(self, query: str, limit: int) -> List[BookmarkRecord]:
+        prefixes = self._split_words(" ".join(SEARCH_TOKEN.findall(query)))
+        if not prefixes:
+            return []
+
+        with self._lock:
+            scores: Optional[Dict[UUID, int]] = None
+            for prefix in prefixes:
+                weights = self._match_prefix(prefix)
+                scores = (
+                    weights
+                    if scores is None
+                    else {
+                        bookmark_id: score + weights[bookmark_id]
+                        for bookmark_id, score in scores.items()
+                        if bookmark_id in weights
+                    }
+                )
+            assert scores is not None
+            # The UUIDs compare as their text does, as the ids in SQLite.
+            ranked = heapq.nsmallest(
+                limit if limit >= 0 else len(scores),
+                scores.items(),
+                key=lambda item: (-item[1], item[0]),
+            )
+            return [self._bookmarks[bookmark_id] for bookmark_id, _ in ranked]
+
+    def _match_prefix(self, prefix: str) -> Dict[UUID, int]:
+        """Score the bookmarks with a word starting with the prefix, by the
+        weight of the best field holding such a word.
+
+        The words starting with the prefix are adjacent in the sorted
+        vocabulary, which is sorted again only after words are added or
+        removed.
+        """
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._words)
+        vocabulary = self._vocabulary
+        weights: Dict[UUID, int] = {}
+        index = bisect_left(vocabulary, prefix)
+        while index < len(vocabulary) and vocabulary[index].startswith(prefix):
+            for bookmark_id, weight in self._words[vocabulary[index]].items():
+                if weights.get(bookmark_id, 0) < weight:
+                    weights[bookmark_id] = weight
+            index += 1
+        return weights
+
+    @staticmethod
+    def _get_search_text(bookmark: BookmarkRecord, field: str) -> str:
+        if field == "tags":
+            return " ".join(bookmark.tags)
+        return getattr(bookmark, field)
+
+    @staticmethod
+    def _split_words(text: str) -> List[str]:
+        """Split the text into words, as the unicode61 tokenizer of SQLite
+        does, with the diacritics removed."""
+        if text.isascii():
+            return SEARCH_WORD.findall(text.lower())
+        decomposed = unicodedata.normalize("NFKD", text.lower())
+        return SEARCH_WORD.findall(
+            "".join(char for char in decomposed if not unicodedata.combining(char))
+        )
+
+    def get_validators(self, bookmark_ids: List[UUID]) -> Dict[UUID, Validator]:
+        with self._lock:
+            return {
+                bookmark_id: self._validators[bookmark_id]
+                for bookmark_id in bookmark_ids
+                if bookmark_id in self._validators
+            }
+
+    def update_validators(self, validators: Dict[UUID, Validator]) -> None:
+        with self._lock:
+            payload = [
+                [str(bookmark_id), validator.etag, validator.lastModified]
+                for bookmark_id, validator in validators.items()
+                if bookmark_id in self._bookmarks
+            ]
+            if payload:
+                self._write("validate", payload)
+
+    def add_check_results(self, results: List[CheckResult]) -> None:
+        with self._lock:
+            payload = [
+                [
+                    str(result.bookmarkId),
+                    self._decode_timestamp(result.checkedDatetime),
+                    result.statusCode,
+                    result.responseMs,
+                    result.bytesRead,
+                    result.finalUrl or None,
+                ]
+                for result in results
+                if result.bookmarkId in self._bookmarks
+            ]
+            if payload:
+                self._write("check", payload)
+
+    def compact_check_results(self, before: datetime) -> int:
+        timestamp = self._decode_timestamp(before)
+        with self._lock:
+            if not any(
+                checked_at < timestamp
+                for results in self._check_results.values()
+                for checked_at in results
+            ):
+                return 0
+            return self._write("compact", timestamp)
+
+    def get_response_times(
+        self, start: datetime, end: datetime, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        start_timestamp = self._decode_timestamp(start)
+        end_timestamp = self._decode_timestamp(end)
+        response_times: Dict[UUID, List[int]] = {}
+        with self._lock:
+            for bookmark_id in bookmark_ids or list(self._check_results):
+                results = self._check_results.get(bookmark_id, {})
+                times = sorted(
+                    response_ms
+                    for checked_at, (_, response_ms, _, _) in results.items()
+                    if start_timestamp <= checked_at < end_timestamp
+                )
+                if times:
+                    response_times[bookmark_id] = times
+        return response_times
+
+    def get_statuses(
+        self, limit: int, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        statuses: Dict[UUID, List[int]] = {}
+        with self._lock:
+            for bookmark_id in bookmark_ids or list(self._check_results):
+                results = self._check_results.get(bookmark_id, {})
+                latest = heapq.nlargest(limit, results)
+                if latest:
+                    statuses[bookmark_id] = [
+                        results[checked_at][0] for checked_at in latest
+                    ]
+        return statuses
+
+    def maintain(self, vacuum: bool = False) -> MaintenanceReport:
+        # The index of the tags drops each tag with its last bookmark, so there
+        # are no orphans to purge, and the journal is compacted into the snapshot, with or without
+        # `vacuum`.
+        with self._lock:
+            size = self._get_file_size()
+            report = MaintenanceReport(
+                pageSize=self.PAGE_SIZE, queryMsBefore=self._time_listing()
+            )
+            self._compact()
+            report.reclaimedPages = max(
+                (size - self._get_file_size()) // self.PAGE_SIZE, 0
+            )
+            report.queryMsAfter = self._time_listing()
+        return report
+
+    def _get_file_size(self) -> int:
+        return sum(
+            os.path.getsize(path)
+            for path in (self.path, self.journal_path)
+            if os.path.exists(path)
+        )
+
+    def _time_listing(self) -> float:
+        """Time the listing of all the bookmarks, in milliseconds."""
+        timings = []
+        for _ in range(self.TIMING_RUNS):
+            start = perf_counter()
+            self.get_bookmarks()
+            timings.append((perf_counter() - start) * 1000)
+        return min(timings)
+
+    # The journal entries are applied by the methods below, both when written
+    # and when recovered. The entries hold the ids in text, and the datetimes
+    # in the ISO format, as in SQLite. The ids of the bookmarks no longer
+    # stored are skipped, so that an entry applies however it was written.
+
+    def _apply_add(self, payload: List[List[Any]]) -> None:
+        for values in payload:
+            self._put(self._decode_record(values))
+
+    def _apply_update(self, payload: List[Any]) -> List[BookmarkRecord]:
+        fields, updates = payload
+        updated: Dict[UUID, BookmarkRecord] = {}
+        for bookmark_id, *values in updates:
+            previous = self._bookmarks.get(UUID(bookmark_id))
+            if previous is None:
+                continue
+            encoded = self._encode_record(previous)
+            for field, value in zip(fields, values):
+                encoded[BookmarkRecord.FIELDS.index(field)] = value
+            bookmark = self._decode_record(encoded)
+            self._remove(previous)
+            self._put(bookmark)
+            updated[UUID(bookmark_id)] = bookmark
+        return [self._bookmarks[bookmark_id] for bookmark_id in updated]
+
+    def _apply_delete(self, payload: List[str]) -> None:
+        for text in payload:
+            bookmark_id = UUID(text)
+            bookmark = self._bookmarks.get(bookmark_id)
+            if bookmark is None:
+                continue
+            self._remove(bookmark)
+            self._log_change(bookmark_id, deleted=True)
+            self._validators.pop(bookmark_id, None)
+            self._check_results.pop(bookmark_id, None)
+            self._check_summaries.pop(bookmark_id, None)
+
+    def _apply_visit(self, payload: List[List[Any]]) -> None:
+        for bookmark_id, count, last_visit in payload:
+            previous = self._bookmarks.get(UUID(bookmark_id))
+            if previous is None:
+                continue
+            encoded = self._encode_record(previous)
+            encoded[LAST_VISIT] = max(encoded[LAST_VISIT], last_visit)
+            encoded[VISIT_COUNT] += count
+            self._remove(previous)
+            self._put(self._decode_record(encoded))
+
+    def _apply_validate(self, payload: List[List[str]]) -> None:
+        for bookmark_id, etag, last_modified in payload:
+            self._validators[UUID(bookmark_id)] = Validator(
+                etag=etag, lastModified=last_modified
+            )
+
+    def _apply_check(self, payload: List[List[Any]]) -> None:
+        for bookmark_id, checked_at, *result in payload:
+            self._check_results.setdefault(UUID(bookmark_id), {})[checked_at] = tuple(
+                result
+            )
+
+    def _apply_compact(self, payload: int) -> int:
+        n_compacted = 0
+        for bookmark_id, results in self._check_results.items():
+            for checked_at in [c for c in results if c < payload]:
+                status_code, response_ms, _, _ = results.pop(checked_at)
+                summary = self._check_summaries.setdefault(bookmark_id, {}).setdefault(
+                    checked_at // 86400, [0, 0, 0, 0]
+                )
+                summary[0] += 1
+                summary[1] += not 200 <= status_code <= 399
+                summary[2] += response_ms
+                summary[3] = max(summary[3], response_ms)
+                n_compacted += 1
+        return n_compacted
+
+    def _put(self, bookmark: BookmarkRecord) -> None:
+        """Store the bookmark, index it, and log it as changed."""
+        assert bookmark.id is not None
+        self._bookmarks[bookmark.id] = bookmark
+        self._urls[bookmark.url] = bookmark.id
+        for tag in bookmark.tags:
+            self._tags.setdefault(tag, set()).add(bookmark.id)
+        for word, weight in self._get_words(bookmark).items():
+            if word not in self._words:
+                self._words[word] = {}
+                self._vocabulary = None
+            self._words[word][bookmark.id] = weight
+        for field, (keys, bookmarks) in self._sorted.items():
+            key = self._get_sort_key(bookmark, field)
+            index = bisect_left(keys, key)
+            keys.insert(index, key)
+            bookmarks.insert(index, bookmark)
+        self._log_change(bookmark.id, deleted=False)
+
+    def _remove(self, bookmark: BookmarkRecord) -> None:
+        """Remove the bookmark, and drop it from the indexes."""
+        assert bookmark.id is not None
+        del self._bookmarks[bookmark.id]
+        del self._urls[bookmark.url]
+        for tag in bookmark.tags:
+            self._tags[tag].discard(bookmark.id)
+            if not self._tags[tag]:
+                del self._tags[tag]
+        for word in self._get_words(bookmark):
+            del self._words[word][bookmark.id]
+            if not self._words[word]:
+                del self._words[word]
+                self._vocabulary = None
+        for field, (keys, bookmarks) in self._sorted.items():
+            index = bisect_left(keys, self._get_sort_key(bookmark, field))
+            del keys[index]
+            del bookmarks[index]
+
+    def _get_words(self, bookmark: BookmarkRecord) -> Dict[str, int]:
+        """Map the words of the bookmark to the weight of the best field
+        holding each."""
+        words: Dict[str, int] = {}
+        for field, weight in self.SEARCH_WEIGHTS.items():
+            for word in self._split_words(self._get_search_text(bookmark, field)):
+                if words.get(word, 0) < weight:
+                    words[word] = weight
+        return words
+
+    def _log_change(self, bookmark_id: UUID, deleted: bool) -> None:
+        # Moved to the end, so that the changes stay in the order of versions.
+        self._changes.pop(bookmark_id, None)
+        self._version += 1
+        self._changes[bookmark_id] = (self._version, deleted)
+
+    def _encode_record(self, bookmark: BookmarkRecord) -> List[Any]:
+        return [self._encode_value(field, value) for field, value in bookmark]
+
+    def _decode_record(self, values: List[Any]) -> BookmarkRecord:
+        """Make the record of the values as encoded.
+
+        The records with the same tags share one tuple of interned tags, and
+        the datetimes are left in the ISO format, as read from SQLite.
+        """
+        values = list(values)
+        values[ID] = UUID(values[ID])
+        tags = tuple(sorted(intern(tag) for tag in values[TAGS]))
+        values[TAGS] = self._tag_sets.setdefault(tags, tags)
+        return BookmarkRecord(*values)
+
+    @classmethod
+    def _encode_value(cls, field: str, value: Any) -> Any:
+        if field == "id":
+            return str(value)
+        if field == "tags":
+            return sorted(set(value))
+        if "datetime" in field.lower():
+            return cls._decode_datetime(value)
+        return value
+
+    @staticmethod
+    def _decode_datetime(value: Optional[datetime]) -> str:
+        if value is None:
+            return ""
+        return value.isoformat()
+
+    @staticmethod
+    def _decode_timestamp(value: datetime) -> int:
+        return int(value.timestamp())
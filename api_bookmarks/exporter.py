@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.exporter.
+
+This module writes the bookmarks out as an export: JSON Lines (a bookmark per
+line), or a Netscape bookmark file, which the browsers (and the importer) read
+back. The bookmarks are encoded as they are iterated, and the output is
+yielded in chunks of about CHUNK_SIZE bytes, so that the memory in use does
+not grow with the number of bookmarks.
+"""
+
+from html import escape
+from typing import Callable
+from typing import Dict
+from typing import Generator
+from typing import Iterable
+from typing import List
+from typing import Tuple
+import zlib
+
+import orjson
+
+from api_bookmarks.model import BookmarkRecord
+from api_bookmarks.model import DEFAULT_TAGS
+
+
+CHUNK_SIZE = 64 * 1024
+
+NETSCAPE_HEADER = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>Bookmarks</H1>
+<DL><p>
+"""
+NETSCAPE_FOOTER = "</DL><p>\n"
+
+Encoder = Callable[[Iterable[BookmarkRecord]], Generator[bytes, None, None]]
+
+
+def to_jsonl(bookmarks: Iterable[BookmarkRecord]) -> Generator[bytes, None, None]:
+    """Encode the bookmarks as JSON Lines."""
+    return _buffer(
+        orjson.dumps(dict(bookmark), option=orjson.OPT_APPEND_NEWLINE)
+        for bookmark in bookmarks
+    )
+
+
+def to_html(bookmarks: Iterable[BookmarkRecord]) -> Generator[bytes, None, None]:
+    """Encode the bookmarks as a Netscape bookmark file.
+
+    The bookmarks are listed in a single folder, with their tags in the TAGS
+    attribute (as Firefox writes them), and their descriptions in <DD>.
+    """
+
+    def lines() -> Generator[bytes, None, None]:
+        yield NETSCAPE_HEADER.encode()
+        for bookmark in bookmarks:
+            yield _format_netscape(bookmark).encode()
+        yield NETSCAPE_FOOTER.encode()
+
+    return _buffer(lines())
+
+
+def compress(chunks: Iterable[bytes]) -> Generator[bytes, None, None]:
+    """Compress the chunks with gzip, as they are iterated."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+# The media type and the encoder of each format.
+FORMATS: Dict[str, Tuple[str, Encoder]] = {
+    "jsonl": ("application/x-ndjson", to_jsonl),
+    "html": ("text/html; charset=utf-8", to_html),
+}
+
+
+def _format_netscape(bookmark: BookmarkRecord) -> str:
+    attributes = ' HREF="%s"' % escape(bookmark.url)
+    if bookmark.lastVisitDatetime is not None:
+        attributes += ' LAST_VISIT="%i"' % bookmark.lastVisitDatetime.timestamp()
+    tags = [tag for tag in bookmark.tags if tag not in DEFAULT_TAGS]
+    if tags:
+        attributes += ' TAGS="%s"' % escape(",".join(tags))
+    line = "    <DT><A%s>%s</A>\n" % (attributes, escape(bookmark.title, quote=False))
+    if bookmark.description:
+        line += "    <DD>%s\n" % escape(bookmark.description, quote=False)
+    return line
+
+
+def _buffer(pieces: Iterable[bytes]) -> Generator[bytes, None, None]:
+    """Join the pieces into chunks of at least CHUNK_SIZE bytes."""
+    buffer: List[bytes] = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
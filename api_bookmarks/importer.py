@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.importer.
+
+This module reads the bookmarks exported from a browser: the Netscape
+bookmark file (as exported to HTML by Firefox and Chrome), Firefox's JSON
+backup, and Chrome's Bookmarks file (JSON). The export is read a chunk at a
+time, and the bookmarks are yielded as soon as they are read, so that the
+memory in use does not grow with the size of the export.
+
+The folders of a bookmark become its tags. The root folders (the toolbar,
+the menu, "Other bookmarks" and so on) are left out.
+"""
+
+from abc import ABC
+from abc import abstractmethod
+from html import unescape
+from typing import Dict
+from typing import IO
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+import codecs
+import json
+import re
+
+from api_bookmarks.model import Bookmark
+
+
+CHUNK_SIZE = 64 * 1024
+# Only the sites that can be checked are imported, and not, for example, the
+# "place:" queries of Firefox or the bookmarklets.
+SCHEMES = ("http", "https")
+# The attributes which mark the root folders in a Netscape bookmark file.
+ROOT_FOLDER_ATTRIBUTES = ("personal_toolbar_folder", "unfiled_bookmarks_folder")
+
+NETSCAPE_TAG = re.compile(
+    r"""<(/?)([a-zA-Z][a-zA-Z0-9]*)((?:[^>"']|"[^"]*"|'[^']*')*)>"""
+)
+NETSCAPE_ATTRIBUTE = re.compile(
+    r"""([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?"""
+)
+# A string, a punctuation, any other literal, or the quote of an unfinished
+# string.
+JSON_TOKEN = re.compile(
+    r"""\s*(?:("[^"\\]*(?:\\.[^"\\]*)*")|([{}\[\]:,])|([^\s{}\[\]:,"]+)|("))"""
+)
+# The fields of the JSON nodes used for the bookmarks. The other fields are
+# skipped. Chrome names the nodes with "name", and Firefox with "title".
+JSON_FIELDS = {"name", "title", "url", "uri", "root", "tags"}
+
+
+def read_bookmarks(
+    stream: IO[bytes], chunk_size: int = CHUNK_SIZE
+) -> Iterator[Bookmark]:
+    """Read the bookmarks from an export, a chunk at a time.
+
+    The export is JSON if it starts with "{" or "[", and a Netscape bookmark
+    file otherwise. It is decoded as UTF-8, as the browsers write it.
+    Malformed JSON raises ValueError, possibly after some bookmarks are read.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parser: Optional[BookmarkParser] = None
+    while True:
+        chunk = stream.read(chunk_size)
+        text = decoder.decode(chunk, final=not chunk)
+        if parser is None:
+            text = text.lstrip("\ufeff \t\r\n")
+            if not text and chunk:
+                continue
+            parser = JsonParser() if text[:1] in ("{", "[") else NetscapeParser()
+        yield from parser.feed(text)
+        if not chunk:
+            break
+    yield from parser.close()
+
+
+class BookmarkParser(ABC):
+    """Incremental parser of an export.
+
+    Feed the export as text in chunks, and each call returns the bookmarks
+    completed by the chunk. Close the parser at the end of the export, for
+    the rest of the bookmarks.
+    """
+
+    @abstractmethod
+    def feed(self, text: str) -> List[Bookmark]:
+        """Parse the next chunk of the export."""
+
+    @abstractmethod
+    def close(self) -> List[Bookmark]:
+        """Parse whatever remains of the export."""
+
+
+class NetscapeParser(BookmarkParser):
+    """Parser of the Netscape bookmark file.
+
+    A folder is a <DT><H3> followed by a <DL> of its entries, and a bookmark
+    is a <DT><A HREF>, optionally followed by a <DD> with its description.
+    The TAGS attribute (written by Firefox) adds to the tags of the folders.
+
+    The file is scanned for its tags with a regular expression, rather than
+    tokenized as HTML, as only a handful of elements matter. A tag cut by the
+    end of a chunk is held until the next chunk.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._done: List[Bookmark] = []
+        # The names of the open folders, None for a root folder.
+        self._folders: List[Optional[str]] = []
+        self._next_folder: Optional[str] = None
+        self._is_root = False
+        # The element whose text is being collected: "h3", "a" or "dd".
+        self._element = ""
+        self._text: List[str] = []
+        self._href = ""
+        self._tags: List[str] = []
+        # The last bookmark, until its description (if any) ends.
+        self._bookmark: Optional[Bookmark] = None
+
+    def feed(self, text: str) -> List[Bookmark]:
+        self._buffer += text
+        self._scan(final=False)
+        return self._pop_bookmarks()
+
+    def close(self) -> List[Bookmark]:
+        self._scan(final=True)
+        self._finish_bookmark()
+        return self._pop_bookmarks()
+
+    def _pop_bookmarks(self) -> List[Bookmark]:
+        bookmarks, self._done = self._done, []
+        return bookmarks
+
+    def _scan(self, final: bool) -> None:
+        buffer = self._buffer
+        position = 0
+        for match in NETSCAPE_TAG.finditer(buffer):
+            if self._element:
+                self._text.append(buffer[position : match.start()])
+            position = match.end()
+            closing, name, attributes = match.groups()
+            if closing:
+                self._handle_endtag(name.lower())
+            else:
+                self._handle_starttag(name.lower(), attributes)
+
+        end = len(buffer) if final else max(buffer.rfind("<", position), position)
+        if self._element:
+            self._text.append(buffer[position:end])
+        self._buffer = buffer[end:]
+
+    def _handle_starttag(self, tag: str, attributes: str) -> None:
+        if tag in ("dt", "dl", "h3", "a"):
+            self._finish_bookmark()
+
+        if tag == "h3":
+            self._start_text("h3")
+            self._is_root = any(
+                name.lower() in ROOT_FOLDER_ATTRIBUTES
+                for name, _ in _parse_attributes(attributes)
+            )
+        elif tag == "dl":
+            self._folders.append(self._next_folder)
+            self._next_folder = None
+        elif tag == "a":
+            self._start_text("a")
+            self._href, self._tags = "", []
+            for name, value in _parse_attributes(attributes):
+                if name.lower() == "href":
+                    self._href = value
+                elif name.lower() == "tags":
+                    self._tags = _split_tags(value)
+        elif tag == "dd" and self._bookmark is not None:
+            self._start_text("dd")
+
+    def _handle_endtag(self, tag: str) -> None:
+        if tag == "h3" and self._element == "h3":
+            name = self._end_text()
+            self._next_folder = None if self._is_root else name or None
+        elif tag == "a" and self._element == "a":
+            title = self._end_text()
+            if _is_checkable(self._href):
+                folders = [folder for folder in reversed(self._folders) if folder]
+                self._bookmark = Bookmark(
+                    url=self._href, title=title, tags=self._tags + folders
+                )
+        elif tag == "dl":
+            self._finish_bookmark()
+            if self._folders:
+                self._folders.pop()
+
+    def _start_text(self, element: str) -> None:
+        self._element = element
+        self._text = []
+
+    def _end_text(self) -> str:
+        # Unescaped once joined, as an entity may be cut by a chunk boundary.
+        text = " ".join(unescape("".join(self._text)).split())
+        self._element = ""
+        self._text = []
+        return text
+
+    def _finish_bookmark(self) -> None:
+        if self._bookmark is None:
+            return
+        if self._element == "dd":
+            self._bookmark.description = self._end_text()
+        self._bookmark.tags = _dedupe_tags(self._bookmark.tags)
+        self._done.append(self._bookmark)
+        self._bookmark = None
+
+
+class JsonParser(BookmarkParser):
+    """Parser of the JSON exports of Firefox and Chrome.
+
+    Both are trees of nodes, where a folder has "children" and a bookmark has
+    "uri" (Firefox) or "url" (Chrome). The JSON is tokenized as it arrives,
+    and only the fields in JSON_FIELDS are kept, while a node is open.
+
+    Chrome writes the name of a folder after its children. So the bookmarks
+    in a Chrome folder are held until the folder ends, and only then yielded
+    with their tags. The bookmarks in a Firefox folder are yielded right
+    away.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._stack: List[_JsonNode] = []
+        self._after_key = False
+        self._done: List[Bookmark] = []
+        self._n_roots = 0
+
+    def feed(self, text: str) -> List[Bookmark]:
+        self._buffer += text
+        self._tokenize(final=False)
+        return self._pop_bookmarks()
+
+    def close(self) -> List[Bookmark]:
+        self._tokenize(final=True)
+        if self._buffer.strip() or self._stack or not self._n_roots:
+            raise ValueError("The JSON export ends unexpectedly")
+        return self._pop_bookmarks()
+
+    def _pop_bookmarks(self) -> List[Bookmark]:
+        bookmarks, self._done = self._done, []
+        return bookmarks
+
+    def _tokenize(self, final: bool) -> None:
+        buffer = self._buffer
+        position = 0
+        for match in JSON_TOKEN.finditer(buffer):
+            string, punctuation, literal, quote = match.groups()
+            # A token at the end of the chunk may continue in the next one,
+            # and so may a string without its closing quote.
+            if quote is not None or (match.end() == len(buffer) and not final):
+                break
+            position = match.end()
+            if punctuation == ",":
+                # A new key is told by its position, after "{" or ",".
+                continue
+            if punctuation is not None:
+                self._handle_punctuation(punctuation)
+            elif string is not None:
+                self._handle_string(string)
+            elif not self._stack:
+                raise ValueError("Unexpected %r in the JSON export" % literal[:20])
+            else:
+                self._after_key = False
+        self._buffer = buffer[position:]
+        if final and self._buffer.strip():
+            raise ValueError("Invalid JSON at %r" % self._buffer[:20])
+
+    def _handle_punctuation(self, punctuation: str) -> None:
+        if punctuation in "{[":
+            parent = self._stack[-1] if self._stack else None
+            if parent is None and self._n_roots:
+                raise ValueError("More than one JSON value in the export")
+            self._stack.append(
+                _JsonNode(
+                    is_object=punctuation == "{",
+                    key=parent.key if parent is not None else None,
+                    in_children=(
+                        parent is not None
+                        and not parent.is_object
+                        and parent.key == "children"
+                    ),
+                )
+            )
+            self._after_key = False
+        elif punctuation in "}]":
+            if not self._stack or self._stack[-1].is_object != (punctuation == "}"):
+                raise ValueError("Unbalanced %r in the JSON export" % punctuation)
+            node = self._stack.pop()
+            if node.is_object:
+                self._end_object(node)
+            if not self._stack:
+                self._n_roots += 1
+        else:
+            self._after_key = True
+
+    def _handle_string(self, token: str) -> None:
+        if not self._stack:
+            raise ValueError("Unexpected %r in the JSON export" % token[:20])
+        node = self._stack[-1]
+        if not node.is_object:
+            return
+        if not self._after_key:
+            node.key = _decode_string(token)
+            return
+        self._after_key = False
+        if node.key in JSON_FIELDS:
+            node.fields[node.key] = _decode_string(token)
+
+    def _end_object(self, node: "_JsonNode") -> None:
+        url = node.fields.get("url", node.fields.get("uri", ""))
+        if url:
+            if _is_checkable(url):
+                bookmark = Bookmark(
+                    url=url,
+                    title=node.fields.get("title", node.fields.get("name", "")),
+                    tags=_split_tags(node.fields.get("tags", "")),
+                )
+                self._dispatch(bookmark, len(self._stack))
+            return
+
+        for bookmark in node.pending:
+            if node.in_children and "root" not in node.fields and node.name:
+                bookmark.tags.append(node.name)
+            self._dispatch(bookmark, len(self._stack))
+
+    def _dispatch(self, bookmark: Bookmark, depth: int) -> None:
+        """Tag the bookmark with the folders below `depth` in the stack.
+
+        When a folder is not named yet, the bookmark is held by the folder.
+        """
+        for node in reversed(self._stack[:depth]):
+            if not node.is_object or not node.in_children or "root" in node.fields:
+                continue
+            if "name" not in node.fields and "title" not in node.fields:
+                node.pending.append(bookmark)
+                return
+            if node.name:
+                bookmark.tags.append(node.name)
+        bookmark.tags = _dedupe_tags(bookmark.tags)
+        self._done.append(bookmark)
+
+
+class _JsonNode:
+    """Open object or array in the JSON export."""
+
+    __slots__ = ("is_object", "key", "in_children", "fields", "pending")
+
+    def __init__(self, is_object: bool, key: Optional[str], in_children: bool) -> None:
+        self.is_object = is_object
+        # The current key of an object, and the key of the array in its parent.
+        self.key = key
+        self.in_children = in_children
+        self.fields: Dict[str, str] = {}
+        self.pending: List[Bookmark] = []
+
+    @property
+    def name(self) -> str:
+        """Name of the folder, or an empty string if not read yet."""
+        return self.fields.get("title", self.fields.get("name", ""))
+
+
+def _parse_attributes(attributes: str) -> Iterator[Tuple[str, str]]:
+    for match in NETSCAPE_ATTRIBUTE.finditer(attributes):
+        name, double_quoted, single_quoted, unquoted = match.groups()
+        value = next(
+            (v for v in (double_quoted, single_quoted, unquoted) if v is not None), ""
+        )
+        yield name, unescape(value)
+
+
+def _decode_string(token: str) -> str:
+    return json.loads(token) if "\\" in token else token[1:-1]
+
+
+def _is_checkable(url: str) -> bool:
+    return url.partition(":")[0].lower() in SCHEMES
+
+
+def _split_tags(tags: str) -> List[str]:
+    return [tag.strip() for tag in tags.split(",") if tag.strip()]
+
+
+def _dedupe_tags(tags: List[str]) -> List[str]:
+    return list(dict.fromkeys(tags))
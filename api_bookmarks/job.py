@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.job.
+
+This module runs the link checks in the background. A check is submitted as a
+job, which is queued for an in-process pool of workers, and its id is returned
+right away. The workers check the bookmarks in batches, and each batch is
+published as events, which can be followed while the job runs.
+"""
+
+from asyncio import AbstractEventLoop
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from threading import Lock
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from uuid import UUID
+from uuid import uuid4
+import asyncio
+import logging
+
+from api_bookmarks.model import Bookmark
+from api_bookmarks.model import BookmarkParameterCheck
+from api_bookmarks.model import BookmarkRecord
+from api_bookmarks.model import Job
+from api_bookmarks.service import Service
+
+
+FINISHED = ("done", "cancelled", "failed")
+
+
+class JobQueue:
+    """In-process queue of link checks.
+
+    Up to `workers` jobs run at a time, each checking its bookmarks through
+    `service` in batches of `batch_size`. A job is cancelled between batches.
+    The `max_finished` most recently finished jobs are kept, so that their
+    results can still be followed.
+
+    A URL is checked by one job at a time: when a job is submitted, the
+    bookmarks whose URLs are still pending in another job are skipped.
+    """
+
+    def __init__(
+        self,
+        service: Service,
+        workers: int = 1,
+        batch_size: int = 16,
+        max_finished: int = 16,
+    ) -> None:
+        self.service = service
+        self.batch_size = batch_size
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="job"
+        )
+        self._tasks: Dict[UUID, _Task] = {}
+        self._pending_urls: Dict[str, UUID] = {}
+        self._lock = Lock()
+
+    def close(self) -> None:
+        """Cancel the jobs, and wait for the running ones to stop."""
+        with self._lock:
+            tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancelled.set()
+        self._executor.shutdown()
+
+    def submit(self, parameters: List[BookmarkParameterCheck]) -> Job:
+        """Queue the link checks, and return the job right away."""
+        job_id = uuid4()
+        with self._lock:
+            accepted = []
+            for parameter in parameters:
+                if parameter.url not in self._pending_urls:
+                    self._pending_urls[parameter.url] = job_id
+                    accepted.append(parameter)
+            task = _Task(
+                Job(
+                    id=job_id,
+                    total=len(accepted),
+                    skipped=len(parameters) - len(accepted),
+                ),
+                accepted,
+            )
+            self._tasks[job_id] = task
+            self._drop_finished()
+
+        self._executor.submit(self._run, task)
+        return task.get_job()
+
+    def get(self, job_id: UUID) -> Optional[Job]:
+        """Retrieve the current state of the job, or None if unknown."""
+        task = self._tasks.get(job_id)
+        return task.get_job() if task is not None else None
+
+    def cancel(self, job_id: UUID) -> Optional[Job]:
+        """Cancel the job, or None if unknown.
+
+        A pending job does not start, and a running job stops after the batch
+        in progress. The bookmarks already checked stay updated.
+        """
+        task = self._tasks.get(job_id)
+        if task is None:
+            return None
+
+        task.cancelled.set()
+        return task.get_job()
+
+    async def follow(self, job_id: UUID) -> AsyncIterator[Tuple[str, str]]:
+        """Follow the events of the job, from the first one until the end.
+
+        Each event is a pair of its name and its JSON data: "result" with a
+        checked bookmark, "progress" with the job after each batch, and "end"
+        with the finished job. Nothing is yielded if the job is unknown.
+        """
+        task = self._tasks.get(job_id)
+        if task is None:
+            return
+
+        loop = asyncio.get_event_loop()
+        wakeup = asyncio.Event()
+        task.subscribe(loop, wakeup)
+        try:
+            index = 0
+            while True:
+                # Cleared before reading, so that the events published after
+                # reading wake this up again.
+                wakeup.clear()
+                events, finished = task.read_events(index)
+                for event in events:
+                    yield event
+                index += len(events)
+                if finished:
+                    return
+                await wakeup.wait()
+        finally:
+            task.unsubscribe(wakeup)
+
+    def _run(self, task: "_Task") -> None:
+        try:
+            if not task.cancelled.is_set():
+                task.start()
+            for start in range(0, len(task.parameters), self.batch_size):
+                if task.cancelled.is_set():
+                    break
+                batch = task.parameters[start : start + self.batch_size]
+                bookmarks = self.service.check_bookmarks(batch)
+                self._release([parameter.url for parameter in batch])
+                task.publish_results(bookmarks)
+            task.finish("cancelled" if task.cancelled.is_set() else "done")
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Job %s failed", task.job.id)
+            task.finish("failed")
+        finally:
+            self._release([parameter.url for parameter in task.parameters])
+
+    def _release(self, urls: List[str]) -> None:
+        with self._lock:
+            for url in urls:
+                self._pending_urls.pop(url, None)
+
+    def _drop_finished(self) -> None:
+        finished = [
+            job_id
+            for job_id, task in self._tasks.items()
+            if task.job.status in FINISHED
+        ]
+        for job_id in finished[: max(len(finished) - self.max_finished, 0)]:
+            del self._tasks[job_id]
+
+
+class _Task:
+    """A job, together with its bookmarks to check and its events."""
+
+    def __init__(self, job: Job, parameters: List[BookmarkParameterCheck]) -> None:
+        self.job = job
+        self.parameters = parameters
+        self.cancelled = Event()
+        self._events: List[Tuple[str, str]] = []
+        self._subscribers: List[Tuple[AbstractEventLoop, asyncio.Event]] = []
+        self._lock = Lock()
+
+    def get_job(self) -> Job:
+        with self._lock:
+            return self.job.copy()
+
+    def start(self) -> None:
+        with self._lock:
+            self.job = self.job.copy(update={"status": "running"})
+            self._events.append(("progress", self.job.json()))
+        self._notify()
+
+    def publish_results(self, bookmarks: List[BookmarkRecord]) -> None:
+        with self._lock:
+            self.job = self.job.copy(
+                update={"completed": self.job.completed + len(bookmarks)}
+            )
+            self._events += [
+                ("result", Bookmark.from_orm(bookmark).json()) for bookmark in bookmarks
+            ]
+            self._events.append(("progress", self.job.json()))
+        self._notify()
+
+    def finish(self, status: str) -> None:
+        with self._lock:
+            self.job = self.job.copy(update={"status": status})
+            self._events.append(("end", self.job.json()))
+        self._notify()
+
+    def read_events(self, index: int) -> Tuple[List[Tuple[str, str]], bool]:
+        """Read the events from `index`, and whether the job has finished."""
+        with self._lock:
+            return self._events[index:], self.job.status in FINISHED
+
+    def subscribe(self, loop: AbstractEventLoop, wakeup: asyncio.Event) -> None:
+        with self._lock:
+            self._subscribers.append((loop, wakeup))
+
+    def unsubscribe(self, wakeup: asyncio.Event) -> None:
+        with self._lock:
+            self._subscribers = [
+                subscriber
+                for subscriber in self._subscribers
+                if subscriber[1] != wakeup
+            ]
+
+    def _notify(self) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, wakeup in subscribers:
+            loop.call_soon_threadsafe(wakeup.set)
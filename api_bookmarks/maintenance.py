@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.maintenance.
+
+This module maintains the database in the background, while the app is idle:
+the tags no bookmark has any more are purged, the statistics of the query
+planner are refreshed, and the unused pages are returned to the file system.
+"""
+
+from datetime import datetime
+from datetime import timedelta
+from threading import Event
+from threading import Thread
+from typing import Callable
+from typing import Optional
+import logging
+
+from api_bookmarks.model import MaintenanceReport
+from api_bookmarks.service import Service
+
+
+class Maintainer:
+    """Background database maintenance.
+
+    Every `tick_seconds`, the database is maintained through `service`, if it
+    was last maintained at least `interval` ago, and the collection was not
+    written to since the previous tick. So the maintenance waits for a quiet
+    moment, rather than competing with the writes.
+    """
+
+    def __init__(
+        self,
+        service: Service,
+        interval: timedelta = timedelta(days=1),
+        tick_seconds: float = 300,
+        clock: Callable[[], datetime] = datetime.now,
+    ) -> None:
+        self.service = service
+        self.interval = interval
+        self.tick_seconds = tick_seconds
+        self.clock = clock
+        self._revision: Optional[str] = None
+        self._maintained: Optional[datetime] = None
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        """Start maintaining in a background thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = Thread(target=self._loop, name="maintainer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop maintaining, and wait for the maintenance in progress."""
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def tick(self) -> Optional[MaintenanceReport]:
+        """Maintain the database, if idle and due.
+
+        Returns the report of the maintenance, or None if not maintained.
+        """
+        revision = self.service.get_revision()
+        idle, self._revision = revision == self._revision, revision
+        now = self.clock()
+        if not idle or (
+            self._maintained is not None and now - self._maintained < self.interval
+        ):
+            return None
+
+        report = self.service.maintain()
+        self._maintained = now
+        return report
+
+    def _loop(self) -> None:
+        while not self._stopped.wait(self.tick_seconds):
+            try:
+                report = self.tick()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Database maintenance failed")
+                continue
+            if report is not None:
+                logging.info(
+                    "Maintained the database: purged %i tag(s), reclaimed %i "
+                    "page(s), listing in %.1f ms (from %.1f ms)",
+                    report.orphanTags,
+                    report.reclaimedPages,
+                    report.queryMsAfter,
+                    report.queryMsBefore,
+                )
@@ -4,14 +4,29 @@
 """api_bookmarks.model."""
 
 from datetime import datetime
+from typing import Any
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Tuple
+from typing import Union
 from uuid import UUID
 
 from pydantic import BaseModel  # pylint: disable=no-name-in-module
+from pydantic import validator
 
 
 DEFAULT_TAGS = ["*unassigned"]
+# The fields the bookmarks can be sorted by, each backed by an index.
+SORT_FIELDS = [
+    "id",
+    "url",
+    "title",
+    "visitCount",
+    "lastVisitDatetime",
+    "checkedDatetime",
+]
 
 
 class Bookmark(BaseModel):
@@ -31,6 +46,263 @@ class Bookmark(BaseModel):
     visitCount: int = 0
     statusCode: int = 0
 
+    class Config:
+        """Build from the attributes of any object, notably BookmarkRecord."""
+
+        orm_mode = True
+
+
+class BookmarkRecord:
+    """Bookmark as read from the database, in a compact form.
+
+    The records pass from the database through the service, and are held in
+    the cache of the service. A Bookmark is built from a record only at the
+    API edge, with Bookmark.from_orm. Unlike Bookmark, a record is not
+    validated when it is built. Its tags are a tuple (of interned strings, as
+    read from the database), and its datetimes are kept in the ISO format
+    until first read.
+
+    The records are shared, and must not be modified. `replace` makes a
+    modified copy.
+    """
+
+    FIELDS = tuple(Bookmark.__fields__)
+    __slots__ = (
+        "id",
+        "url",
+        "title",
+        "description",
+        "tags",
+        "_checkedDatetime",
+        "_lastVisitDatetime",
+        "visitCount",
+        "statusCode",
+    )
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        id: Optional[UUID] = None,  # pylint: disable=redefined-builtin
+        url: str = "",
+        title: str = "",
+        description: str = "",
+        tags: Iterable[str] = DEFAULT_TAGS,
+        checkedDatetime: Union[datetime, str, None] = None,
+        lastVisitDatetime: Union[datetime, str, None] = None,
+        visitCount: int = 0,
+        statusCode: int = 0,
+    ) -> None:
+        self.id = id
+        self.url = url
+        self.title = title
+        self.description = description
+        self.tags: Tuple[str, ...] = tuple(tags)
+        self._checkedDatetime = checkedDatetime
+        self._lastVisitDatetime = lastVisitDatetime
+        self.visitCount = visitCount
+        self.statusCode = statusCode
+
+    @classmethod
+    def from_bookmark(cls, bookmark: Bookmark) -> "BookmarkRecord":
+        """Make a record of the bookmark."""
+        return cls(**dict(bookmark))
+
+    @property
+    def checkedDatetime(self) -> Optional[datetime]:  # pylint: disable=invalid-name
+        """The datetime of the last check, decoded on the first read."""
+        if isinstance(self._checkedDatetime, str):
+            self._checkedDatetime = _decode_datetime(self._checkedDatetime)
+        return self._checkedDatetime
+
+    @property
+    def lastVisitDatetime(self) -> Optional[datetime]:  # pylint: disable=invalid-name
+        """The datetime of the last visit, decoded on the first read."""
+        if isinstance(self._lastVisitDatetime, str):
+            self._lastVisitDatetime = _decode_datetime(self._lastVisitDatetime)
+        return self._lastVisitDatetime
+
+    def replace(self, **changes: Any) -> "BookmarkRecord":
+        """Make a copy of the record, with the fields changed."""
+        return BookmarkRecord(**{**dict(self), **changes})
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        """Iterate over the fields and their values, as a Bookmark does."""
+        for field in self.FIELDS:
+            yield field, getattr(self, field)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, BookmarkRecord):
+            return NotImplemented
+        return dict(self) == dict(other)
+
+    def __repr__(self) -> str:
+        return "BookmarkRecord(%s)" % ", ".join(
+            "%s=%r" % (field, value) for field, value in self
+        )
+
+
+def _decode_datetime(value: str) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+class BookmarkChanges(BaseModel):
+    """Changes to the bookmarks since a version.
+
+    `bookmarks` are the inserted or updated bookmarks, and `deleted` are the
+    ids of the deleted bookmarks. `version` is the version to request the
+    next changes since.
+    """
+
+    version: int
+    bookmarks: List[Bookmark] = []
+    deleted: List[UUID] = []
+
+
+class BookmarkQuery(BaseModel):
+    """Query for a page of bookmarks.
+
+    The bookmarks are sorted by `sort`, which is one of SORT_FIELDS, prefixed
+    by "-" for the descending order. Ties are broken by the id. The page
+    starts after the bookmark with the id `after` (typically the last
+    bookmark of the previous page), and has at most `limit` bookmarks.
+
+    Only the listed `fields` are retrieved, and the id is always retrieved.
+    All the fields are retrieved if `fields` is None.
+    """
+
+    limit: Optional[int] = None
+    after: Optional[UUID] = None
+    sort: str = "id"
+    fields: Optional[List[str]] = None
+
+    @validator("limit")
+    def check_limit(cls, value):  # pylint: disable=no-self-argument,no-self-use
+        """Check the limit is positive."""
+        if value is not None and value <= 0:
+            raise ValueError("limit must be positive")
+        return value
+
+    @validator("sort")
+    def check_sort(cls, value):  # pylint: disable=no-self-argument,no-self-use
+        """Check the bookmarks can be sorted by the field."""
+        if value.lstrip("-") not in SORT_FIELDS:
+            raise ValueError("sort must be one of %s" % ", ".join(SORT_FIELDS))
+        return value
+
+    @validator("fields")
+    def check_fields(cls, value):  # pylint: disable=no-self-argument,no-self-use
+        """Check the fields exist, and add the id."""
+        if value is None:
+            return None
+        unknown = [field for field in value if field not in Bookmark.__fields__]
+        if unknown:
+            raise ValueError("unknown fields: %s" % ", ".join(unknown))
+        return list(dict.fromkeys(["id"] + value))
+
+    @property
+    def sort_field(self) -> str:
+        """The field to sort by, without the direction."""
+        return self.sort.lstrip("-")
+
+    @property
+    def descending(self) -> bool:
+        """Whether to sort in the descending order."""
+        return self.sort.startswith("-")
+
+
+class Job(BaseModel):
+    """Link checks running in the background.
+
+    `status` is one of "pending", "running", "done", "cancelled" and "failed".
+    `total` is the number of bookmarks to check, and `completed` is the number
+    checked so far. `skipped` is the number of bookmarks not checked by this
+    job, as their URLs were already pending in another job.
+    """
+
+    id: UUID
+    status: str = "pending"
+    total: int = 0
+    completed: int = 0
+    skipped: int = 0
+
+
+class ImportReport(BaseModel):
+    """Outcome of a bulk import.
+
+    `added` is the number of bookmarks inserted, and `skipped` is the number
+    of bookmarks not inserted, as their urls were already in the collection
+    (or earlier in the import).
+    """
+
+    added: int = 0
+    skipped: int = 0
+
+
+class MaintenanceReport(BaseModel):
+    """Outcome of a maintenance of the database.
+
+    `orphanTags` is the number of tags purged, as no bookmark had them any
+    more. `reclaimedPages` is the number of pages (of `pageSize` bytes)
+    returned to the file system, and `freePages` the number of pages left
+    unused in the file. `queryMsBefore` and `queryMsAfter` are the times taken
+    to list all the bookmarks, before and after the maintenance.
+    """
+
+    orphanTags: int = 0
+    reclaimedPages: int = 0
+    freePages: int = 0
+    pageSize: int = 0
+    queryMsBefore: float = 0.0
+    queryMsAfter: float = 0.0
+
+
+class CheckResult(BaseModel):
+    """Outcome of a link check.
+
+    `responseMs` is the time until the response headers arrived, and
+    `bytesRead` is the size of the body read to find the title. `finalUrl` is
+    the URL after redirects, or an empty string if not redirected.
+    """
+
+    bookmarkId: Optional[UUID] = None
+    checkedDatetime: datetime
+    statusCode: int
+    responseMs: int
+    bytesRead: int = 0
+    finalUrl: str = ""
+
+
+class LatencyPercentiles(BaseModel):
+    """Percentiles of the response times in milliseconds.
+
+    `bookmarkId` is None for the percentiles over all the bookmarks.
+    """
+
+    bookmarkId: Optional[UUID] = None
+    nChecks: int
+    p50: int
+    p90: int
+    p99: int
+    max: int
+
+
+class LatencyReport(BaseModel):
+    """Response times of the link checks in a time window."""
+
+    start: datetime
+    end: datetime
+    overall: Optional[LatencyPercentiles] = None
+    bookmarks: List[LatencyPercentiles] = []
+
+
+class Validator(BaseModel):
+    """Validators of the bookmarked resource, for conditional requests.
+
+    Empty strings mean the server did not send the validator.
+    """
+
+    etag: str = ""
+    lastModified: str = ""
+
 
 class BookmarkParameterAdd(BaseModel):
     """Parameter to add a new bookmark."""
@@ -60,8 +332,12 @@ class BookmarkParameterDelete(BaseModel):
 
 
 class BookmarkParameterVisit(BaseModel):
-    """Parameter to visit a bookmark."""
+    """Parameter to visit a bookmark.
+
+    The visit count and the datetime are ignored: the visit is counted by the
+    server, when received.
+    """
 
     id: UUID
-    visitCount: int
+    visitCount: int = 0
     lastVisitDatetime: Optional[datetime] = None
@@ -7,51 +7,220 @@
 # defined there, and so, disable unused-variable.
 """api_bookmarks.route."""
 
+from datetime import datetime
+from datetime import timedelta
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator
+from typing import Generator
+from typing import Iterable
 from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+from uuid import UUID
 
 from fastapi import APIRouter
+from fastapi import Header
+from fastapi import HTTPException
+from fastapi import Query
+from fastapi import Request
+from fastapi import Response
+from fastapi.responses import RedirectResponse
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from starlette.background import BackgroundTask
+from starlette.status import HTTP_302_FOUND
+from starlette.status import HTTP_202_ACCEPTED
+from starlette.status import HTTP_304_NOT_MODIFIED
+from starlette.status import HTTP_404_NOT_FOUND
+from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 
-from api_bookmarks.service import Service
+from api_bookmarks.exporter import Encoder
+from api_bookmarks.exporter import FORMATS
+from api_bookmarks.exporter import compress
+from api_bookmarks.importer import read_bookmarks
+from api_bookmarks.job import JobQueue
+from api_bookmarks.service import AsyncService
 from api_bookmarks.model import Bookmark
+from api_bookmarks.model import BookmarkChanges
 from api_bookmarks.model import BookmarkParameterAdd
 from api_bookmarks.model import BookmarkParameterCheck
 from api_bookmarks.model import BookmarkParameterDelete
 from api_bookmarks.model import BookmarkParameterEdit
 from api_bookmarks.model import BookmarkParameterVisit
+from api_bookmarks.model import BookmarkQuery
+from api_bookmarks.model import BookmarkRecord
+from api_bookmarks.model import ImportReport
+from api_bookmarks.model import Job
+from api_bookmarks.model import LatencyReport
 
+# The uploaded export is held in memory up to this size, and on disk beyond.
+SPOOL_BYTES = 1024 * 1024
 
-def Route(service: Service,) -> APIRouter:
+
+def Route(service: AsyncService, jobs: Optional[JobQueue] = None) -> APIRouter:
     """API route definitions.
 
     This is a function pretending to be a class, for the consistency with
     Service and Database modules.
+
+    The service is awaited, so that no blocking I/O runs on the event loop.
+    The link checks in the background are queued to `jobs`, which the caller
+    closes on shutdown, before the service. If not given, a new queue is made
+    in front of the service, and left to stop with the process.
     """
 
     router = APIRouter()
+    job_queue = jobs if jobs is not None else JobQueue(service.service)
+
+    @router.get(
+        "/api/v1/bookmarks",
+        response_model=Union[List[Bookmark], BookmarkChanges],  # type: ignore
+    )
+    async def get_bookmarks(  # pylint: disable=too-many-arguments
+        since: int = None,
+        limit: int = None,
+        after: UUID = None,
+        sort: str = None,
+        fields: str = None,
+        if_none_match: str = Header(None),
+    ):
+        """Retrieve all the bookmarks from the database.
+
+        The response carries an ETag, and if the client already has the
+        current bookmarks (If-None-Match), 304 is returned without a body.
+
+        If `since` is given, only the changes after that version are retrieved,
+        including the ids of the deleted bookmarks, together with the version
+        to request the next changes since. Request since zero to start.
+
+        The bookmarks can be retrieved a page at a time: at most `limit`
+        bookmarks, sorted by `sort` (e.g., "title" or "-visitCount" for the
+        descending order), after the bookmark with the id `after` (the last
+        bookmark of the previous page). Only the comma-separated `fields`
+        (e.g., "url,title") are retrieved, in addition to the id.
+        """
+        if since is not None:
+            changes = await service.get_changes(since)
+            return Response(content=changes.json(), media_type="application/json")
+
+        query = None
+        if any(parameter is not None for parameter in [limit, after, sort, fields]):
+            try:
+                query = BookmarkQuery(
+                    limit=limit,
+                    after=after,
+                    sort=sort if sort is not None else "id",
+                    fields=fields.split(",") if fields is not None else None,
+                )
+            except ValidationError as error:
+                raise HTTPException(
+                    status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail=error.errors()
+                )
+
+        # The revision is read before the bookmarks, so the bookmarks are at
+        # least as new as the ETag.
+        etag = '"%s"' % service.get_revision()
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if if_none_match is not None and _match_etag(etag, if_none_match):
+            return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+
+        # The service serializes the bookmarks (and may cache the result), so
+        # return the JSON as it is, bypassing the response model.
+        content = await service.get_bookmarks_json(query)
+        return Response(
+            content=content, media_type="application/json", headers=headers,
+        )
+
+    @router.get("/api/v1/bookmarks/search", response_model=List[Bookmark])
+    async def search_bookmarks(q: str, limit: int = Query(20, ge=1, le=100)):
+        """Search the bookmarks by the words in their url, title, description
+        and tags.
 
-    @router.get("/api/v1/bookmarks", response_model=List[Bookmark])
-    async def get_bookmarks():
-        """Retrieve all the bookmarks from the database."""
-        return service.get_bookmarks()
+        Each word matches as a prefix (e.g., "pyth" matches "Python"), and
+        every word must match. The best `limit` matches are returned, the best
+        first.
+        """
+        return await service.search_bookmarks(q, limit)
 
     @router.post("/api/v1/bookmarks", response_model=List[Bookmark])
     async def add_bookmarks(parameters: List[BookmarkParameterAdd]):
         """Add new bookmarks to the database."""
-        return service.add_bookmarks(parameters)
+        return await service.add_bookmarks(parameters)
+
+    @router.post("/api/v1/bookmarks/import", response_model=ImportReport)
+    async def import_bookmarks(request: Request):
+        """Import the bookmarks exported from a browser.
+
+        The body is a Netscape bookmark file (as exported to HTML by Firefox
+        and Chrome), a Firefox JSON backup or Chrome's Bookmarks file. The
+        folders become tags, and the bookmarks already in the collection are
+        skipped.
+
+        The sites are not fetched, so the import takes seconds even for many
+        thousands of bookmarks. The imported bookmarks are checked later, on
+        schedule.
+        """
+        with SpooledTemporaryFile(max_size=SPOOL_BYTES) as body:
+            async for chunk in request.stream():
+                body.write(chunk)
+            body.seek(0)
+            try:
+                return await service.import_bookmarks(read_bookmarks(body))
+            except ValueError as error:
+                raise HTTPException(
+                    status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail=str(error)
+                )
+
+    @router.get("/api/v1/bookmarks/export")
+    async def export_bookmarks(
+        export_format: str = Query("jsonl", alias="format", regex="^(jsonl|html)$"),
+        gzip: bool = False,
+    ):
+        """Export all the bookmarks, as JSON Lines or as a Netscape bookmark
+        file (which the browsers import).
+
+        The bookmarks are streamed from the database as they are sent, from one
+        snapshot of the collection. If `gzip` is true, the export is
+        gzip-compressed.
+        """
+        media_type, encode = FORMATS[export_format]
+        filename = "bookmarks.%s" % export_format
+        if gzip:
+            media_type = "application/gzip"
+            filename += ".gz"
+            encode = _compressed(encode)
+        return StreamingResponse(
+            service.export_bookmarks(encode),
+            media_type=media_type,
+            headers={"Content-Disposition": 'attachment; filename="%s"' % filename},
+        )
 
     @router.patch("/api/v1/bookmarks", response_model=List[Bookmark])
     async def update_bookmarks(parameters: List[BookmarkParameterEdit]):
         """Update Bookmarks' attributes."""
-        return service.update_bookmarks(parameters)
+        return await service.update_bookmarks(parameters)
 
     @router.put("/api/v1/bookmarks", response_model=List[Bookmark])
-    async def check_bookmarks(parameters: List[BookmarkParameterCheck]):
+    async def check_bookmarks(
+        parameters: List[BookmarkParameterCheck], background: bool = False
+    ):
         """Check if a request to the bookmarked site succeeds.
 
         Depending on the response, Bookmarks' attributes (status, url, title,
         etc) will be updated.
+
+        If `background` is true, the checks are queued as a job, and the job
+        is returned right away (202). Follow its results at
+        /api/v1/jobs/{id}/events.
         """
-        return service.check_bookmarks(parameters)
+        if background:
+            return Response(
+                content=job_queue.submit(parameters).json(),
+                media_type="application/json",
+                status_code=HTTP_202_ACCEPTED,
+            )
+        return await service.check_bookmarks(parameters)
 
     @router.delete("/api/v1/bookmarks")
     async def delete_bookmarks(parameters: List[BookmarkParameterDelete]):
@@ -59,11 +228,111 @@ def Route(service: Service,) -> APIRouter:
 
         Once deleted, a bookmark cannot be un-deleted.
         """
-        return service.delete_bookmarks(parameters)
+        return await service.delete_bookmarks(parameters)
 
     @router.patch("/api/v1/visit/bookmark", response_model=Bookmark)
     async def visit_bookmark(parameter: BookmarkParameterVisit):
         """Increment the visit count and update the last visit date."""
-        return service.visit_bookmark(parameter)
+        return await service.visit_bookmark(parameter)
+
+    @router.get("/go/{bookmark_id}", include_in_schema=False)
+    async def go_to_bookmark(bookmark_id: UUID):
+        """Redirect to the bookmarked site, and count the visit.
+
+        The visit is recorded after the redirect is sent, so opening a
+        bookmark takes a single request.
+        """
+        url = await service.get_url(bookmark_id)
+        if url is None:
+            raise HTTPException(
+                status_code=HTTP_404_NOT_FOUND, detail="Bookmark not found"
+            )
+        response = RedirectResponse(url, status_code=HTTP_302_FOUND)
+        response.background = BackgroundTask(
+            service.add_visits, {bookmark_id: (1, datetime.now())}
+        )
+        return response
+
+    @router.get("/api/v1/checks/latency", response_model=LatencyReport)
+    async def get_latency_report(
+        start: datetime = None,
+        end: datetime = None,
+        bookmark_ids: List[UUID] = Query(None, alias="id"),
+    ):
+        """Summarize the response times of the link checks in a time window.
+
+        The window is from `start` to `end`, and defaults to the last seven
+        days. The percentiles are given for each bookmark checked in the
+        window (or only for the bookmarks with the given `id`s), and over all of
+        them.
+        """
+        if end is None:
+            end = datetime.now()
+        if start is None:
+            start = end - timedelta(days=7)
+        return await service.get_latency_report(start, end, bookmark_ids)
+
+    @router.get("/api/v1/jobs/{job_id}", response_model=Job)
+    async def get_job(job_id: UUID):
+        """Retrieve the progress of the link checks in the background."""
+        return _found(job_queue.get(job_id))
+
+    @router.get("/api/v1/jobs/{job_id}/events")
+    async def follow_job(job_id: UUID):
+        """Stream the events of the job as Server-Sent Events.
+
+        The events are "result" with each checked bookmark, "progress" with
+        the job after each batch of checks, and "end" with the finished job,
+        after which the stream ends. The stream starts from the first event,
+        however late it is requested.
+        """
+        _found(job_queue.get(job_id))
+        return StreamingResponse(
+            _format_events(job_queue.follow(job_id)),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    @router.delete("/api/v1/jobs/{job_id}", response_model=Job)
+    async def cancel_job(job_id: UUID):
+        """Cancel the link checks in the background.
+
+        The bookmarks checked before the cancellation stay updated.
+        """
+        return _found(job_queue.cancel(job_id))
 
     return router
+
+
+def _found(job: Optional[Job]) -> Job:
+    if job is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+
+def _compressed(encode: Encoder) -> Encoder:
+    def encode_compressed(
+        bookmarks: Iterable[BookmarkRecord],
+    ) -> Generator[bytes, None, None]:
+        return compress(encode(bookmarks))
+
+    return encode_compressed
+
+
+async def _format_events(events: AsyncIterator[Tuple[str, str]]) -> AsyncIterator[str]:
+    """Format the events as Server-Sent Events."""
+    async for name, data in events:
+        yield "event: %s\ndata: %s\n\n" % (name, data)
+
+
+def _match_etag(etag: str, if_none_match: str) -> bool:
+    """Evaluate If-None-Match against the current ETag.
+
+    As specified for If-None-Match, the comparison is weak (i.e., "W/" prefix
+    is ignored).
+    """
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in [
+        candidate[2:] if candidate.startswith("W/") else candidate
+        for candidate in candidates
+    ]
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.scheduler.
+
+This module re-checks the bookmarks in the background. Each bookmark has its
+own interval between checks, which adapts to the outcome of the checks: the
+interval doubles while the status stays the same, and drops to the minimum
+when the status changes. So stable links are checked rarely, and flapping
+links often. The intervals are derived from the recorded history of the
+checks, so they carry over a restart.
+
+The checks are spread out over time, within a budget of concurrent checks
+and of bandwidth, instead of checking the whole collection at once.
+"""
+
+from datetime import datetime
+from datetime import timedelta
+from threading import Event
+from threading import Thread
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from uuid import UUID
+import logging
+
+from api_bookmarks.model import BookmarkParameterCheck
+from api_bookmarks.model import BookmarkRecord
+from api_bookmarks.service import Service
+
+
+class Scheduler:
+    """Background health checker.
+
+    Every `tick_seconds`, the bookmarks due for a check are checked through
+    `service`, the most overdue first. At most `concurrency` bookmarks are
+    checked at a time, and at most as many per tick as `bytes_per_second`
+    allows. No more than `bytes_per_check` bytes are read of each page, so
+    that the checks stay within the budget.
+
+    A bookmark is first checked again `stable_interval` after its last check
+    if its status is 200, and `min_interval` after otherwise. The interval
+    then doubles while the status stays the same, up to `max_interval` (or up
+    to `stable_interval`, while the link is failing), and drops back to
+    `min_interval` when the status changes. The intervals are varied by up to
+    ±10 % per bookmark, so that bookmarks added together do not stay due
+    together.
+
+    The interval of a bookmark first seen (e.g., after a restart) is replayed
+    from the status codes of its last checks, as recorded by the service:
+    doubled for each check in the latest run of the same status, from the
+    minimum if the run follows a change of status.
+
+    A bookmark whose check raises (rather than failing with a status code) is
+    taken as checked and failed at the time, so that it does not stay the
+    most overdue, ahead of all the others. Such a failure is not recorded by
+    the service, so it is retried once after a restart.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        service: Service,
+        concurrency: int = 2,
+        bytes_per_second: int = 64 * 1024,
+        bytes_per_check: int = 128 * 1024,
+        tick_seconds: float = 60,
+        min_interval: timedelta = timedelta(hours=1),
+        stable_interval: timedelta = timedelta(days=1),
+        max_interval: timedelta = timedelta(days=30),
+        clock: Callable[[], datetime] = datetime.now,
+    ) -> None:
+        if concurrency < 1 or bytes_per_second < 1 or bytes_per_check < 1:
+            raise ValueError("Budgets must be positive.")
+
+        self.service = service
+        self.concurrency = concurrency
+        self.bytes_per_check = bytes_per_check
+        self.checks_per_tick = max(
+            int(bytes_per_second * tick_seconds / bytes_per_check), 1
+        )
+        self.tick_seconds = tick_seconds
+        self.min_interval = min_interval
+        self.stable_interval = stable_interval
+        self.max_interval = max_interval
+        self.clock = clock
+        # The number of checks of the history to replay, beyond which the
+        # interval reaches its ceiling from any start.
+        self.history_checks = 2
+        while min_interval * 2 ** (self.history_checks - 2) < max_interval:
+            self.history_checks += 1
+        self._intervals: Dict[UUID, timedelta] = {}
+        self._failures: Dict[UUID, datetime] = {}
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        """Start checking in a background thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop checking, and wait for the checks in progress."""
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def tick(self) -> List[BookmarkRecord]:
+        """Check the bookmarks now due, within the budget of one tick.
+
+        Returns the checked bookmarks.
+        """
+        due = self.get_due(self.clock())[: self.checks_per_tick]
+        checked: List[BookmarkRecord] = []
+        for start in range(0, len(due), self.concurrency):
+            if self._stopped.is_set():
+                break
+            batch = due[start : start + self.concurrency]
+            # The bookmarks deleted meanwhile are not returned, so the results
+            # are matched by id.
+            previous = {bookmark.id: bookmark for bookmark in batch}
+            for result in self._check(batch):
+                assert result.id is not None
+                self._failures.pop(result.id, None)
+                self._adapt(previous[result.id], result)
+                checked.append(result)
+        return checked
+
+    def get_due(self, now: datetime) -> List[BookmarkRecord]:
+        """Retrieve the bookmarks due for a check, the most overdue first."""
+        bookmarks = self.service.get_bookmarks()
+        # Forget the intervals of the deleted bookmarks.
+        ids = {bookmark.id for bookmark in bookmarks}
+        for bookmark_id in [bid for bid in self._intervals if bid not in ids]:
+            del self._intervals[bookmark_id]
+        for bookmark_id in [bid for bid in self._failures if bid not in ids]:
+            del self._failures[bookmark_id]
+        self._replay(
+            [bookmark for bookmark in bookmarks if bookmark.id not in self._intervals]
+        )
+
+        due = [(self._get_due_datetime(bookmark), bookmark) for bookmark in bookmarks]
+        return [
+            bookmark
+            for due_datetime, bookmark in sorted(due, key=lambda pair: pair[0])
+            if due_datetime <= now
+        ]
+
+    def _check(self, batch: List[BookmarkRecord]) -> List[BookmarkRecord]:
+        """Check the batch, or else each bookmark on its own, to find the one
+        whose check raises."""
+        try:
+            return self.service.check_bookmarks(
+                [
+                    BookmarkParameterCheck(id=bookmark.id, url=bookmark.url)
+                    for bookmark in batch
+                ],
+                max_page_bytes=self.bytes_per_check,
+            )
+        except Exception:  # pylint: disable=broad-except
+            if len(batch) > 1:
+                return [
+                    result for bookmark in batch for result in self._check([bookmark])
+                ]
+            logging.exception("Scheduled check of %s failed", batch[0].url)
+
+        bookmark = batch[0]
+        assert bookmark.id is not None
+        now = self.clock()
+        self._failures[bookmark.id] = now
+        self._adapt(bookmark, bookmark.replace(statusCode=0, checkedDatetime=now))
+        return []
+
+    def _get_due_datetime(self, bookmark: BookmarkRecord) -> datetime:
+        checked = bookmark.checkedDatetime
+        failed = self._failures.get(bookmark.id) if bookmark.id is not None else None
+        if failed is not None and (checked is None or checked < failed):
+            checked = failed
+        if checked is None:
+            return datetime.min
+        interval = self._get_interval(bookmark) * self._jitter(bookmark.id)
+        return checked + interval
+
+    def _get_interval(self, bookmark: BookmarkRecord) -> timedelta:
+        assert bookmark.id is not None
+        if bookmark.id not in self._intervals:
+            self._intervals[bookmark.id] = self._get_first_interval(bookmark.statusCode)
+        return self._intervals[bookmark.id]
+
+    def _get_first_interval(self, status_code: int) -> timedelta:
+        return self.stable_interval if status_code == 200 else self.min_interval
+
+    def _replay(self, bookmarks: List[BookmarkRecord]) -> None:
+        """Derive the intervals of the bookmarks from their last checks."""
+        if not bookmarks:
+            return
+        history = self.service.get_statuses(
+            self.history_checks, [bookmark.id for bookmark in bookmarks]  # type: ignore
+        )
+        for bookmark in bookmarks:
+            assert bookmark.id is not None
+            # Without any check recorded, the status of the bookmark is taken.
+            statuses = history.get(bookmark.id) or [bookmark.statusCode]
+            status_code = statuses[0]
+            run = 1
+            while run < len(statuses) and statuses[run] == status_code:
+                run += 1
+            if run < len(statuses):
+                interval = self.min_interval
+            else:
+                interval = self._get_first_interval(status_code)
+            ceiling = self.max_interval if status_code == 200 else self.stable_interval
+            self._intervals[bookmark.id] = min(interval * 2 ** (run - 1), ceiling)
+
+    def _adapt(self, previous: BookmarkRecord, checked: BookmarkRecord) -> None:
+        """Adapt the interval of the bookmark to the outcome of its check."""
+        assert previous.id is not None
+        if checked.statusCode != previous.statusCode:
+            self._intervals[previous.id] = self.min_interval
+            return
+
+        if checked.statusCode == 200:
+            ceiling = self.max_interval
+        else:
+            ceiling = self.stable_interval
+        self._intervals[previous.id] = min(self._get_interval(previous) * 2, ceiling)
+
+    @staticmethod
+    def _jitter(bookmark_id: Optional[UUID]) -> float:
+        """Vary the interval by up to ±10 %, by the id of the bookmark."""
+        if bookmark_id is None:
+            return 1.0
+        return 0.9 + (bookmark_id.int % 1000) / 1000 * 0.2
+
+    def _loop(self) -> None:
+        while not self._stopped.wait(self.tick_seconds):
+            try:
+                checked = self.tick()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Scheduled checks failed")
+                continue
+            if checked:
+                logging.info("Checked %i bookmark(s) on schedule", len(checked))
@@ -4,25 +4,62 @@
 
 from abc import ABC
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from html import unescape
+from datetime import timedelta
+from functools import partial
+from http import HTTPStatus
+from threading import Event
+from threading import Lock
+from threading import RLock
+from threading import Thread
+from time import perf_counter
+from typing import Any
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
-from unicodedata import normalize
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
 from urllib.parse import urlparse
 from uuid import UUID
 from uuid import uuid4
-import re
+import asyncio
+import logging
 
+import orjson
 import requests
 
+from api_bookmarks.checker import Checker
 from api_bookmarks.database import Database
+from api_bookmarks.exporter import Encoder
 from api_bookmarks.model import Bookmark
+from api_bookmarks.model import BookmarkChanges
 from api_bookmarks.model import BookmarkParameterAdd
 from api_bookmarks.model import BookmarkParameterCheck
 from api_bookmarks.model import BookmarkParameterDelete
 from api_bookmarks.model import BookmarkParameterEdit
 from api_bookmarks.model import BookmarkParameterVisit
+from api_bookmarks.model import BookmarkQuery
+from api_bookmarks.model import BookmarkRecord
+from api_bookmarks.model import CheckResult
 from api_bookmarks.model import DEFAULT_TAGS
+from api_bookmarks.model import ImportReport
+from api_bookmarks.model import LatencyPercentiles
+from api_bookmarks.model import LatencyReport
+from api_bookmarks.model import MaintenanceReport
+from api_bookmarks.model import Validator
+from api_bookmarks.title import TitleExtractor
+from api_bookmarks.title import get_charset
+
+
+CHUNK_SIZE = 16 * 1024
+HTML_MEDIA_TYPES = ("text/html", "application/xhtml+xml")
+
+T = TypeVar("T")  # pylint: disable=invalid-name
 
 
 class Service(ABC):
@@ -30,29 +67,77 @@ class Service(ABC):
 
     def __init__(self, database: Database) -> None:
         self.database = database
+        # The revision is counted from the start of this instance, so it is
+        # prefixed by a token unique to the instance.
+        self._instance = uuid4().hex[:8]
+        self._revision = 0
+        self._revision_lock = Lock()
 
     @abstractmethod
-    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[Bookmark]:
+    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[BookmarkRecord]:
         """Retrieve bookmarks from the database."""
 
     @abstractmethod
-    def add_bookmarks(self, parameters: List[BookmarkParameterAdd]) -> List[Bookmark]:
+    def get_changes(self, since: int) -> BookmarkChanges:
+        """Retrieve the changes to the bookmarks after the version `since`.
+
+        With `since` being zero, all the bookmarks are retrieved.
+        """
+
+    @abstractmethod
+    def query_bookmarks(self, query: BookmarkQuery) -> List[BookmarkRecord]:
+        """Retrieve a page of bookmarks from the database.
+
+        Only the fields listed in the query are retrieved, and the others are
+        left at their default values.
+        """
+
+    @abstractmethod
+    def iter_bookmarks(self) -> Iterator[BookmarkRecord]:
+        """Iterate over all the bookmarks, reading them from the database as
+        they are consumed.
+        """
+
+    @abstractmethod
+    def search_bookmarks(self, query: str, limit: int) -> List[BookmarkRecord]:
+        """Search the bookmarks, and retrieve the best `limit` matches.
+
+        Every word in the query is matched as a prefix of the words in the
+        url, title, description and tags.
+        """
+
+    @abstractmethod
+    def add_bookmarks(
+        self, parameters: List[BookmarkParameterAdd]
+    ) -> List[BookmarkRecord]:
         """Add new bookmarks to the database."""
 
+    @abstractmethod
+    def import_bookmarks(self, bookmarks: Iterable[Bookmark]) -> ImportReport:
+        """Add the bookmarks read from an export, without fetching the sites.
+
+        The bookmarks are inserted in batches, as they are read. The ones
+        whose urls are already in the collection are skipped. The imported
+        bookmarks are left unchecked, to be checked later in the background.
+        """
+
     @abstractmethod
     def update_bookmarks(
         self, parameters: List[BookmarkParameterEdit]
-    ) -> List[Bookmark]:
+    ) -> List[BookmarkRecord]:
         """Update Bookmarks' attributes."""
 
     @abstractmethod
     def check_bookmarks(
-        self, parameters: List[BookmarkParameterCheck]
-    ) -> List[Bookmark]:
+        self,
+        parameters: List[BookmarkParameterCheck],
+        max_page_bytes: Optional[int] = None,
+    ) -> List[BookmarkRecord]:
         """Check if a GET request to the bookmarked sites succeeds.
 
         Depending on the response, Bookmarks' attributes (status, url, title,
-        favicon) will be updated.
+        favicon) will be updated. If `max_page_bytes` is given, no more than
+        that is read of each page, below the limit of the service.
         """
 
     @abstractmethod
@@ -63,30 +148,210 @@ class Service(ABC):
         """
 
     @abstractmethod
-    def visit_bookmark(self, parameter: BookmarkParameterVisit) -> Bookmark:
+    def visit_bookmark(self, parameter: BookmarkParameterVisit) -> BookmarkRecord:
         """Increment the visit count and update the last visit date."""
 
+    @abstractmethod
+    def add_visits(self, visits: Dict[UUID, Tuple[int, datetime]]) -> None:
+        """Add the numbers of visits, and update the last visit dates."""
 
-class Live(Service):
-    """Service implementation."""
+    @abstractmethod
+    def get_latency_report(
+        self, start: datetime, end: datetime, bookmark_ids: List[UUID] = None
+    ) -> LatencyReport:
+        """Summarize the response times of the link checks in the time window.
+
+        The percentiles are given for each bookmark checked in the window, and
+        over all of them. If bookmark ids are given, only those bookmarks are
+        included.
+        """
+
+    @abstractmethod
+    def get_statuses(
+        self, limit: int, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        """Retrieve the status codes of the last `limit` checks of each
+        bookmark, the latest first."""
+
+    def get_revision(self) -> str:
+        """Identify the current state of the bookmark collection.
+
+        The revision changes whenever the collection is written to. It is
+        bumped after the write, so content read after the revision is at
+        least as new as the revision.
+        """
+        return "%s-%i" % (self._instance, self._revision)
+
+    def _bump_revision(self) -> None:
+        with self._revision_lock:
+            self._revision += 1
+
+    @staticmethod
+    def _get_datetime() -> datetime:
+        return datetime.now()
 
-    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[Bookmark]:
+    def get_bookmarks_json(self, query: Optional[BookmarkQuery] = None) -> bytes:
+        """Retrieve all the bookmarks, or the page of bookmarks queried,
+        serialized as a JSON array.
+        """
+        if query is None:
+            return serialize_bookmarks(self.get_bookmarks())
+        return serialize_bookmarks(self.query_bookmarks(query), query.fields)
+
+    def get_url(self, bookmark_id: UUID) -> Optional[str]:
+        """Look up the url of the bookmark, or None if not found."""
+        bookmarks = self.get_bookmarks([bookmark_id])
+        return bookmarks[0].url if bookmarks else None
+
+    def maintain(self, vacuum: bool = False) -> MaintenanceReport:
+        """Maintain the database, leaving the bookmarks as they are.
+
+        If `vacuum`, the whole database is rewritten, which blocks the writes
+        meanwhile.
+        """
+        return self.database.maintain(vacuum)
+
+    def close(self) -> None:
+        """Write out anything pending, before the service is shut down."""
+
+
+def get_percentiles(
+    response_times: List[int], bookmark_id: Optional[UUID] = None
+) -> LatencyPercentiles:
+    """Compute the nearest-rank percentiles of the sorted response times."""
+
+    def percentile(rank: float) -> int:
+        index = max(int(-(-rank * len(response_times) // 100)) - 1, 0)
+        return response_times[index]
+
+    return LatencyPercentiles(
+        bookmarkId=bookmark_id,
+        nChecks=len(response_times),
+        p50=percentile(50),
+        p90=percentile(90),
+        p99=percentile(99),
+        max=response_times[-1],
+    )
+
+
+def serialize_bookmarks(
+    bookmarks: List[BookmarkRecord], fields: Optional[List[str]] = None
+) -> bytes:
+    """Serialize the bookmarks as a JSON array.
+
+    If `fields` is given, only the listed fields are serialized. The fields
+    are read off the bookmarks as they are, without copying the bookmarks.
+    """
+    if fields is None:
+        return orjson.dumps([dict(bookmark) for bookmark in bookmarks])
+    return orjson.dumps(
+        [
+            {field: getattr(bookmark, field) for field in fields}
+            for bookmark in bookmarks
+        ]
+    )
+
+
+class Live(Service):
+    """Service implementation.
+
+    The link checks (on adding and checking bookmarks) are run concurrently by
+    `checker`. If not provided, a checker with the default concurrency limits
+    is used.
+
+    At most `max_page_bytes` bytes of each page are read to find its title.
+    A request is given up after `timeout` seconds, as a (connect, read) pair,
+    without a connection or without data arriving. A request that fails (or
+    times out) is recorded as a failed check, with the status code 0.
+
+    Every check is recorded in the history, and the checks older than
+    `check_retention` are downsampled into daily summaries.
+
+    The imports are inserted `import_batch_size` bookmarks per transaction.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        database: Database,
+        checker: Optional[Checker] = None,
+        max_page_bytes: int = 1024 * 1024,
+        check_retention: timedelta = timedelta(days=90),
+        import_batch_size: int = 5000,
+        timeout: Tuple[float, float] = (10.0, 30.0),
+    ) -> None:
+        super().__init__(database)
+        self.checker = checker if checker is not None else Checker()
+        self.max_page_bytes = max_page_bytes
+        self.timeout = timeout
+        self.check_retention = check_retention
+        self.import_batch_size = import_batch_size
+
+    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[BookmarkRecord]:
         return self.database.get_bookmarks(bookmark_ids)
 
-    def add_bookmarks(self, parameters: List[BookmarkParameterAdd]) -> List[Bookmark]:
+    def get_changes(self, since: int) -> BookmarkChanges:
+        return self.database.get_changes(since)
 
-        bookmarks = []
-        for parameter in parameters:
-            bookmark = self._construct_bookmark(parameter.url)
+    def query_bookmarks(self, query: BookmarkQuery) -> List[BookmarkRecord]:
+        return self.database.query_bookmarks(query)
+
+    def get_bookmarks_json(self, query: Optional[BookmarkQuery] = None) -> bytes:
+        # Straight from the records to JSON, without the models.
+        return self.database.get_bookmarks_json(query)
+
+    def iter_bookmarks(self) -> Iterator[BookmarkRecord]:
+        return self.database.iter_bookmarks()
+
+    def search_bookmarks(self, query: str, limit: int) -> List[BookmarkRecord]:
+        return self.database.search_bookmarks(query, limit)
+
+    def add_bookmarks(
+        self, parameters: List[BookmarkParameterAdd]
+    ) -> List[BookmarkRecord]:
+
+        results = self.checker.map(
+            self._construct_bookmark, [parameter.url for parameter in parameters]
+        )
+        bookmarks = [bookmark for bookmark, _, _ in results]
+        for bookmark in bookmarks:
             bookmark.tags = DEFAULT_TAGS
-            bookmarks.append(bookmark)
 
         self.database.add_bookmarks(bookmarks)
-        return bookmarks
+        self._bump_revision()
+        validators: Dict[UUID, Validator] = {}
+        for bookmark, validator, _ in results:
+            assert bookmark.id is not None
+            validators[bookmark.id] = validator
+        self.database.update_validators(validators)
+        self._record_checks([result for _, _, result in results])
+        return [BookmarkRecord.from_bookmark(bookmark) for bookmark in bookmarks]
+
+    def import_bookmarks(self, bookmarks: Iterable[Bookmark]) -> ImportReport:
+        report = ImportReport()
+        batch: List[Bookmark] = []
+        for bookmark in bookmarks:
+            batch.append(
+                bookmark.copy(
+                    update={"id": uuid4(), "tags": bookmark.tags or DEFAULT_TAGS}
+                )
+            )
+            if len(batch) == self.import_batch_size:
+                self._import_batch(batch, report)
+                batch = []
+        self._import_batch(batch, report)
+        return report
+
+    def _import_batch(self, batch: List[Bookmark], report: ImportReport) -> None:
+        if not batch:
+            return
+        added = self.database.add_bookmarks(batch, skip_existing=True)
+        report.added += len(added)
+        report.skipped += len(batch) - len(added)
+        self._bump_revision()
 
     def update_bookmarks(
         self, parameters: List[BookmarkParameterEdit]
-    ) -> List[Bookmark]:
+    ) -> List[BookmarkRecord]:
 
         updates = [
             Bookmark(
@@ -96,42 +361,103 @@ class Live(Service):
             )
             for parameter in parameters
         ]
-        self.database.update_bookmarks(updates, ["description", "tags"])
-        return self.get_bookmarks([parameter.id for parameter in parameters])
+        bookmarks = self.database.update_bookmarks(updates, ["description", "tags"])
+        self._bump_revision()
+        return bookmarks
 
     def check_bookmarks(
-        self, parameters: List[BookmarkParameterCheck]
-    ) -> List[Bookmark]:
+        self,
+        parameters: List[BookmarkParameterCheck],
+        max_page_bytes: Optional[int] = None,
+    ) -> List[BookmarkRecord]:
+        # The results are matched to the bookmarks by position, as the same
+        # URL may be checked for several bookmarks.
+        bookmark_ids = [parameter.id for parameter in parameters]
+        previous = {
+            bookmark.id: bookmark
+            for bookmark in self.database.get_bookmarks(bookmark_ids)
+        }
+        validators = self.database.get_validators(bookmark_ids)
+
+        def check(
+            session: requests.Session, parameter: BookmarkParameterCheck
+        ) -> Tuple[Bookmark, Validator, CheckResult]:
+            return self._construct_bookmark(
+                session,
+                parameter.url,
+                previous.get(parameter.id),
+                validators.get(parameter.id),
+                max_page_bytes,
+            )
+
+        results = self.checker.map_items(
+            check, parameters, lambda parameter: parameter.url
+        )
         bookmarks = []
-        for parameter in parameters:
-            bookmark = self._construct_bookmark(parameter.url)
+        check_results = []
+        for parameter, (bookmark, validator, result) in zip(parameters, results):
             bookmark.id = parameter.id
+            result.bookmarkId = parameter.id
             bookmarks.append(bookmark)
+            validators[parameter.id] = validator
+            check_results.append(result)
 
-        self.database.update_bookmarks(
+        updated = self.database.update_bookmarks(
             bookmarks, ["url", "title", "statusCode", "checkedDatetime"],
         )
-        return self.get_bookmarks([parameter.id for parameter in parameters])
+        self._bump_revision()
+        self.database.update_validators(validators)
+        self._record_checks(check_results)
+        return updated
 
     def delete_bookmarks(self, parameters: List[BookmarkParameterDelete]) -> None:
         self.database.delete_bookmarks([parameter.id for parameter in parameters])
+        self._bump_revision()
 
-    def visit_bookmark(self, parameter: BookmarkParameterVisit) -> Bookmark:
-        new_parameter = Bookmark(
-            id=parameter.id,
-            visitCount=parameter.visitCount + 1,
-            lastVisitDatetime=self._get_datetime(),
-        )
-        self.database.update_bookmarks(
-            [new_parameter], ["visitCount", "lastVisitDatetime"]
-        )
+    def visit_bookmark(self, parameter: BookmarkParameterVisit) -> BookmarkRecord:
+        self.add_visits({parameter.id: (1, self._get_datetime())})
         return self.get_bookmarks([parameter.id])[0]
 
-    @staticmethod
-    def _get_datetime() -> datetime:
-        return datetime.now()
+    def add_visits(self, visits: Dict[UUID, Tuple[int, datetime]]) -> None:
+        self.database.add_visits(visits)
+        self._bump_revision()
+
+    def get_statuses(
+        self, limit: int, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        return self.database.get_statuses(limit, bookmark_ids)
+
+    def get_latency_report(
+        self, start: datetime, end: datetime, bookmark_ids: List[UUID] = None
+    ) -> LatencyReport:
+        response_times = self.database.get_response_times(start, end, bookmark_ids)
+        if not response_times:
+            return LatencyReport(start=start, end=end)
+
+        return LatencyReport(
+            start=start,
+            end=end,
+            overall=get_percentiles(
+                sorted(time for times in response_times.values() for time in times)
+            ),
+            bookmarks=[
+                get_percentiles(times, bookmark_id)
+                for bookmark_id, times in response_times.items()
+            ],
+        )
 
-    def _construct_bookmark(self, url: str) -> Bookmark:
+    def _record_checks(self, results: List[CheckResult]) -> None:
+        self.database.add_check_results(results)
+        self.database.compact_check_results(self._get_datetime() - self.check_retention)
+
+    def _construct_bookmark(
+        self,
+        session: requests.Session,
+        url: str,
+        previous: Optional[BookmarkRecord] = None,
+        validator: Optional[Validator] = None,
+        max_page_bytes: Optional[int] = None,
+    ) -> Tuple[Bookmark, Validator, CheckResult]:
         """Retrieve the URL of the resource.
 
         If URL does not start with "http", http protocol is assumed, as opposed
@@ -139,49 +465,516 @@ class Live(Service):
 
         This method follows a redirect, if any, and retrieves the redirected
         destination URL.
+
+        If the validators from the previous check are given, the request is
+        conditional. When the server responds that the resource has not been
+        modified, the previous title is kept and the body is not read.
+
+        If the request fails, e.g., the host is not found, refuses the
+        connection or does not respond in time, the check is failed with the
+        status code 0, and the previous title is kept.
+
+        The outcome of the check is returned together with the bookmark.
         """
         if not url.startswith("http://") and not url.startswith("https://"):
             url = "http://" + url
 
+        headers = {"User-Agent": "Mozilla/5.0"}
+        if previous is not None and validator is not None:
+            if validator.etag:
+                headers["If-None-Match"] = validator.etag
+            if validator.lastModified:
+                headers["If-Modified-Since"] = validator.lastModified
+
         # Python's urllib.request.urlopen fails at Status 308 (permanent
         # redirect), so here, use requests library instead.
-        response = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
-        content = response.content.decode("utf-8", errors="ignore")
+        start = perf_counter()
+        try:
+            response = session.get(
+                url, headers=headers, stream=True, timeout=self.timeout
+            )
+            response_ms = int((perf_counter() - start) * 1000)
+            n_bytes = 0
+            try:
+                if (
+                    response.status_code == HTTPStatus.NOT_MODIFIED
+                    and previous is not None
+                ):
+                    # The validators are stored only for a successful response,
+                    # so the resource is still available as in the previous
+                    # check.
+                    title = previous.title
+                    status_code = HTTPStatus.OK
+                else:
+                    title, n_bytes = self._read_title(response, max_page_bytes)
+                    status_code = response.status_code
+            finally:
+                response.close()
+        except requests.RequestException as error:
+            logging.info("Failed to check %s: %s", url, error)
+            return self._construct_failure(
+                url, previous, int((perf_counter() - start) * 1000)
+            )
 
         # If the page does not have a title tag (e.g., direct link to a file),
         # the last part of url is assumed title.
-        title = self._extract_title(content, response.url)
+        if not title:
+            title = urlparse(response.url).path.strip("/").split("/")[-1]
+
         bookmark = Bookmark(
             id=uuid4(),
             url=response.url,
             title=title,
-            statusCode=response.status_code,
+            statusCode=status_code,
             checkedDatetime=self._get_datetime(),
         )
-        return bookmark
+        result = CheckResult(
+            bookmarkId=bookmark.id,
+            checkedDatetime=bookmark.checkedDatetime,
+            statusCode=status_code,
+            responseMs=response_ms,
+            bytesRead=n_bytes,
+            finalUrl=response.url if response.url != url else "",
+        )
+        return bookmark, self._get_validator(response, validator), result
+
+    def _construct_failure(
+        self, url: str, previous: Optional[BookmarkRecord], response_ms: int
+    ) -> Tuple[Bookmark, Validator, CheckResult]:
+        """Construct the outcome of a request that failed after `response_ms`.
+
+        No validators are kept, so the next request is unconditional.
+        """
+        title = previous.title if previous is not None else ""
+        if not title:
+            title = urlparse(url).path.strip("/").split("/")[-1]
+
+        bookmark = Bookmark(
+            id=uuid4(),
+            url=url,
+            title=title,
+            statusCode=0,
+            checkedDatetime=self._get_datetime(),
+        )
+        result = CheckResult(
+            bookmarkId=bookmark.id,
+            checkedDatetime=bookmark.checkedDatetime,
+            statusCode=0,
+            responseMs=response_ms,
+        )
+        return bookmark, Validator(), result
 
     @staticmethod
-    def _extract_title(content: str, url: str) -> str:
-        default_title = urlparse(url).path.strip("/").split("/")[-1]
-
-        # A website can have a title tag inside the body, in which case
-        # `re.search` returns the last title tag in the body. So limit
-        # search to inside the head.
-        head = re.search(
-            "<head(.*)>(.*)</head>", content, flags=re.IGNORECASE | re.DOTALL
+    def _get_validator(
+        response: requests.Response, validator: Optional[Validator]
+    ) -> Validator:
+        """Get the validators for the next conditional request."""
+        if response.status_code == HTTPStatus.OK:
+            return Validator(
+                etag=response.headers.get("ETag", ""),
+                lastModified=response.headers.get("Last-Modified", ""),
+            )
+        if response.status_code == HTTPStatus.NOT_MODIFIED and validator:
+            # The server may send updated validators along with 304.
+            return Validator(
+                etag=response.headers.get("ETag", validator.etag),
+                lastModified=response.headers.get(
+                    "Last-Modified", validator.lastModified
+                ),
+            )
+        return Validator()
+
+    def _read_title(
+        self, response: requests.Response, max_page_bytes: Optional[int] = None
+    ) -> Tuple[str, int]:
+        """Read the response body up to the end of the HTML title or head.
+
+        The body of a non-HTML resource (e.g., an ISO image or a PDF file) is
+        not read at all. An HTML body is parsed incrementally as it arrives,
+        until the title is found, the head ends, or `max_page_bytes` is read
+        (the smaller of the argument and the attribute).
+
+        Returns the title, and the number of bytes read.
+        """
+        if max_page_bytes is None or max_page_bytes > self.max_page_bytes:
+            max_page_bytes = self.max_page_bytes
+        content_type = response.headers.get("Content-Type", "")
+        media_type = content_type.split(";")[0].strip().lower()
+        if media_type and media_type not in HTML_MEDIA_TYPES:
+            return "", 0
+
+        extractor = TitleExtractor(get_charset(content_type))
+        n_bytes = 0
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            chunk = chunk[: max_page_bytes - n_bytes]
+            n_bytes += len(chunk)
+            extractor.feed(chunk)
+            if extractor.done or n_bytes >= max_page_bytes:
+                break
+        extractor.close()
+        return extractor.title, n_bytes
+
+
+class Cached(Service):
+    """Read-through cache in front of another service.
+
+    The whole collection is retrieved from `service` on the first read, and
+    kept in memory together with its JSON serialization. Writes go through to
+    `service`, and the bookmarks they return replace the cached ones, so reads
+    do not access the database at all.
+
+    The revision of this service is bumped only once the cache is updated,
+    so that it always matches the cached content.
+
+    The cached bookmarks are shared between the callers, and must not be
+    modified.
+
+    The visits are written behind: a visit increments the cached bookmark and
+    a pending count in memory, and the pending counts are added to `service`
+    in one batch every `flush_seconds`, and on close. So the visit counts in
+    the cache are always up to date, and never overwritten by the (possibly
+    older) counts returned from the other writes.
+    """
+
+    def __init__(self, service: Service, flush_seconds: float = 5.0) -> None:
+        super().__init__(service.database)
+        self.service = service
+        self.flush_seconds = flush_seconds
+        self._bookmarks: Optional[Dict[UUID, BookmarkRecord]] = None
+        self._json: Optional[bytes] = None
+        self._visits: Dict[UUID, Tuple[int, datetime]] = {}
+        self._lock = RLock()
+        self._closed = Event()
+        self._flusher: Optional[Thread] = None
+
+    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[BookmarkRecord]:
+        with self._lock:
+            bookmarks = self._load()
+            if not bookmark_ids:
+                return list(bookmarks.values())
+            return [
+                bookmarks[bookmark_id]
+                for bookmark_id in bookmark_ids
+                if bookmark_id in bookmarks
+            ]
+
+    def get_changes(self, since: int) -> BookmarkChanges:
+        return self.service.get_changes(since)
+
+    def query_bookmarks(self, query: BookmarkQuery) -> List[BookmarkRecord]:
+        # The pages are read from the indexes in the database.
+        return self.service.query_bookmarks(query)
+
+    def iter_bookmarks(self) -> Iterator[BookmarkRecord]:
+        # The bookmarks are streamed from the database rather than copied out
+        # of the cache, after the pending visits are written.
+        self.flush()
+        return self.service.iter_bookmarks()
+
+    def search_bookmarks(self, query: str, limit: int) -> List[BookmarkRecord]:
+        # The search index is in the database.
+        return self.service.search_bookmarks(query, limit)
+
+    def get_bookmarks_json(self, query: Optional[BookmarkQuery] = None) -> bytes:
+        if query is not None:
+            # The pages are read from the indexes in the database.
+            return self.service.get_bookmarks_json(query)
+        with self._lock:
+            if self._json is None:
+                self._json = serialize_bookmarks(list(self._load().values()))
+            return self._json
+
+    def get_url(self, bookmark_id: UUID) -> Optional[str]:
+        # The cached bookmarks are indexed by id.
+        with self._lock:
+            bookmark = self._load().get(bookmark_id)
+            return bookmark.url if bookmark is not None else None
+
+    def add_bookmarks(
+        self, parameters: List[BookmarkParameterAdd]
+    ) -> List[BookmarkRecord]:
+        return self._replace(self.service.add_bookmarks(parameters))
+
+    def import_bookmarks(self, bookmarks: Iterable[Bookmark]) -> ImportReport:
+        report = self.service.import_bookmarks(bookmarks)
+        # The imported bookmarks are not kept in memory while importing, so
+        # the cache is reloaded on the next read. The pending visits are
+        # written first, for the reload to include them.
+        with self._lock:
+            self.flush()
+            self._bookmarks = None
+            self._json = None
+            self._bump_revision()
+        return report
+
+    def update_bookmarks(
+        self, parameters: List[BookmarkParameterEdit]
+    ) -> List[BookmarkRecord]:
+        return self._replace(self.service.update_bookmarks(parameters))
+
+    def check_bookmarks(
+        self,
+        parameters: List[BookmarkParameterCheck],
+        max_page_bytes: Optional[int] = None,
+    ) -> List[BookmarkRecord]:
+        return self._replace(self.service.check_bookmarks(parameters, max_page_bytes))
+
+    def delete_bookmarks(self, parameters: List[BookmarkParameterDelete]) -> None:
+        self.service.delete_bookmarks(parameters)
+        with self._lock:
+            if self._bookmarks is not None:
+                for parameter in parameters:
+                    self._bookmarks.pop(parameter.id, None)
+            self._json = None
+            self._bump_revision()
+
+    def visit_bookmark(self, parameter: BookmarkParameterVisit) -> BookmarkRecord:
+        with self._lock:
+            if parameter.id not in self._load():
+                raise KeyError("Bookmark not found: %s" % parameter.id)
+            self.add_visits({parameter.id: (1, self._get_datetime())})
+            return self._load()[parameter.id]
+
+    def add_visits(self, visits: Dict[UUID, Tuple[int, datetime]]) -> None:
+        with self._lock:
+            bookmarks = self._load()
+            for bookmark_id, (count, last_visit) in visits.items():
+                if bookmark_id not in bookmarks:
+                    continue
+                # As in the database, the last visit is only ever moved later.
+                bookmark = bookmarks[bookmark_id]
+                bookmarks[bookmark_id] = bookmark.replace(
+                    visitCount=bookmark.visitCount + count,
+                    lastVisitDatetime=_get_later(
+                        bookmark.lastVisitDatetime, last_visit
+                    ),
+                )
+                pending, pending_visit = self._visits.get(
+                    bookmark_id, (0, last_visit)
+                )
+                self._visits[bookmark_id] = (
+                    pending + count,
+                    _get_later(pending_visit, last_visit),
+                )
+            self._json = None
+            self._bump_revision()
+            self._start_flusher()
+
+    def get_latency_report(
+        self, start: datetime, end: datetime, bookmark_ids: List[UUID] = None
+    ) -> LatencyReport:
+        return self.service.get_latency_report(start, end, bookmark_ids)
+
+    def get_statuses(
+        self, limit: int, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        return self.service.get_statuses(limit, bookmark_ids)
+
+    def flush(self) -> None:
+        """Add the pending visits to the service.
+
+        The revision is bumped once they are written, as the reads that go
+        to the database (e.g., the pages queried) then return other counts.
+        """
+        # The lock is held until written, so that no bookmark read meanwhile
+        # misses the visits being written.
+        with self._lock:
+            if self._visits:
+                self.service.add_visits(self._visits)
+                self._visits = {}
+                self._bump_revision()
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        self.service.close()
+
+    def _start_flusher(self) -> None:
+        if self._flusher is None and not self._closed.is_set():
+            self._flusher = Thread(target=self._flush_periodically, daemon=True)
+            self._flusher.start()
+
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to write the visits")
+
+    def _load(self) -> Dict[UUID, BookmarkRecord]:
+        if self._bookmarks is None:
+            self._bookmarks = {}
+            for bookmark in self.service.get_bookmarks():
+                assert bookmark.id is not None
+                self._bookmarks[bookmark.id] = bookmark
+        return self._bookmarks
+
+    def _replace(self, bookmarks: List[BookmarkRecord]) -> List[BookmarkRecord]:
+        """Put the bookmarks, as written to the database, into the cache.
+
+        The cached visit counts are kept, as the pending visits are not yet
+        written to the database.
+        """
+        with self._lock:
+            if self._bookmarks is not None:
+                bookmarks = [self._keep_visits(bookmark) for bookmark in bookmarks]
+                for bookmark in bookmarks:
+                    assert bookmark.id is not None
+                    self._bookmarks[bookmark.id] = bookmark
+            self._json = None
+            self._bump_revision()
+        return bookmarks
+
+    def _keep_visits(self, bookmark: BookmarkRecord) -> BookmarkRecord:
+        assert self._bookmarks is not None and bookmark.id is not None
+        cached = self._bookmarks.get(bookmark.id)
+        if cached is None:
+            return bookmark
+        return bookmark.replace(
+            visitCount=cached.visitCount, lastVisitDatetime=cached.lastVisitDatetime
+        )
+
+
+class AsyncService:
+    """Awaitable interface to another service.
+
+    The service (and the database below it) does blocking I/O, so every call
+    is run in a thread, off the event loop. The calls that fetch the
+    bookmarked sites (adding and checking bookmarks) run in their own
+    executor of `network_workers` threads, and all the other calls in an
+    executor of `database_workers` threads. Hence however long the link checks
+    take, the other calls are never queued behind them.
+    """
+
+    def __init__(
+        self, service: Service, database_workers: int = 4, network_workers: int = 2
+    ) -> None:
+        self.service = service
+        self._database_executor = ThreadPoolExecutor(
+            max_workers=database_workers, thread_name_prefix="database"
+        )
+        self._network_executor = ThreadPoolExecutor(
+            max_workers=network_workers, thread_name_prefix="network"
+        )
+
+    def close(self) -> None:
+        """Wait for the calls in progress, and stop the executors."""
+        self._database_executor.shutdown()
+        self._network_executor.shutdown()
+
+    def get_revision(self) -> str:
+        """Identify the current state of the bookmark collection.
+
+        The revision is kept in memory, so this does not block.
+        """
+        return self.service.get_revision()
+
+    async def get_bookmarks(
+        self, bookmark_ids: List[UUID] = None
+    ) -> List[BookmarkRecord]:
+        """Retrieve bookmarks from the database."""
+        return await self._run_database(self.service.get_bookmarks, bookmark_ids)
+
+    async def get_bookmarks_json(self, query: Optional[BookmarkQuery] = None) -> bytes:
+        """Retrieve all the bookmarks, or the page of bookmarks queried,
+        serialized as a JSON array.
+        """
+        return await self._run_database(self.service.get_bookmarks_json, query)
+
+    async def get_changes(self, since: int) -> BookmarkChanges:
+        """Retrieve the changes to the bookmarks after the version `since`."""
+        return await self._run_database(self.service.get_changes, since)
+
+    async def query_bookmarks(self, query: BookmarkQuery) -> List[BookmarkRecord]:
+        """Retrieve a page of bookmarks from the database."""
+        return await self._run_database(self.service.query_bookmarks, query)
+
+    async def search_bookmarks(self, query: str, limit: int) -> List[BookmarkRecord]:
+        """Search the bookmarks, and retrieve the best `limit` matches."""
+        return await self._run_database(self.service.search_bookmarks, query, limit)
+
+    async def export_bookmarks(self, encode: Encoder) -> AsyncIterator[bytes]:
+        """Stream all the bookmarks, encoded by `encode` into chunks.
+
+        The bookmarks are read and encoded a chunk at a time, in the thread,
+        so that neither the whole collection is held in memory nor the event
+        loop is blocked.
+        """
+        chunks = await self._run_database(
+            lambda: encode(self.service.iter_bookmarks())
         )
+        try:
+            while True:
+                chunk = await self._run_database(lambda: next(chunks, None))
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            # Closing the iterator ends the read transaction.
+            await self._run_database(chunks.close)
+
+    async def add_bookmarks(
+        self, parameters: List[BookmarkParameterAdd]
+    ) -> List[BookmarkRecord]:
+        """Add new bookmarks to the database."""
+        return await self._run_network(self.service.add_bookmarks, parameters)
+
+    async def import_bookmarks(self, bookmarks: Iterable[Bookmark]) -> ImportReport:
+        """Add the bookmarks read from an export, without fetching the sites.
+
+        The bookmarks are read (e.g., parsed from a file) in the thread, too.
+        """
+        return await self._run_database(self.service.import_bookmarks, bookmarks)
 
-        if head is None:
-            return default_title
+    async def update_bookmarks(
+        self, parameters: List[BookmarkParameterEdit]
+    ) -> List[BookmarkRecord]:
+        """Update Bookmarks' attributes."""
+        return await self._run_database(self.service.update_bookmarks, parameters)
+
+    async def check_bookmarks(
+        self, parameters: List[BookmarkParameterCheck]
+    ) -> List[BookmarkRecord]:
+        """Check if a GET request to the bookmarked sites succeeds."""
+        return await self._run_network(self.service.check_bookmarks, parameters)
 
-        title_match = re.search(
-            "<title(.*)>(.*)</title>", head.group(0), flags=re.IGNORECASE | re.DOTALL,
+    async def delete_bookmarks(self, parameters: List[BookmarkParameterDelete]) -> None:
+        """Delete the bookmarks from the database."""
+        return await self._run_database(self.service.delete_bookmarks, parameters)
+
+    async def visit_bookmark(self, parameter: BookmarkParameterVisit) -> BookmarkRecord:
+        """Increment the visit count and update the last visit date."""
+        return await self._run_database(self.service.visit_bookmark, parameter)
+
+    async def add_visits(self, visits: Dict[UUID, Tuple[int, datetime]]) -> None:
+        """Add the numbers of visits, and update the last visit dates."""
+        return await self._run_database(self.service.add_visits, visits)
+
+    async def get_url(self, bookmark_id: UUID) -> Optional[str]:
+        """Look up the url of the bookmark, or None if not found."""
+        return await self._run_database(self.service.get_url, bookmark_id)
+
+    async def get_latency_report(
+        self, start: datetime, end: datetime, bookmark_ids: List[UUID] = None
+    ) -> LatencyReport:
+        """Summarize the response times of the link checks in the time window."""
+        return await self._run_database(
+            self.service.get_latency_report, start, end, bookmark_ids
+        )
+
+    async def _run_database(self, function: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_event_loop().run_in_executor(
+            self._database_executor, partial(function, *args)
         )
-        if title_match is None:
-            return default_title
-
-        # Unescape the HTML escape sequence: for example, convert "&amp;"
-        # to "&".
-        # And normalize to unicode string: for example, "\xa0" to " " (white
-        # space).
-        return normalize("NFKD", unescape(title_match.group(2)).strip())
+
+    async def _run_network(self, function: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_event_loop().run_in_executor(
+            self._network_executor, partial(function, *args)
+        )
+
+
+def _get_later(first: Optional[datetime], second: datetime) -> datetime:
+    return second if first is None else max(first, second)
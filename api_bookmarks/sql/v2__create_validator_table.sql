@@ -0,0 +1,9 @@
+PRAGMA foreign_keys = ON;
+
+-- Validators from the latest successful check, for conditional requests.
+CREATE TABLE IF NOT EXISTS validator (
+    bookmarkId TEXT PRIMARY KEY,
+    etag TEXT,
+    lastModified TEXT,
+    FOREIGN KEY (bookmarkId) REFERENCES bookmark(id) ON DELETE CASCADE
+);
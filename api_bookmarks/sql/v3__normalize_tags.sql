@@ -0,0 +1,33 @@
+-- Tag names are stored once in `tag`, and linked to bookmarks through
+-- `bookmark_tag`. The primary key of `bookmark_tag` starts with bookmarkId,
+-- so the tags of one bookmark are looked up without scanning the table.
+
+ALTER TABLE tag RENAME TO tag_v1;
+
+CREATE TABLE tag (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE bookmark_tag (
+    bookmarkId TEXT NOT NULL,
+    tagId INTEGER NOT NULL,
+    PRIMARY KEY (bookmarkId, tagId),
+    FOREIGN KEY (bookmarkId) REFERENCES bookmark(id) ON DELETE CASCADE,
+    FOREIGN KEY (tagId) REFERENCES tag(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE INDEX bookmark_tag_tagId ON bookmark_tag (tagId);
+
+INSERT OR IGNORE INTO tag (name)
+SELECT DISTINCT name FROM tag_v1;
+
+-- Tags of deleted bookmarks are left behind in the old table, as foreign
+-- keys were not enforced. They are not carried over.
+INSERT OR IGNORE INTO bookmark_tag (bookmarkId, tagId)
+SELECT old.bookmarkId, tag.id
+FROM tag_v1 AS old
+JOIN tag ON tag.name = old.name
+JOIN bookmark ON bookmark.id = old.bookmarkId;
+
+DROP TABLE tag_v1;
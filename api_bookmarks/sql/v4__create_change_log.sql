@@ -0,0 +1,49 @@
+-- Every insert, update and delete of a bookmark (including its tags) is
+-- recorded against a monotonically increasing version. Only the latest change
+-- of each bookmark is kept, so the log grows with the number of bookmarks
+-- (and tombstones of deleted bookmarks), not with the number of writes.
+--
+-- The previous entry is deleted before inserting, rather than INSERT OR
+-- REPLACE, because the conflict resolution of a trigger is overridden by that
+-- of the statement firing it (e.g., INSERT OR IGNORE).
+
+CREATE TABLE change_log (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    bookmarkId TEXT NOT NULL UNIQUE,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO change_log (bookmarkId) SELECT id FROM bookmark;
+
+CREATE TRIGGER change_log_bookmark_insert AFTER INSERT ON bookmark
+BEGIN
+    DELETE FROM change_log WHERE bookmarkId = NEW.id;
+    INSERT INTO change_log (bookmarkId, deleted) VALUES (NEW.id, 0);
+END;
+
+CREATE TRIGGER change_log_bookmark_update AFTER UPDATE ON bookmark
+BEGIN
+    DELETE FROM change_log WHERE bookmarkId = NEW.id;
+    INSERT INTO change_log (bookmarkId, deleted) VALUES (NEW.id, 0);
+END;
+
+CREATE TRIGGER change_log_bookmark_delete AFTER DELETE ON bookmark
+BEGIN
+    DELETE FROM change_log WHERE bookmarkId = OLD.id;
+    INSERT INTO change_log (bookmarkId, deleted) VALUES (OLD.id, 1);
+END;
+
+CREATE TRIGGER change_log_tag_insert AFTER INSERT ON bookmark_tag
+BEGIN
+    DELETE FROM change_log WHERE bookmarkId = NEW.bookmarkId;
+    INSERT INTO change_log (bookmarkId, deleted) VALUES (NEW.bookmarkId, 0);
+END;
+
+-- When the bookmark itself is deleted, its tags are deleted by the cascade,
+-- which must not overwrite the tombstone.
+CREATE TRIGGER change_log_tag_delete AFTER DELETE ON bookmark_tag
+WHEN EXISTS (SELECT 1 FROM bookmark WHERE id = OLD.bookmarkId)
+BEGIN
+    DELETE FROM change_log WHERE bookmarkId = OLD.bookmarkId;
+    INSERT INTO change_log (bookmarkId, deleted) VALUES (OLD.bookmarkId, 0);
+END;
@@ -0,0 +1,80 @@
+-- Full-text index over the url, title, description and tags of every
+-- bookmark. The rowid of the index is the rowid of the bookmark, and the index
+-- is kept in sync by the triggers below. (A full VACUUM may renumber the rowids
+-- of bookmark, so the index must be rebuilt after one.)
+--
+-- The prefix index on two and three characters makes prefix queries (as typed
+-- in the search box) fast. The bm25 weights rank matches in the title and the
+-- tags above matches in the description and the url.
+
+CREATE VIRTUAL TABLE bookmark_fts USING fts5(
+    url,
+    title,
+    description,
+    tags,
+    prefix = '2 3',
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+INSERT INTO bookmark_fts (bookmark_fts, rank) VALUES ('rank', 'bm25(1.0, 10.0, 2.0, 5.0)');
+
+INSERT INTO bookmark_fts (rowid, url, title, description, tags)
+SELECT
+    b.rowid,
+    b.url,
+    b.title,
+    b.description,
+    (
+        SELECT GROUP_CONCAT(t.name, ' ')
+        FROM bookmark_tag AS bt
+        JOIN tag AS t ON t.id = bt.tagId
+        WHERE bt.bookmarkId = b.id
+    )
+FROM bookmark AS b;
+
+-- The tags are inserted after the bookmark, so they are indexed by the
+-- triggers on bookmark_tag.
+CREATE TRIGGER bookmark_fts_bookmark_insert AFTER INSERT ON bookmark
+BEGIN
+    INSERT INTO bookmark_fts (rowid, url, title, description)
+    VALUES (NEW.rowid, NEW.url, NEW.title, NEW.description);
+END;
+
+-- Visits and checks update the other columns much more often than these, and
+-- need not touch the index.
+CREATE TRIGGER bookmark_fts_bookmark_update
+AFTER UPDATE OF url, title, description ON bookmark
+BEGIN
+    UPDATE bookmark_fts
+    SET url = NEW.url, title = NEW.title, description = NEW.description
+    WHERE rowid = NEW.rowid;
+END;
+
+CREATE TRIGGER bookmark_fts_bookmark_delete AFTER DELETE ON bookmark
+BEGIN
+    DELETE FROM bookmark_fts WHERE rowid = OLD.rowid;
+END;
+
+CREATE TRIGGER bookmark_fts_tag_insert AFTER INSERT ON bookmark_tag
+BEGIN
+    UPDATE bookmark_fts
+    SET tags = (
+        SELECT GROUP_CONCAT(t.name, ' ')
+        FROM bookmark_tag AS bt
+        JOIN tag AS t ON t.id = bt.tagId
+        WHERE bt.bookmarkId = NEW.bookmarkId
+    )
+    WHERE rowid = (SELECT rowid FROM bookmark WHERE id = NEW.bookmarkId);
+END;
+
+CREATE TRIGGER bookmark_fts_tag_delete AFTER DELETE ON bookmark_tag
+BEGIN
+    UPDATE bookmark_fts
+    SET tags = (
+        SELECT GROUP_CONCAT(t.name, ' ')
+        FROM bookmark_tag AS bt
+        JOIN tag AS t ON t.id = bt.tagId
+        WHERE bt.bookmarkId = OLD.bookmarkId
+    )
+    WHERE rowid = (SELECT rowid FROM bookmark WHERE id = OLD.bookmarkId);
+END;
@@ -0,0 +1,12 @@
+-- Indexes for the sorted and paginated listing of bookmarks. Each index ends
+-- with the id, which breaks the ties, so that a page is read by seeking to
+-- the (value, id) of the last bookmark of the previous page. The id and the
+-- url are already indexed by their constraints.
+
+CREATE INDEX bookmark_title ON bookmark (title, id);
+
+CREATE INDEX bookmark_visitCount ON bookmark (visitCount, id);
+
+CREATE INDEX bookmark_lastVisitDatetime ON bookmark (lastVisitDatetime, id);
+
+CREATE INDEX bookmark_checkedDatetime ON bookmark (checkedDatetime, id);
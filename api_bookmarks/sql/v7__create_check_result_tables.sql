@@ -0,0 +1,30 @@
+-- Every link check is appended to check_result. The timestamps are integer
+-- seconds since the epoch, and the final URL is NULL unless redirected, to
+-- keep the rows small. The rows are clustered by bookmark, so the history of
+-- a bookmark is read from adjacent pages.
+--
+-- Past the retention period, the checks are downsampled into one row per
+-- bookmark per day in check_summary (the day being days since the epoch),
+-- and deleted from check_result.
+
+CREATE TABLE check_result (
+    bookmarkId TEXT NOT NULL REFERENCES bookmark(id) ON DELETE CASCADE,
+    checkedAt INTEGER NOT NULL,
+    statusCode INTEGER NOT NULL,
+    responseMs INTEGER NOT NULL,
+    bytesRead INTEGER NOT NULL,
+    finalUrl TEXT,
+    PRIMARY KEY (bookmarkId, checkedAt)
+) WITHOUT ROWID;
+
+CREATE INDEX check_result_checkedAt ON check_result (checkedAt);
+
+CREATE TABLE check_summary (
+    bookmarkId TEXT NOT NULL REFERENCES bookmark(id) ON DELETE CASCADE,
+    day INTEGER NOT NULL,
+    nChecks INTEGER NOT NULL,
+    nFailures INTEGER NOT NULL,
+    sumResponseMs INTEGER NOT NULL,
+    maxResponseMs INTEGER NOT NULL,
+    PRIMARY KEY (bookmarkId, day)
+) WITHOUT ROWID;
@@ -0,0 +1,47 @@
+-- The tags of a new bookmark are inserted before the bookmark itself (with
+-- the foreign keys deferred to the commit), so that the bookmark is indexed
+-- for search, and logged as changed, once with all its tags. The triggers on
+-- bookmark_tag skip the tags of a bookmark not inserted yet.
+
+DROP TRIGGER bookmark_fts_bookmark_insert;
+
+CREATE TRIGGER bookmark_fts_bookmark_insert AFTER INSERT ON bookmark
+BEGIN
+    INSERT INTO bookmark_fts (rowid, url, title, description, tags)
+    VALUES (
+        NEW.rowid,
+        NEW.url,
+        NEW.title,
+        NEW.description,
+        (
+            SELECT GROUP_CONCAT(t.name, ' ')
+            FROM bookmark_tag AS bt
+            JOIN tag AS t ON t.id = bt.tagId
+            WHERE bt.bookmarkId = NEW.id
+        )
+    );
+END;
+
+DROP TRIGGER bookmark_fts_tag_insert;
+
+CREATE TRIGGER bookmark_fts_tag_insert AFTER INSERT ON bookmark_tag
+WHEN EXISTS (SELECT 1 FROM bookmark WHERE id = NEW.bookmarkId)
+BEGIN
+    UPDATE bookmark_fts
+    SET tags = (
+        SELECT GROUP_CONCAT(t.name, ' ')
+        FROM bookmark_tag AS bt
+        JOIN tag AS t ON t.id = bt.tagId
+        WHERE bt.bookmarkId = NEW.bookmarkId
+    )
+    WHERE rowid = (SELECT rowid FROM bookmark WHERE id = NEW.bookmarkId);
+END;
+
+DROP TRIGGER change_log_tag_insert;
+
+CREATE TRIGGER change_log_tag_insert AFTER INSERT ON bookmark_tag
+WHEN EXISTS (SELECT 1 FROM bookmark WHERE id = NEW.bookmarkId)
+BEGIN
+    DELETE FROM change_log WHERE bookmarkId = NEW.bookmarkId;
+    INSERT INTO change_log (bookmarkId, deleted) VALUES (NEW.bookmarkId, 0);
+END;
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=protected-access
+"""api_bookmarks.test.test_checker."""
+
+from collections import Counter
+from threading import Lock
+from threading import Thread
+from time import sleep
+from typing import Dict
+
+import pytest
+import requests
+
+from api_bookmarks.checker import Checker
+
+
+def test_mapping() -> None:
+    """Test the results are returned in the order of the URLs."""
+    checker = Checker(concurrency=4, concurrency_per_host=2)
+    urls = ["python.org/%i" % i for i in range(5)] + [
+        "https://fastapi.tiangolo.com/%i" % i for i in range(5)
+    ]
+
+    results = checker.map(lambda session, url: url.upper(), urls)
+    assert results == [url.upper() for url in urls]
+
+
+def test_sharing_session() -> None:
+    """Test the URLs on the same host share a session."""
+    checker = Checker(concurrency=4, concurrency_per_host=1)
+    urls = ["http://a.example.com/%i" % i for i in range(3)] + [
+        "http://b.example.com/%i" % i for i in range(3)
+    ]
+
+    sessions = checker.map(lambda session, url: id(session), urls)
+    assert len(set(sessions[:3])) == 1
+    assert len(set(sessions[3:])) == 1
+    assert sessions[0] != sessions[3]
+
+
+@pytest.mark.parametrize("concurrency,concurrency_per_host", [(2, 1), (8, 2)])
+def test_limiting(concurrency: int, concurrency_per_host: int) -> None:
+    """Test the concurrency does not exceed the global and per-host limits."""
+    checker = Checker(
+        concurrency=concurrency, concurrency_per_host=concurrency_per_host
+    )
+    urls = [
+        "http://%s.example.com/%i" % (host, i) for host in "abcd" for i in range(4)
+    ]
+
+    lock = Lock()
+    in_flight: Dict[str, int] = Counter()
+    max_in_flight: Dict[str, int] = Counter()
+
+    def check(_session: requests.Session, url: str) -> None:
+        host = url.split("/")[2]
+        with lock:
+            for key in (host, "*"):
+                in_flight[key] += 1
+                max_in_flight[key] = max(max_in_flight[key], in_flight[key])
+        sleep(0.01)
+        with lock:
+            for key in (host, "*"):
+                in_flight[key] -= 1
+
+    checker.map(check, urls)
+
+    assert max_in_flight.pop("*") <= concurrency
+    assert max(max_in_flight.values()) <= concurrency_per_host
+
+
+def test_limiting_across_calls() -> None:
+    """Test the limits are shared by the calls running at the same time."""
+    checker = Checker(concurrency=3, concurrency_per_host=2)
+    urls = [
+        "http://%s.example.com/%i" % (host, i) for host in "abc" for i in range(4)
+    ]
+
+    lock = Lock()
+    in_flight: Dict[str, int] = Counter()
+    max_in_flight: Dict[str, int] = Counter()
+
+    def check(_session: requests.Session, url: str) -> None:
+        host = url.split("/")[2]
+        with lock:
+            for key in (host, "*"):
+                in_flight[key] += 1
+                max_in_flight[key] = max(max_in_flight[key], in_flight[key])
+        sleep(0.01)
+        with lock:
+            for key in (host, "*"):
+                in_flight[key] -= 1
+
+    threads = [Thread(target=checker.map, args=(check, urls)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max_in_flight.pop("*") <= 3
+    assert max(max_in_flight.values()) <= 2
+    assert not checker._host_slots
+
+
+def test_invalid_limits() -> None:
+    """Test a non-positive concurrency limit is rejected."""
+    with pytest.raises(ValueError):
+        Checker(concurrency=0)
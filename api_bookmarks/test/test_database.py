@@ -1,33 +1,44 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+# pylint: disable=protected-access
 """api_bookmarks.test.test_database."""
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
+from typing import Tuple
 from datetime import datetime
+from datetime import timedelta
 from pathlib import Path
+from uuid import UUID
+from uuid import uuid4
 from itertools import product
+import json
+import sqlite3
+
+import pytest
 
 from api_bookmarks.database import Database
+from api_bookmarks.database import Memory
 from api_bookmarks.database import SQLite
+from api_bookmarks.database import get_migration_version
 from api_bookmarks.model import Bookmark
+from api_bookmarks.model import BookmarkQuery
+from api_bookmarks.model import CheckResult
+from api_bookmarks.model import DEFAULT_TAGS
+from api_bookmarks.model import Validator
+from api_bookmarks.service import serialize_bookmarks
 
 
-def test_adding(tmp_path: Path) -> None:
+def test_adding(database: Database) -> None:
     """Test adding bookmarks to the database."""
-    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
-    database = SQLite(filepath)
-
     bookmarks = _make_bookmarks()
     database.add_bookmarks(bookmarks)
 
     _compare_bookmarks_against_database(database, bookmarks)
 
 
-def test_updaging(tmp_path: Path) -> None:
+def test_updaging(database: Database) -> None:
     """Test updating bookmarks in the database."""
-    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
-    database = SQLite(filepath)
-
     bookmarks = _make_bookmarks()
     database.add_bookmarks(bookmarks)
 
@@ -42,11 +53,30 @@ def test_updaging(tmp_path: Path) -> None:
     _compare_bookmarks_against_database(database, new_bookmarks)
 
 
-def test_deleting(tmp_path: Path) -> None:
-    """Test deleting bookmarks from the database."""
-    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
-    database = SQLite(filepath)
+def test_updating_tags(database: Database) -> None:
+    """Test the updated bookmarks are returned, including the untagged ones."""
+    bookmarks = _make_bookmarks()
+    bookmarks[0].tags = []
+    database.add_bookmarks(bookmarks)
+
+    bookmarks[0].tags = ["lang"]
+    bookmarks[1].tags = ["oss", "web"]
+    missing = Bookmark(id=uuid4(), url="https://example.com/", tags=["missing"])
+    updated = database.update_bookmarks(
+        [bookmarks[1], missing, bookmarks[0]], ["tags"]
+    )
+
+    assert [bookmark.id for bookmark in updated] == [
+        bookmarks[1].id,
+        bookmarks[0].id,
+    ]
+    assert [bookmark.tags for bookmark in updated] == [("oss", "web"), ("lang",)]
+    assert updated == database.get_bookmarks([bookmarks[1].id, bookmarks[0].id])
+    assert not database.search_bookmarks("missing", 10)
+
 
+def test_deleting(database: Database) -> None:
+    """Test deleting bookmarks from the database."""
     bookmarks = _make_bookmarks()
     database.add_bookmarks(bookmarks)
 
@@ -57,6 +87,655 @@ def test_deleting(tmp_path: Path) -> None:
     assert not database.get_bookmarks([bookmarks[0].id])
 
 
+def test_adding_new_only(database: Database) -> None:
+    """Test the bookmarks with the urls already added are skipped."""
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks[:1])
+    duplicates = [
+        bookmark.copy(update={"id": uuid4(), "tags": ["copy"]})
+        for bookmark in bookmarks
+    ]
+
+    added = database.add_bookmarks(bookmarks[1:] + duplicates, skip_existing=True)
+    assert added == bookmarks[1:]
+    _compare_bookmarks_against_database(database, bookmarks)
+
+    with pytest.raises(sqlite3.IntegrityError):
+        database.add_bookmarks(duplicates[:1])
+
+
+def test_adding_visits(database: Database) -> None:
+    """Test the visits are added to the counts, from many threads at once."""
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+    bookmark = database.get_bookmarks([bookmarks[0].id])[0]
+    now = datetime.now() + timedelta(hours=1)
+
+    with ThreadPoolExecutor(4) as executor:
+        list(
+            executor.map(
+                lambda _: database.add_visits({bookmark.id: (1, now)}), range(40)
+            )
+        )
+    database.add_visits({bookmark.id: (2, now - timedelta(days=1))})
+
+    visited = database.get_bookmarks([bookmark.id])[0]
+    assert visited.visitCount == bookmark.visitCount + 42
+    assert visited.lastVisitDatetime == now
+
+
+def test_reading_records(database: Database) -> None:
+    """Test the records share their tags, and decode their datetimes lazily."""
+    bookmarks = _make_bookmarks()
+    bookmarks[1].tags = bookmarks[0].tags[::-1]
+    database.add_bookmarks(bookmarks)
+
+    records = database.get_bookmarks()
+    assert records[0].tags is records[1].tags
+    assert isinstance(records[0]._checkedDatetime, str)
+    assert records[0].checkedDatetime == bookmarks[0].checkedDatetime
+    assert Bookmark.from_orm(records[0]) == bookmarks[0]
+
+
+def test_serializing(database: Database) -> None:
+    """Test the records are serialized as the bookmarks would be."""
+    bookmarks = _make_bookmarks()
+    bookmarks[1].checkedDatetime = None
+    bookmarks[1].tags = []
+    database.add_bookmarks(bookmarks)
+
+    content = database.get_bookmarks_json()
+    assert content == serialize_bookmarks(database.get_bookmarks())
+    _compare_bookmarks(bookmarks, [Bookmark(**item) for item in json.loads(content)])
+
+    query = BookmarkQuery(limit=1, sort="-title", fields=["title", "tags"])
+    assert database.get_bookmarks_json(query) == serialize_bookmarks(
+        database.query_bookmarks(query), query.fields
+    )
+
+
+def test_iterating(database: Database) -> None:
+    """Test iterating over the bookmarks from a snapshot of the database."""
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+
+    iterator = database.iter_bookmarks()
+    first = next(iterator)
+    database.delete_bookmarks([bookmark.id for bookmark in bookmarks])
+    _compare_bookmarks(bookmarks, [first] + list(iterator))
+    assert not list(database.iter_bookmarks())
+
+
+def test_getting_changes(database: Database) -> None:
+    """Test retrieving the changes since a version."""
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+
+    changes = database.get_changes(0)
+    _compare_bookmarks(bookmarks, changes.bookmarks)
+    assert not changes.deleted
+    assert not database.get_changes(changes.version).bookmarks
+
+    version = changes.version
+    bookmarks[1].tags = ["new tag"]
+    database.update_bookmarks([bookmarks[1]], ["tags"])
+    database.delete_bookmarks([bookmarks[0].id])
+
+    changes = database.get_changes(version)
+    assert changes.version > version
+    _compare_bookmarks(bookmarks[1:], changes.bookmarks)
+    assert changes.deleted == [bookmarks[0].id]
+
+    changes = database.get_changes(changes.version)
+    assert not changes.bookmarks
+    assert not changes.deleted
+
+
+def test_searching(database: Database) -> None:
+    """Test searching the bookmarks by prefixes, as the index is kept in sync."""
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+
+    # The title is ranked above the description.
+    retrieved = database.search_bookmarks("pyth", 10)
+    assert [bookmark.id for bookmark in retrieved] == [b.id for b in bookmarks]
+    _compare_bookmarks(bookmarks, retrieved)
+    _compare_bookmarks(bookmarks[:1], database.search_bookmarks("pyth", 1))
+    _compare_bookmarks(bookmarks[1:], database.search_bookmarks("back fram", 10))
+    _compare_bookmarks(bookmarks[1:], database.search_bookmarks("tiangolo", 10))
+    assert not database.search_bookmarks("lang backend", 10)
+    assert not database.search_bookmarks('" * -', 10)
+
+    bookmarks[0].title = "Snake"
+    bookmarks[0].tags = ["backend"]
+    database.update_bookmarks([bookmarks[0]], ["title", "tags"])
+    _compare_bookmarks(bookmarks[:1], database.search_bookmarks("snake backend", 10))
+    _compare_bookmarks(bookmarks[1:], database.search_bookmarks("oss", 10))
+
+    database.delete_bookmarks([bookmarks[1].id])
+    _compare_bookmarks(bookmarks[:1], database.search_bookmarks("backend", 10))
+
+
+def test_validating(database: Database) -> None:
+    """Test storing and replacing the validators."""
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+
+    database.update_validators({bookmarks[0].id: Validator(etag='"v1"')})
+    database.update_validators(
+        {bookmarks[0].id: Validator(etag='"v2"', lastModified="yesterday")}
+    )
+
+    validators = database.get_validators([bookmark.id for bookmark in bookmarks])
+    assert list(validators) == [bookmarks[0].id]
+    assert validators[bookmarks[0].id].etag == '"v2"'
+    assert validators[bookmarks[0].id].lastModified == "yesterday"
+
+
+def test_recording_checks(database: Database) -> None:
+    """Test appending, reading and downsampling the check history."""
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+
+    now = datetime(2020, 4, 11, 12)
+    database.add_check_results(
+        [
+            CheckResult(
+                bookmarkId=bookmark.id,
+                checkedDatetime=now - timedelta(days=days),
+                statusCode=200 if days % 2 else 404,
+                responseMs=100 * (days + 1) + index,
+                finalUrl="https://example.com/" if index else "",
+            )
+            for index, bookmark in enumerate(bookmarks)
+            for days in range(10)
+        ]
+    )
+
+    response_times = database.get_response_times(now - timedelta(days=2), now)
+    assert response_times == {
+        bookmark.id: [200 + index, 300 + index]
+        for index, bookmark in enumerate(bookmarks)
+    }
+    assert list(
+        database.get_response_times(now - timedelta(days=20), now, [bookmarks[0].id])
+    ) == [bookmarks[0].id]
+
+    assert database.compact_check_results(now - timedelta(days=5)) == 4 * 2
+    assert database.compact_check_results(now - timedelta(days=5)) == 0
+    assert not database.get_response_times(
+        now - timedelta(days=20), now - timedelta(days=5)
+    )
+    assert _get_check_summaries(database, bookmarks[0].id) == [
+        (1, 0, 1000),
+        (1, 1, 900),
+        (1, 0, 800),
+        (1, 1, 700),
+    ]
+
+    database.delete_bookmarks([bookmarks[0].id])
+    assert bookmarks[0].id not in database.get_response_times(
+        now - timedelta(days=20), now
+    )
+
+
+def test_migrating(tmp_path: Path) -> None:
+    """Test the migration scripts are applied only once."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    SQLite(filepath)
+    database = SQLite(filepath)
+
+    scripts = list(Database.MIGRATION_DIR.glob("*.sql"))
+    assert database._get_applied_versions() == {
+        get_migration_version(script) for script in scripts
+    }
+    with database._connect() as conn:
+        records = conn.execute("SELECT durationMs FROM schema_version").fetchall()
+    assert len(records) == len(scripts)
+    assert all(record[0] >= 0 for record in records)
+
+
+def test_migrating_atomically(tmp_path: Path, monkeypatch) -> None:
+    """Test a failing migration leaves the database as it was."""
+    migration_dir = tmp_path.joinpath("sql")
+    migration_dir.mkdir()
+    migration_dir.joinpath("v1__create.sql").write_text("CREATE TABLE first (id INT);")
+    migration_dir.joinpath("v10__fail.sql").write_text(
+        "CREATE TABLE second (id INT);\nINSERT INTO missing VALUES (1);"
+    )
+    migration_dir.joinpath("v2__insert.sql").write_text(
+        "INSERT INTO first VALUES (1);\nINSERT INTO first VALUES (2);"
+    )
+    monkeypatch.setattr(Database, "MIGRATION_DIR", migration_dir)
+
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    with pytest.raises(sqlite3.OperationalError):
+        SQLite(filepath)
+
+    migration_dir.joinpath("v10__fail.sql").unlink()
+    database = SQLite(filepath)
+    assert database._get_applied_versions() == {1, 2}
+    with database._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM first").fetchone()[0] == 2
+        tables = conn.execute("SELECT name FROM sqlite_master").fetchall()
+    assert ("second",) not in tables
+
+
+def test_normalizing_tags(tmp_path: Path, monkeypatch) -> None:
+    """Test the tags in the old schema are carried over, except orphans."""
+    scripts = sorted(Database.MIGRATION_DIR.glob("*.sql"), key=get_migration_version)
+    migration_dir = tmp_path.joinpath("sql")
+    migration_dir.mkdir()
+    for script in scripts[:2]:
+        migration_dir.joinpath(script.name).write_text(script.read_text())
+    monkeypatch.setattr(Database, "MIGRATION_DIR", migration_dir)
+
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    database = SQLite(filepath, pool_size=0)
+    bookmark = _make_bookmarks()[0]
+    with database._connect() as conn:
+        # Foreign keys were not enforced with the old schema.
+        conn.execute("PRAGMA foreign_keys = OFF")
+        conn.execute(
+            "INSERT INTO bookmark VALUES (?, ?, '', '', '', '', 0, 0)",
+            (str(bookmark.id), bookmark.url),
+        )
+        conn.executemany(
+            "INSERT INTO tag (name, bookmarkId) VALUES (?, ?)",
+            [("lang", str(bookmark.id)), ("oss", str(bookmark.id)), ("x", "gone")],
+        )
+
+    monkeypatch.setattr(Database, "MIGRATION_DIR", scripts[0].parent)
+    database = SQLite(filepath)
+    assert database.get_bookmarks()[0].tags == ("lang", "oss")
+    with database._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM bookmark_tag").fetchone()[0] == 2
+
+
+def test_selecting_by_id(tmp_path: Path) -> None:
+    """Test selecting bookmarks by id only touches the matching rows."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    database = SQLite(filepath)
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+
+    query, parameters = database._make_select_query([bookmarks[0].id], ",")
+    with database._connect() as conn:
+        plan = [
+            record[-1]
+            for record in conn.execute("EXPLAIN QUERY PLAN " + query, parameters)
+        ]
+
+    assert not [detail for detail in plan if detail.startswith("SCAN")]
+    assert [detail for detail in plan if "PRIMARY KEY (bookmarkId=?)" in detail]
+
+
+def test_chunking_parameters(tmp_path: Path, monkeypatch) -> None:
+    """Test the ids are bound in chunks, within the limit on the parameters
+    of a statement."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    database = SQLite(filepath, pool_size=1)
+    bookmarks = [
+        Bookmark(id=uuid4(), url="https://example.com/%i" % i) for i in range(5)
+    ]
+    database.add_bookmarks(bookmarks)
+    bookmark_ids = [bookmark.id for bookmark in bookmarks]
+    database.update_validators(
+        {bookmark_id: Validator(etag='"v1"') for bookmark_id in bookmark_ids}
+    )
+    now = datetime.now()
+    database.add_check_results(
+        [
+            CheckResult(
+                bookmarkId=bookmark_id,
+                checkedDatetime=now,
+                statusCode=200,
+                responseMs=10,
+            )
+            for bookmark_id in bookmark_ids
+        ]
+    )
+
+    monkeypatch.setattr("api_bookmarks.database.MAX_PARAMETERS", 3)
+    with database._connect() as conn:
+        if hasattr(conn, "setlimit"):
+            conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 3)
+
+    assert set(database.get_validators(bookmark_ids)) == set(bookmark_ids)
+    response_times = database.get_response_times(
+        now - timedelta(days=1), now + timedelta(days=1), bookmark_ids
+    )
+    assert response_times == {bookmark_id: [10] for bookmark_id in bookmark_ids}
+    database.close()
+
+
+@pytest.mark.parametrize("sort", ["title", "-visitCount", "-id"])
+def test_paginating(database: Database, sort: str) -> None:
+    """Test retrieving the sorted bookmarks a page at a time."""
+    bookmarks = [
+        Bookmark(
+            id=uuid4(),
+            url="https://example.com/%i" % i,
+            title="Example %i" % (i % 3),
+            visitCount=i % 4,
+        )
+        for i in range(10)
+    ]
+    database.add_bookmarks(bookmarks)
+
+    retrieved: List[Bookmark] = []
+    after = None
+    while True:
+        page = database.query_bookmarks(BookmarkQuery(limit=3, after=after, sort=sort))
+        assert len(page) <= 3
+        if not page:
+            break
+        retrieved += page
+        after = page[-1].id
+
+    field = sort.lstrip("-")
+    expected = sorted(
+        bookmarks,
+        key=lambda bookmark: (getattr(bookmark, field), str(bookmark.id)),
+        reverse=sort.startswith("-"),
+    )
+    assert [bookmark.id for bookmark in retrieved] == [b.id for b in expected]
+    _compare_bookmarks(bookmarks, retrieved)
+
+    if isinstance(database, SQLite):
+        query, parameters = database._make_select_query(
+            None, ",", page=BookmarkQuery(limit=3, after=after, sort=sort)
+        )
+        with database._connect() as conn:
+            plan = [
+                record[-1]
+                for record in conn.execute("EXPLAIN QUERY PLAN " + query, parameters)
+            ]
+        assert not [detail for detail in plan if "TEMP B-TREE" in detail]
+
+
+def test_projecting(database: Database) -> None:
+    """Test retrieving only the listed fields."""
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+
+    query = BookmarkQuery(fields=["url", "title"], sort="url")
+    retrieved = database.query_bookmarks(query)
+    assert [bookmark.url for bookmark in retrieved] == sorted(
+        bookmark.url for bookmark in bookmarks
+    )
+    assert all(bookmark.description == "" for bookmark in retrieved)
+    assert all(list(bookmark.tags) == DEFAULT_TAGS for bookmark in retrieved)
+
+    if isinstance(database, SQLite):
+        sql, _ = database._make_select_query(None, ",", page=query)
+        assert "tag" not in sql
+
+
+@pytest.mark.parametrize("pool_size", [0, 2])
+def test_connecting(tmp_path: Path, pool_size: int) -> None:
+    """Test the connections are set up, with and without the pool."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    database = SQLite(filepath, pool_size=pool_size)
+
+    with database._connect() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+    database.add_bookmarks(_make_bookmarks())
+    database.delete_bookmarks([bookmark.id for bookmark in _make_bookmarks()])
+    with database._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM bookmark_tag").fetchone()[0] == 0
+    database.close()
+
+
+def test_sharing_pool(tmp_path: Path) -> None:
+    """Test the pooled connections are used from several threads."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    database = SQLite(filepath, pool_size=2)
+
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+
+    def visit(bookmark: Bookmark) -> None:
+        for _ in range(20):
+            bookmark.visitCount += 1
+            database.update_bookmarks([bookmark], ["visitCount"])
+            database.get_bookmarks([bookmark.id])
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(visit, bookmarks))
+
+    assert database._n_connections <= 2
+    _compare_bookmarks_against_database(database, bookmarks)
+    database.close()
+
+
+def test_exporting_outside_pool(tmp_path: Path) -> None:
+    """Test the iterations do not hold the pooled connections."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    database = SQLite(filepath, pool_size=1)
+
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+    iterators = [database.iter_bookmarks() for _ in range(3)]
+    for iterator in iterators:
+        next(iterator)
+
+    database.delete_bookmarks([bookmarks[0].id])
+    assert database._n_connections == 1
+    assert all(len(list(iterator)) == len(bookmarks) - 1 for iterator in iterators)
+    assert len(list(database.iter_bookmarks())) == len(bookmarks) - 1
+    database.close()
+
+
+def test_maintaining(tmp_path: Path) -> None:
+    """Test the unused tags and pages are purged, and the statistics kept."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    database = SQLite(filepath)
+
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+    database.delete_bookmarks([bookmarks[1].id])
+    bookmarks[0].tags = ["lang"]
+    database.update_bookmarks([bookmarks[0]], ["tags"])
+    _add_and_delete_padding(database)
+
+    report = database.maintain()
+
+    # The tags of the deleted bookmark and the retagged one, and the default
+    # tag of the padding.
+    assert report.orphanTags == 3
+    assert report.reclaimedPages > 0
+    assert report.freePages == 0
+    assert report.queryMsBefore > 0 and report.queryMsAfter > 0
+    with database._connect() as conn:
+        assert [name for name, in conn.execute("SELECT name FROM tag")] == ["lang"]
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0]
+    _compare_bookmarks_against_database(database, bookmarks[:1])
+    assert database.maintain().orphanTags == 0
+
+
+def test_maintaining_new(tmp_path: Path) -> None:
+    """Test the pages added by the analysis of a database with nothing to
+    reclaim are not counted against the reclaimed ones."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    database = SQLite(filepath)
+    database.add_bookmarks(_make_bookmarks())
+
+    assert database.maintain().reclaimedPages == 0
+    assert database.maintain(vacuum=True).reclaimedPages == 0
+    database.close()
+
+
+def test_vacuuming(tmp_path: Path) -> None:
+    """Test a database created without incremental vacuum is switched to it
+    by a full vacuum, and still searchable."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    with sqlite3.connect(filepath) as conn:
+        conn.execute("CREATE TABLE created_before (id INTEGER)")
+    database = SQLite(filepath)
+
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+    _add_and_delete_padding(database)
+
+    report = database.maintain()
+    assert report.reclaimedPages == 0
+    assert report.freePages > 0
+
+    report = database.maintain(vacuum=True)
+    assert report.reclaimedPages > 0
+    assert report.freePages == 0
+    with database._connect() as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    _compare_bookmarks(bookmarks[1:], database.search_bookmarks("tiangolo", 10))
+    _compare_bookmarks_against_database(database, bookmarks)
+
+
+def test_recovering(tmp_path: Path) -> None:
+    """Test the in-memory database is recovered from the journal, and from
+    the snapshot once compacted."""
+    filepath = tmp_path.joinpath("bookman.snapshot").as_posix()
+    database = Memory(filepath, compaction_entries=3)
+
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+    database.update_validators({bookmarks[0].id: Validator(etag='"v1"')})
+    assert not Path(filepath).exists()
+
+    bookmarks[1].tags = ["web"]
+    database.update_bookmarks([bookmarks[1]], ["tags"])
+    database.add_visits({bookmarks[0].id: (2, bookmarks[0].lastVisitDatetime)})
+    bookmarks[0].visitCount += 2
+    assert Path(filepath).exists()
+    version = database.get_changes(0).version
+    database.close()
+
+    database = Memory(filepath)
+    _compare_bookmarks_against_database(database, bookmarks)
+    assert database.get_changes(0).version == version
+    assert database.get_validators([bookmarks[0].id])[bookmarks[0].id].etag == '"v1"'
+    _compare_bookmarks(bookmarks[1:], database.search_bookmarks("web", 10))
+
+
+def test_recovering_repeated_ids(tmp_path: Path) -> None:
+    """Test the writes repeating an id are recovered, including the entries
+    journaled with the id repeated."""
+    filepath = tmp_path.joinpath("bookman.snapshot").as_posix()
+    database = Memory(filepath)
+
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+    database.delete_bookmarks([bookmarks[0].id, bookmarks[0].id])
+    bookmarks[1].title = "Updated"
+    database.update_bookmarks([bookmarks[1], bookmarks[1]], ["title", "url"])
+    database.close()
+
+    database = Memory(filepath)
+    _compare_bookmarks_against_database(database, bookmarks[1:])
+    database.close()
+    # As journaled before the ids were deduplicated.
+    entry = [4, "delete", [str(bookmarks[1].id)] * 2]
+    with open(filepath + "-journal", "ab") as journal:
+        journal.write(json.dumps(entry).encode() + b"\n")
+
+    database = Memory(filepath)
+    assert not database.get_bookmarks()
+    database.close()
+
+
+def test_recovering_torn_journal(tmp_path: Path) -> None:
+    """Test an entry torn by a crash is dropped, and the journal written on."""
+    filepath = tmp_path.joinpath("bookman.snapshot").as_posix()
+    database = Memory(filepath)
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks[:1])
+    database.close()
+    with open(database.journal_path, "ab") as journal:
+        journal.write(b'[2, "add", [["3c5d88a6-2550')
+
+    database = Memory(filepath)
+    _compare_bookmarks_against_database(database, bookmarks[:1])
+    database.add_bookmarks(bookmarks[1:])
+    database.close()
+
+    _compare_bookmarks_against_database(Memory(filepath), bookmarks)
+
+
+def test_skipping_empty_writes(tmp_path: Path) -> None:
+    """Test the writes changing nothing are not journaled."""
+    filepath = tmp_path.joinpath("bookman.snapshot").as_posix()
+    database = Memory(filepath)
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+    size = Path(database.journal_path).stat().st_size
+
+    database.add_bookmarks(bookmarks, skip_existing=True)
+    database.update_bookmarks([], ["title"])
+    database.delete_bookmarks([uuid4()])
+    database.add_visits({uuid4(): (1, datetime.now())})
+    database.update_validators({})
+    database.add_check_results([])
+    assert database.compact_check_results(datetime.now()) == 0
+
+    assert Path(database.journal_path).stat().st_size == size
+    database.close()
+
+
+def test_skipping_compacted_entries(tmp_path: Path) -> None:
+    """Test the entries already in the snapshot are not applied again, as
+    after a crash before the journal is emptied."""
+    filepath = tmp_path.joinpath("bookman.snapshot").as_posix()
+    database = Memory(filepath)
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+    database.add_visits({bookmarks[0].id: (1, datetime.now())})
+    with open(database.journal_path, "rb") as journal:
+        entries = journal.read()
+    database.maintain()
+    database.close()
+    with open(database.journal_path, "wb") as journal:
+        journal.write(entries)
+
+    database = Memory(filepath)
+    assert database.get_bookmarks([bookmarks[0].id])[0].visitCount == 11
+
+
+def test_maintaining_in_memory(tmp_path: Path) -> None:
+    """Test the journal is compacted into the snapshot."""
+    filepath = tmp_path.joinpath("bookman.snapshot").as_posix()
+    database = Memory(filepath)
+    bookmarks = _make_bookmarks()
+    database.add_bookmarks(bookmarks)
+    _add_and_delete_padding(database)
+
+    report = database.maintain()
+    assert report.reclaimedPages > 0
+    assert report.orphanTags == 0
+    assert Path(database.journal_path).stat().st_size == 0
+    database.close()
+    _compare_bookmarks_against_database(Memory(filepath), bookmarks)
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def database(request, tmp_path: Path) -> Database:
+    """Open an empty database of each backend."""
+    if request.param == "sqlite":
+        return SQLite(tmp_path.joinpath("bookman.sqlite3").as_posix())
+    return Memory(tmp_path.joinpath("bookman.snapshot").as_posix())
+
+
+def _add_and_delete_padding(database: Database) -> None:
+    """Add and delete enough bookmarks to leave pages unused."""
+    padding = [
+        Bookmark(id=uuid4(), url="https://example.com/%i" % i, description="x" * 1000)
+        for i in range(200)
+    ]
+    database.add_bookmarks(padding)
+    database.delete_bookmarks([bookmark.id for bookmark in padding])
+
+
 def _compare_bookmarks_against_database(
     database: Database, bookmarks: List[Bookmark]
 ) -> None:
@@ -65,7 +744,34 @@ def _compare_bookmarks_against_database(
     Any mismatch (e.g., extra records in bookmarks that are not in the
     database) results in assertion error.
     """
-    retrieved_bookmarks = database.get_bookmarks()
+    _compare_bookmarks(bookmarks, database.get_bookmarks())
+
+
+def _get_check_summaries(
+    database: Database, bookmark_id: UUID
+) -> List[Tuple[int, int, int]]:
+    """Read the number of checks, of failures, and the maximum response time
+    of each daily summary of the bookmark, by the day."""
+    if isinstance(database, SQLite):
+        with database._connect() as conn:
+            return conn.execute(
+                "SELECT nChecks, nFailures, maxResponseMs FROM check_summary "
+                "WHERE bookmarkId = ? ORDER BY day",
+                (str(bookmark_id),),
+            ).fetchall()
+
+    assert isinstance(database, Memory)
+    summaries = database._check_summaries[bookmark_id]
+    return [
+        (summaries[day][0], summaries[day][1], summaries[day][3])
+        for day in sorted(summaries)
+    ]
+
+
+def _compare_bookmarks(
+    bookmarks: List[Bookmark], retrieved_bookmarks: List[Bookmark]
+) -> None:
+    """Compare the bookmarks against the retrieved bookmarks."""
     assert len(bookmarks) == len(retrieved_bookmarks)
 
     n_matches = 0
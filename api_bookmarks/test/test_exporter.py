@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.test.test_exporter."""
+
+from datetime import datetime
+from io import BytesIO
+from typing import List
+import gzip
+import json
+
+from api_bookmarks.exporter import compress
+from api_bookmarks.exporter import to_html
+from api_bookmarks.exporter import to_jsonl
+from api_bookmarks.importer import read_bookmarks
+from api_bookmarks.model import Bookmark
+from api_bookmarks.model import DEFAULT_TAGS
+
+
+def test_exporting_jsonl() -> None:
+    """Test a bookmark is written per line."""
+    bookmarks = _make_bookmarks()
+    lines = b"".join(to_jsonl(iter(bookmarks))).decode().splitlines()
+    assert [Bookmark(**json.loads(line)) for line in lines] == bookmarks
+
+
+def test_exporting_html() -> None:
+    """Test the Netscape bookmark file is read back by the importer."""
+    bookmarks = _make_bookmarks()
+    content = b"".join(to_html(iter(bookmarks)))
+    imported = list(read_bookmarks(BytesIO(content)))
+    assert [
+        (bookmark.url, bookmark.title, bookmark.description, bookmark.tags)
+        for bookmark in imported
+    ] == [
+        ("https://www.python.org/", 'Python <"3">', "Python & co", ["lang", "oss"]),
+        ("https://example.com/?a=1&b=2", "Example", "", []),
+    ]
+
+
+def test_compressing() -> None:
+    """Test the compressed chunks decompress to the export."""
+    bookmarks = _make_bookmarks() * 1000
+    content = b"".join(to_jsonl(iter(bookmarks)))
+    chunks = list(compress(to_jsonl(iter(bookmarks))))
+    assert len(chunks) > 1
+    assert gzip.decompress(b"".join(chunks)) == content
+
+
+def _make_bookmarks() -> List[Bookmark]:
+    return [
+        Bookmark(
+            id="fa578b6d-50b0-4f68-a6cd-43200cc75e1a",
+            url="https://www.python.org/",
+            title='Python <"3">',
+            description="Python & co",
+            tags=["lang", "oss"],
+            lastVisitDatetime=datetime(2020, 4, 11, 8, 48),
+            visitCount=10,
+            statusCode=200,
+        ),
+        Bookmark(
+            id="3c5d88a6-2550-4910-aca9-d508696ef400",
+            url="https://example.com/?a=1&b=2",
+            title="Example",
+            tags=DEFAULT_TAGS,
+        ),
+    ]
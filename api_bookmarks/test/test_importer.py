@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.test.test_importer."""
+
+from io import BytesIO
+from typing import Iterable
+from typing import List
+from typing import Tuple
+import json
+
+import pytest
+
+from api_bookmarks.importer import BookmarkParser
+from api_bookmarks.importer import JsonParser
+from api_bookmarks.importer import read_bookmarks
+from api_bookmarks.model import Bookmark
+
+
+NETSCAPE = b"""<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>Bookmarks Menu</H1>
+<DL><p>
+    <DT><H3 ADD_DATE="1586594887" PERSONAL_TOOLBAR_FOLDER="true">Toolbar</H3>
+    <DL><p>
+        <DT><A HREF="https://www.python.org/" TAGS="lang,oss">Python &amp; co</A>
+        <DD>Python programming language
+        <DT><H3>Dev</H3>
+        <DL><p>
+            <DT><A HREF="https://fastapi.tiangolo.com/">FastAPI</A>
+            <DT><A HREF="place:sort=8&maxResults=10">Recently Bookmarked</A>
+            <DT><H3>Web</H3>
+            <DL><p>
+                <DT><A HREF="https://developer.mozilla.org/">MDN</A>
+            </DL><p>
+        </DL><p>
+    </DL><p>
+    <DT><A HREF="https://archlinux.org/">Arch Linux</A>
+</DL>
+"""
+
+# Chrome writes the keys in the alphabetical order, so a folder's name comes
+# after its children.
+CHROME = {
+    "checksum": "0",
+    "roots": {
+        "bookmark_bar": {
+            "children": [
+                {
+                    "children": [
+                        {
+                            "name": "FastAPI",
+                            "type": "url",
+                            "url": "https://fastapi.tiangolo.com/",
+                        },
+                        {
+                            "children": [
+                                {
+                                    "name": "MDN",
+                                    "type": "url",
+                                    "url": "https://developer.mozilla.org/",
+                                }
+                            ],
+                            "name": "Web",
+                            "type": "folder",
+                        },
+                    ],
+                    "name": "Dev",
+                    "type": "folder",
+                },
+                {
+                    "name": "Python é",
+                    "type": "url",
+                    "url": "https://www.python.org/",
+                },
+            ],
+            "name": "Bookmarks bar",
+            "type": "folder",
+        },
+        "other": {"children": [], "name": "Other bookmarks", "type": "folder"},
+    },
+    "version": 1,
+}
+
+FIREFOX = {
+    "guid": "root________",
+    "title": "",
+    "root": "placesRoot",
+    "children": [
+        {
+            "guid": "toolbar_____",
+            "title": "toolbar",
+            "root": "toolbarFolder",
+            "children": [
+                {
+                    "title": "Dev",
+                    "children": [
+                        {
+                            "title": 'FastAPI "fast"',
+                            "uri": "https://fastapi.tiangolo.com/",
+                            "tags": "web,api",
+                        },
+                        {
+                            "title": "Web",
+                            "children": [
+                                {
+                                    "title": "MDN",
+                                    "uri": "https://developer.mozilla.org/",
+                                },
+                                {"title": "Query", "uri": "place:folder=TOOLBAR"},
+                            ],
+                        },
+                    ],
+                },
+                {"title": "Python", "uri": "https://www.python.org/", "index": 1},
+            ],
+        }
+    ],
+}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_reading_netscape(chunk_size: int) -> None:
+    """Test the folders become tags, however the file is chunked."""
+    bookmarks = list(read_bookmarks(BytesIO(NETSCAPE), chunk_size))
+    assert [(bookmark.url, bookmark.title) for bookmark in bookmarks] == [
+        ("https://www.python.org/", "Python & co"),
+        ("https://fastapi.tiangolo.com/", "FastAPI"),
+        ("https://developer.mozilla.org/", "MDN"),
+        ("https://archlinux.org/", "Arch Linux"),
+    ]
+    assert [bookmark.tags for bookmark in bookmarks] == [
+        ["lang", "oss"],
+        ["Dev"],
+        ["Web", "Dev"],
+        [],
+    ]
+    assert bookmarks[0].description == "Python programming language"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_reading_chrome(chunk_size: int) -> None:
+    """Test the folders named after their children become tags."""
+    content = json.dumps(CHROME, indent=3).encode()
+    assert _summarize(read_bookmarks(BytesIO(content), chunk_size)) == [
+        ("https://fastapi.tiangolo.com/", "FastAPI", ["Dev"]),
+        ("https://developer.mozilla.org/", "MDN", ["Web", "Dev"]),
+        ("https://www.python.org/", "Python é", []),
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_reading_firefox(chunk_size: int) -> None:
+    """Test the tags of the bookmarks are kept, besides the folders."""
+    content = json.dumps(FIREFOX).encode()
+    assert _summarize(read_bookmarks(BytesIO(content), chunk_size)) == [
+        ("https://fastapi.tiangolo.com/", 'FastAPI "fast"', ["web", "api", "Dev"]),
+        ("https://developer.mozilla.org/", "MDN", ["Web", "Dev"]),
+        ("https://www.python.org/", "Python", []),
+    ]
+
+
+def test_streaming() -> None:
+    """Test a bookmark is yielded before the rest of the export is read."""
+    parser = JsonParser()
+    content = json.dumps(FIREFOX)
+    split = content.index("developer.mozilla.org")
+    assert [bookmark.title for bookmark in parser.feed(content[:split])] == [
+        'FastAPI "fast"'
+    ]
+    assert len(parser.feed(content[split:])) == 2
+    assert parser.close() == []
+
+
+@pytest.mark.parametrize(
+    "content", [b'{"children": [}', b'{"children": [', b"{} {}", b"[1, 2"]
+)
+def test_rejecting_malformed_json(content: bytes) -> None:
+    """Test a malformed JSON export raises ValueError."""
+    with pytest.raises(ValueError):
+        list(read_bookmarks(BytesIO(content)))
+
+
+def test_requiring_parser_methods() -> None:
+    """Test a parser without close fails on instantiation, not on import."""
+
+    class IncompleteParser(BookmarkParser):  # pylint: disable=abstract-method
+        def feed(self, text: str) -> List[Bookmark]:
+            return []
+
+    with pytest.raises(TypeError):
+        IncompleteParser()  # type: ignore  # pylint: disable=E0110
+
+
+def _summarize(bookmarks: Iterable[Bookmark]) -> List[Tuple[str, str, List[str]]]:
+    return [(bookmark.url, bookmark.title, bookmark.tags) for bookmark in bookmarks]
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.test.test_job."""
+
+from datetime import datetime
+from threading import Event
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from uuid import UUID
+from uuid import uuid4
+import asyncio
+import json
+
+from api_bookmarks.job import JobQueue
+from api_bookmarks.model import Bookmark
+from api_bookmarks.model import BookmarkChanges
+from api_bookmarks.model import BookmarkParameterAdd
+from api_bookmarks.model import BookmarkParameterCheck
+from api_bookmarks.model import BookmarkParameterDelete
+from api_bookmarks.model import BookmarkParameterEdit
+from api_bookmarks.model import BookmarkParameterVisit
+from api_bookmarks.model import BookmarkQuery
+from api_bookmarks.model import BookmarkRecord
+from api_bookmarks.model import ImportReport
+from api_bookmarks.model import LatencyReport
+from api_bookmarks.service import Service
+
+
+def test_running() -> None:
+    """Test the results are streamed batch by batch, until the end."""
+    service = MockService()
+    jobs = JobQueue(service, batch_size=2)
+    parameters = _make_parameters(5)
+
+    job = jobs.submit(parameters)
+    assert job.total == 5
+    events = _follow(jobs, job.id)
+
+    results = [json.loads(data) for name, data in events if name == "result"]
+    assert [result["url"] for result in results] == [p.url for p in parameters]
+    progress = [json.loads(data) for name, data in events if name != "result"]
+    assert [job["completed"] for job in progress] == [0, 2, 4, 5, 5]
+    assert events[-1][0] == "end"
+    assert jobs.get(job.id).status == "done"
+    assert service.batches == [2, 2, 1]
+    jobs.close()
+
+
+def test_deduplicating() -> None:
+    """Test the URLs pending in another job are skipped."""
+    service = MockService(blocked=True)
+    jobs = JobQueue(service, batch_size=2)
+    parameters = _make_parameters(4)
+
+    first = jobs.submit(parameters[:3])
+    second = jobs.submit(parameters[1:] + parameters[3:])
+    assert second.total == 1
+    assert second.skipped == 3
+
+    service.unblock.set()
+    _follow(jobs, first.id)
+    _follow(jobs, second.id)
+    assert sorted(service.checked) == sorted(p.url for p in parameters)
+
+    third = jobs.submit(parameters[:1])
+    assert third.total == 1
+    _follow(jobs, third.id)
+    jobs.close()
+
+
+def test_cancelling() -> None:
+    """Test a cancelled job stops after the batch in progress."""
+    service = MockService(blocked=True)
+    jobs = JobQueue(service, batch_size=2)
+
+    running = jobs.submit(_make_parameters(6))
+    pending = jobs.submit(_make_parameters(2))
+    jobs.cancel(pending.id)
+    jobs.cancel(running.id)
+    service.unblock.set()
+
+    events = _follow(jobs, running.id)
+    assert len([name for name, _ in events if name == "result"]) <= 2
+    assert jobs.get(running.id).status == "cancelled"
+
+    assert not [name for name, _ in _follow(jobs, pending.id) if name == "result"]
+    assert jobs.get(pending.id).status == "cancelled"
+    assert jobs.cancel(uuid4()) is None
+    jobs.close()
+
+
+def _follow(jobs: JobQueue, job_id: UUID) -> List[Tuple[str, str]]:
+    async def follow() -> List[Tuple[str, str]]:
+        return [event async for event in jobs.follow(job_id)]
+
+    return asyncio.get_event_loop().run_until_complete(
+        asyncio.wait_for(follow(), timeout=5)
+    )
+
+
+def _make_parameters(n_bookmarks: int) -> List[BookmarkParameterCheck]:
+    return [
+        BookmarkParameterCheck(id=uuid4(), url="https://example.com/%i" % i)
+        for i in range(n_bookmarks)
+    ]
+
+
+class MockService(Service):
+    """Mock service module, whose link checks may block until unblocked."""
+
+    def __init__(self, blocked: bool = False) -> None:
+        super().__init__(None)
+        self.unblock = Event()
+        if not blocked:
+            self.unblock.set()
+        self.batches: List[int] = []
+        self.checked: List[str] = []
+
+    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[BookmarkRecord]:
+        return []
+
+    def get_changes(self, since: int) -> BookmarkChanges:
+        return BookmarkChanges(version=since)
+
+    def query_bookmarks(self, query: BookmarkQuery) -> List[BookmarkRecord]:
+        return []
+
+    def iter_bookmarks(self) -> Iterator[BookmarkRecord]:
+        return iter([])
+
+    def search_bookmarks(self, query: str, limit: int) -> List[BookmarkRecord]:
+        return []
+
+    def add_bookmarks(self, parameters: List[BookmarkParameterAdd]) -> List[BookmarkRecord]:
+        return []
+
+    def update_bookmarks(
+        self, parameters: List[BookmarkParameterEdit]
+    ) -> List[BookmarkRecord]:
+        return []
+
+    def check_bookmarks(
+        self,
+        parameters: List[BookmarkParameterCheck],
+        max_page_bytes: Optional[int] = None,
+    ) -> List[BookmarkRecord]:
+        self.unblock.wait()
+        self.batches.append(len(parameters))
+        self.checked += [parameter.url for parameter in parameters]
+        return [
+            BookmarkRecord(id=parameter.id, url=parameter.url, statusCode=200)
+            for parameter in parameters
+        ]
+
+    def delete_bookmarks(self, parameters: List[BookmarkParameterDelete]) -> None:
+        return None
+
+    def import_bookmarks(self, bookmarks: Iterable[Bookmark]) -> ImportReport:
+        return ImportReport()
+
+    def add_visits(self, visits: Dict[UUID, Tuple[int, datetime]]) -> None:
+        return None
+
+    def get_latency_report(
+        self, start: datetime, end: datetime, bookmark_ids: List[UUID] = None
+    ) -> LatencyReport:
+        return LatencyReport(start=start, end=end)
+
+    def get_statuses(
+        self, limit: int, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        return {}
+
+    def visit_bookmark(self, parameter: BookmarkParameterVisit) -> BookmarkRecord:
+        return BookmarkRecord(id=parameter.id)
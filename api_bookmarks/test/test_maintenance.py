@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.test.test_maintenance."""
+
+from datetime import datetime
+from datetime import timedelta
+from pathlib import Path
+from uuid import uuid4
+
+from api_bookmarks.database import SQLite
+from api_bookmarks.maintenance import Maintainer
+from api_bookmarks.model import Bookmark
+from api_bookmarks.model import BookmarkParameterVisit
+from api_bookmarks.service import Live
+
+
+def test_waiting_for_idle(tmp_path: Path) -> None:
+    """Test the database is maintained once per interval, while not written."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    service = Live(SQLite(filepath))
+    bookmark = Bookmark(id=uuid4(), url="https://www.python.org/", tags=["lang"])
+    service.database.add_bookmarks([bookmark])
+    clock = MockClock()
+    maintainer = Maintainer(service, interval=timedelta(hours=1), clock=clock)
+
+    # The revision is not known before the first tick.
+    assert maintainer.tick() is None
+    service.visit_bookmark(BookmarkParameterVisit(id=bookmark.id))
+    assert maintainer.tick() is None
+
+    report = maintainer.tick()
+    assert report is not None
+    assert report.queryMsAfter > 0
+
+    clock.now += timedelta(minutes=30)
+    assert maintainer.tick() is None
+    clock.now += timedelta(minutes=30)
+    assert maintainer.tick() is not None
+
+
+class MockClock:
+    """Clock advanced by hand."""
+
+    def __init__(self) -> None:
+        self.now = datetime(2020, 4, 11)
+
+    def __call__(self) -> datetime:
+        return self.now
@@ -1,20 +1,39 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+# pylint: disable=protected-access
 """api_bookmarks.test.test_route."""
 
 from datetime import datetime
+from datetime import timedelta
+from time import perf_counter
+from time import sleep
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Tuple
 from uuid import UUID
+from uuid import uuid4
+import asyncio
+import gzip
+import json
 
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
 from api_bookmarks.model import Bookmark
+from api_bookmarks.model import BookmarkChanges
 from api_bookmarks.model import BookmarkParameterAdd
 from api_bookmarks.model import BookmarkParameterCheck
 from api_bookmarks.model import BookmarkParameterDelete
 from api_bookmarks.model import BookmarkParameterEdit
 from api_bookmarks.model import BookmarkParameterVisit
+from api_bookmarks.model import BookmarkQuery
+from api_bookmarks.model import BookmarkRecord
+from api_bookmarks.model import ImportReport
+from api_bookmarks.model import LatencyReport
+from api_bookmarks.service import AsyncService
 from api_bookmarks.service import Service
 from api_bookmarks.route import Route
 
@@ -22,7 +41,7 @@ from api_bookmarks.route import Route
 def test_getting() -> None:
     """Test getting bookmarks through the get api."""
     service = MockService()
-    route = Route(service)
+    route = Route(AsyncService(service))
 
     app = FastAPI()
     app.include_router(route)
@@ -33,10 +52,194 @@ def test_getting() -> None:
     _check_response(response, service)
 
 
+def test_revalidating() -> None:
+    """Test getting bookmarks conditionally with the ETag."""
+    service = MockService()
+    route = Route(AsyncService(service))
+
+    app = FastAPI()
+    app.include_router(route)
+
+    client = TestClient(app)
+
+    etag = client.get("/api/v1/bookmarks").headers["ETag"]
+    response = client.get("/api/v1/bookmarks", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.content
+
+    response = client.get(
+        "/api/v1/bookmarks", headers={"If-None-Match": '"other", W/%s' % etag}
+    )
+    assert response.status_code == 304
+
+    service._bump_revision()
+    response = client.get("/api/v1/bookmarks", headers={"If-None-Match": etag})
+    assert response.headers["ETag"] != etag
+    _check_response(response, service)
+
+
+def test_getting_changes() -> None:
+    """Test getting the changes since a version through the get api."""
+    service = MockService()
+    route = Route(AsyncService(service))
+
+    app = FastAPI()
+    app.include_router(route)
+
+    client = TestClient(app)
+
+    response = client.get("/api/v1/bookmarks", params={"since": 3})
+    assert response.status_code == 200
+
+    changes = BookmarkChanges(**response.json())
+    assert changes.version == 4
+    assert changes.bookmarks == service.bookmarks[1:]
+    assert changes.deleted == [service.bookmarks[0].id]
+
+
+def test_paginating() -> None:
+    """Test getting a sorted page of bookmarks with only the listed fields."""
+    service = MockService()
+    route = Route(AsyncService(service))
+
+    app = FastAPI()
+    app.include_router(route)
+
+    client = TestClient(app)
+
+    response = client.get(
+        "/api/v1/bookmarks", params={"limit": 1, "sort": "-title", "fields": "title"}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"]
+    assert response.json() == [
+        {"id": str(service.bookmarks[1].id), "title": service.bookmarks[1].title}
+    ]
+
+    response = client.get("/api/v1/bookmarks", params={"sort": "description"})
+    assert response.status_code == 422
+    response = client.get("/api/v1/bookmarks", params={"fields": "id,unknown"})
+    assert response.status_code == 422
+
+
+def test_checking_in_background() -> None:
+    """Test queueing the checks as a job, and following its events."""
+    service = MockService()
+    route = Route(AsyncService(service))
+
+    app = FastAPI()
+    app.include_router(route)
+
+    client = TestClient(app)
+    response = client.put(
+        "/api/v1/bookmarks",
+        params={"background": True},
+        json=[
+            {"id": str(bookmark.id), "url": bookmark.url}
+            for bookmark in service.bookmarks
+        ],
+    )
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+
+    response = client.get("/api/v1/jobs/%s/events" % job_id)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [event.split("\n")[0] for event in response.text.split("\n\n") if event]
+    assert events.count("event: result") == len(service.bookmarks)
+    assert events[-1] == "event: end"
+
+    response = client.get("/api/v1/jobs/%s" % job_id)
+    assert response.json()["status"] == "done"
+    assert response.json()["completed"] == len(service.bookmarks)
+
+    response = client.delete("/api/v1/jobs/%s" % job_id)
+    assert response.status_code == 200
+    response = client.get("/api/v1/jobs/%s/events" % uuid4())
+    assert response.status_code == 404
+
+
+def test_serving_during_check() -> None:
+    """Test GET latency stays flat while a slow PUT check is in flight."""
+    service = SlowService(check_seconds=1.0)
+    route = Route(AsyncService(service))
+
+    app = FastAPI()
+    app.include_router(route)
+
+    async def measure() -> List[float]:
+        parameters = [
+            {"id": str(bookmark.id), "url": bookmark.url}
+            for bookmark in service.bookmarks
+        ]
+        check = asyncio.ensure_future(
+            _request(app, "PUT", "/api/v1/bookmarks", parameters)
+        )
+        # Were the check run on the event loop, this would take a second.
+        start = perf_counter()
+        await asyncio.sleep(0.1)
+        latencies = [perf_counter() - start - 0.1]
+
+        for _ in range(5):
+            start = perf_counter()
+            status, _ = await _request(app, "GET", "/api/v1/bookmarks")
+            assert status == 200
+            latencies.append(perf_counter() - start)
+
+        assert not check.done()
+        status, _ = await check
+        assert status == 200
+        return latencies
+
+    latencies = asyncio.get_event_loop().run_until_complete(measure())
+    assert max(latencies) < 0.2
+
+
+def test_reporting_latency() -> None:
+    """Test the latency report defaults to the last seven days."""
+    service = MockService()
+    route = Route(AsyncService(service))
+
+    app = FastAPI()
+    app.include_router(route)
+
+    client = TestClient(app)
+    response = client.get(
+        "/api/v1/checks/latency", params={"id": [str(service.bookmarks[0].id)]}
+    )
+    assert response.status_code == 200
+    report = LatencyReport(**response.json())
+    assert report.end - report.start == timedelta(days=7)
+
+
+def test_searching() -> None:
+    """Test searching bookmarks through the search api."""
+    service = MockService()
+    route = Route(AsyncService(service))
+
+    app = FastAPI()
+    app.include_router(route)
+
+    client = TestClient(app)
+
+    response = client.get("/api/v1/bookmarks/search", params={"q": "fastapi"})
+    assert response.status_code == 200
+    returned = [Bookmark(**res) for res in response.json()]
+    assert [bookmark.id for bookmark in returned] == [service.bookmarks[1].id]
+
+    response = client.get("/api/v1/bookmarks/search", params={"q": "", "limit": 1})
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+    response = client.get("/api/v1/bookmarks/search", params={"q": "", "limit": 0})
+    assert response.status_code == 422
+
+
 def test_adding() -> None:
     """Test adding bookmarks through the post api."""
     service = MockService()
-    route = Route(service)
+    route = Route(AsyncService(service))
 
     app = FastAPI()
     app.include_router(route)
@@ -50,7 +253,7 @@ def test_adding() -> None:
 def test_updating() -> None:
     """Test updating bookmarks through the patch api."""
     service = MockService()
-    route = Route(service)
+    route = Route(AsyncService(service))
 
     app = FastAPI()
     app.include_router(route)
@@ -74,7 +277,7 @@ def test_updating() -> None:
 def test_checking() -> None:
     """Test chekcing bookmarks through the put api."""
     service = MockService()
-    route = Route(service)
+    route = Route(AsyncService(service))
 
     app = FastAPI()
     app.include_router(route)
@@ -94,7 +297,7 @@ def test_checking() -> None:
 def test_deleting() -> None:
     """Test deleting bookmarks through the delete api."""
     service = MockService()
-    route = Route(service)
+    route = Route(AsyncService(service))
 
     app = FastAPI()
     app.include_router(route)
@@ -112,7 +315,7 @@ def test_deleting() -> None:
 def test_visiting() -> None:
     """Test visiting a bookmark through the patch api."""
     service = MockService()
-    route = Route(service)
+    route = Route(AsyncService(service))
 
     app = FastAPI()
     app.include_router(route)
@@ -135,6 +338,129 @@ def test_visiting() -> None:
     assert original.visitCount + 1 == returned.visitCount
 
 
+def test_importing() -> None:
+    """Test importing a bookmark file through the post api."""
+    service = MockService()
+    route = Route(AsyncService(service))
+
+    app = FastAPI()
+    app.include_router(route)
+
+    client = TestClient(app)
+    response = client.post(
+        "/api/v1/bookmarks/import",
+        data=b"""
+            <DL><p>
+                <DT><H3>Dev</H3>
+                <DL><p><DT><A HREF="https://fastapi.tiangolo.com/">FastAPI</A></DL>
+            </DL>
+        """,
+        headers={"Content-Type": "text/html"},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"added": 1, "skipped": 0}
+    assert [bookmark.tags for bookmark in service.imported] == [["Dev"]]
+
+    response = client.post("/api/v1/bookmarks/import", data=b'{"roots": [')
+    assert response.status_code == 422
+
+
+def test_exporting() -> None:
+    """Test exporting the bookmarks through the get api."""
+    service = MockService()
+    route = Route(AsyncService(service))
+
+    app = FastAPI()
+    app.include_router(route)
+
+    client = TestClient(app)
+    response = client.get("/api/v1/bookmarks/export")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    assert "bookmarks.jsonl" in response.headers["Content-Disposition"]
+    assert [
+        Bookmark(**json.loads(line)) for line in response.text.splitlines()
+    ] == service.bookmarks
+
+    response = client.get(
+        "/api/v1/bookmarks/export", params={"format": "html", "gzip": True}
+    )
+    assert response.status_code == 200
+    assert "bookmarks.html.gz" in response.headers["Content-Disposition"]
+    content = gzip.decompress(response.content)
+    assert all(bookmark.url.encode() in content for bookmark in service.bookmarks)
+
+    response = client.get("/api/v1/bookmarks/export", params={"format": "csv"})
+    assert response.status_code == 422
+
+
+def test_going_to_bookmark() -> None:
+    """Test the redirect to the bookmarked site counts the visit."""
+    service = MockService()
+    route = Route(AsyncService(service))
+
+    app = FastAPI()
+    app.include_router(route)
+
+    client = TestClient(app)
+    bookmark = service.bookmarks[0]
+    response = client.get("/go/%s" % bookmark.id, allow_redirects=False)
+    assert response.status_code == 302
+    assert response.headers["Location"] == bookmark.url
+    assert [list(visits) for visits in service.visits] == [[bookmark.id]]
+    assert service.visits[0][bookmark.id][0] == 1
+
+    response = client.get("/go/%s" % uuid4(), allow_redirects=False)
+    assert response.status_code == 404
+    assert len(service.visits) == 1
+
+
+async def _request(
+    app: FastAPI, method: str, path: str, payload: object = None
+) -> Tuple[int, bytes]:
+    """Send a request straight to the ASGI app, on the running event loop.
+
+    Unlike the test client, this lets several requests be in flight at once.
+    """
+    body = json.dumps(payload).encode() if payload is not None else b""
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"testserver"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = 0
+    content = b""
+
+    async def receive() -> dict:
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        nonlocal status, content
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            content += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return status, content
+
+
 def _check_response(response, service):
     assert response.status_code == 200
 
@@ -160,35 +486,85 @@ class MockService(Service):
 
     def __init__(self) -> None:
         super().__init__(None)
+        self.visits: List[Dict[UUID, Tuple[int, datetime]]] = []
+        self.imported: List[Bookmark] = []
 
-    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[Bookmark]:
+    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[BookmarkRecord]:
         if not bookmark_ids:
-            return self.bookmarks
-        return [bookmark for bookmark in self.bookmarks if bookmark.id in bookmark_ids]
+            return _make_records(self.bookmarks)
+        return _make_records(
+            [bookmark for bookmark in self.bookmarks if bookmark.id in bookmark_ids]
+        )
 
-    def add_bookmarks(self, parameters: List[BookmarkParameterAdd]) -> List[Bookmark]:
-        return self.bookmarks
+    def get_changes(self, since: int) -> BookmarkChanges:
+        return BookmarkChanges(
+            version=since + 1,
+            bookmarks=self.bookmarks[1:],
+            deleted=[self.bookmarks[0].id],
+        )
+
+    def query_bookmarks(self, query: BookmarkQuery) -> List[BookmarkRecord]:
+        bookmarks = sorted(
+            self.bookmarks,
+            key=lambda bookmark: getattr(bookmark, query.sort_field),
+            reverse=query.descending,
+        )
+        return _make_records(bookmarks[: query.limit])
+
+    def iter_bookmarks(self) -> Iterator[BookmarkRecord]:
+        return iter(_make_records(self.bookmarks))
+
+    def search_bookmarks(self, query: str, limit: int) -> List[BookmarkRecord]:
+        return _make_records(
+            [bookmark for bookmark in self.bookmarks if query in bookmark.title][:limit]
+        )
+
+    def add_bookmarks(
+        self, parameters: List[BookmarkParameterAdd]
+    ) -> List[BookmarkRecord]:
+        return _make_records(self.bookmarks)
 
     def update_bookmarks(
         self, parameters: List[BookmarkParameterEdit]
-    ) -> List[Bookmark]:
-        return self.bookmarks
+    ) -> List[BookmarkRecord]:
+        return _make_records(self.bookmarks)
 
     def check_bookmarks(
-        self, parameters: List[BookmarkParameterCheck]
-    ) -> List[Bookmark]:
-        return self.bookmarks
+        self,
+        parameters: List[BookmarkParameterCheck],
+        max_page_bytes: Optional[int] = None,
+    ) -> List[BookmarkRecord]:
+        return _make_records(self.bookmarks)
 
     def delete_bookmarks(self, parameters: List[BookmarkParameterDelete]) -> None:
         return None
 
-    def visit_bookmark(self, parameter: BookmarkParameterVisit) -> Bookmark:
+    def import_bookmarks(self, bookmarks: Iterable[Bookmark]) -> ImportReport:
+        report = ImportReport()
+        for bookmark in bookmarks:
+            self.imported.append(bookmark)
+            report.added += 1
+        return report
+
+    def add_visits(self, visits: Dict[UUID, Tuple[int, datetime]]) -> None:
+        self.visits.append(visits)
+
+    def get_latency_report(
+        self, start: datetime, end: datetime, bookmark_ids: List[UUID] = None
+    ) -> LatencyReport:
+        return LatencyReport(start=start, end=end)
+
+    def get_statuses(
+        self, limit: int, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        return {}
+
+    def visit_bookmark(self, parameter: BookmarkParameterVisit) -> BookmarkRecord:
         bookmark = self.get_bookmarks([parameter.id])[0]
-        bookmark.visitCount += 1
-        bookmark.lastVisitDatetime = datetime.fromisoformat(
-            "2020-04-11T13:48:07.008968"
+        return bookmark.replace(
+            visitCount=bookmark.visitCount + 1,
+            lastVisitDatetime=datetime.fromisoformat("2020-04-11T13:48:07.008968"),
         )
-        return bookmark
 
     @property
     def bookmarks(self) -> List[Bookmark]:
@@ -218,3 +594,23 @@ class MockService(Service):
                 statusCode=200,
             ),
         ]
+
+
+class SlowService(MockService):
+    """Mock service whose link checks block for a while."""
+
+    def __init__(self, check_seconds: float) -> None:
+        super().__init__()
+        self.check_seconds = check_seconds
+
+    def check_bookmarks(
+        self,
+        parameters: List[BookmarkParameterCheck],
+        max_page_bytes: Optional[int] = None,
+    ) -> List[BookmarkRecord]:
+        sleep(self.check_seconds)
+        return _make_records(self.bookmarks)
+
+
+def _make_records(bookmarks: List[Bookmark]) -> List[BookmarkRecord]:
+    return [BookmarkRecord.from_bookmark(bookmark) for bookmark in bookmarks]
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=protected-access
+"""api_bookmarks.test.test_scheduler."""
+
+from datetime import datetime
+from datetime import timedelta
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from uuid import UUID
+from uuid import uuid4
+
+import pytest
+
+from api_bookmarks.model import Bookmark
+from api_bookmarks.model import BookmarkChanges
+from api_bookmarks.model import BookmarkParameterAdd
+from api_bookmarks.model import BookmarkParameterCheck
+from api_bookmarks.model import BookmarkParameterDelete
+from api_bookmarks.model import BookmarkParameterEdit
+from api_bookmarks.model import BookmarkParameterVisit
+from api_bookmarks.model import BookmarkQuery
+from api_bookmarks.model import BookmarkRecord
+from api_bookmarks.model import ImportReport
+from api_bookmarks.model import LatencyReport
+from api_bookmarks.scheduler import Scheduler
+from api_bookmarks.service import Service
+
+
+def test_adapting() -> None:
+    """Test stable links are checked rarely, and flapping links often."""
+    clock = MockClock()
+    service = MockService(clock)
+    stable = service.add("https://stable.example.com", [200])
+    flapping = service.add("https://flapping.example.com", [200, 500])
+    scheduler = Scheduler(service, concurrency=2, bytes_per_check=1, clock=clock)
+
+    for _ in range(24 * 14):
+        scheduler.tick()
+        clock.now += timedelta(hours=1)
+
+    assert service.n_checks[stable] <= 10
+    # Checked every tick or every other tick, depending on the jitter.
+    assert service.n_checks[flapping] >= 24 * 14 / 2
+
+
+def test_resuming() -> None:
+    """Test the intervals are replayed from the history after a restart."""
+    clock = MockClock()
+    service = MockService(clock)
+    stable = service.add("https://stable.example.com", [200], checked=True)
+    changed = service.add(
+        "https://changed.example.com", [500, 200, 200, 200], checked=True
+    )
+    scheduler = Scheduler(service, concurrency=2, bytes_per_check=1, clock=clock)
+
+    for _ in range(24 * 14):
+        scheduler.tick()
+        clock.now += timedelta(hours=1)
+    intervals = dict(scheduler._intervals)
+    assert intervals[stable] > scheduler.stable_interval
+
+    restarted = Scheduler(service, concurrency=2, bytes_per_check=1, clock=clock)
+    restarted.get_due(clock.now)
+    assert restarted._intervals == intervals
+
+
+def test_budgeting() -> None:
+    """Test the checks per tick and per batch are within the budget."""
+    clock = MockClock()
+    service = MockService(clock)
+    for i in range(10):
+        service.add("https://example.com/%i" % i, [200])
+    scheduler = Scheduler(
+        service,
+        concurrency=2,
+        bytes_per_second=1024,
+        bytes_per_check=10 * 1024,
+        tick_seconds=60,
+        clock=clock,
+    )
+
+    assert len(scheduler.tick()) == 6
+    assert max(service.batches) == 2
+    assert service.max_page_bytes == 10 * 1024
+    assert len(scheduler.tick()) == 4
+    assert not scheduler.tick()
+
+
+def test_failing() -> None:
+    """Test a check that raises does not hold up the other bookmarks."""
+    clock = MockClock()
+    service = MockService(clock)
+    dead = service.add("http://127.0.0.1:9/", [200])
+    alive = service.add("https://example.com", [200])
+    service.raising.add(dead)
+    scheduler = Scheduler(service, concurrency=2, bytes_per_check=1, clock=clock)
+
+    assert [bookmark.id for bookmark in scheduler.tick()] == [alive]
+    # The failed bookmark is taken as checked, and not due again right away.
+    assert not scheduler.get_due(clock.now)
+
+    clock.now += timedelta(hours=3)
+    assert dead in [bookmark.id for bookmark in scheduler.get_due(clock.now)]
+
+
+def test_deleting_while_checking() -> None:
+    """Test the results are matched to the bookmarks checked by id."""
+    clock = MockClock()
+    service = MockService(clock)
+    deleted = service.add("https://deleted.example.com", [200])
+    kept = service.add("https://kept.example.com", [500])
+    scheduler = Scheduler(service, concurrency=2, bytes_per_check=1, clock=clock)
+    due = scheduler.get_due(clock.now)
+    del service.bookmarks[deleted]
+    service.get_bookmarks = lambda bookmark_ids=None: due  # type: ignore
+
+    assert [bookmark.id for bookmark in scheduler.tick()] == [kept]
+    # The failing bookmark is due again after the minimum interval.
+    assert scheduler._intervals[kept] == scheduler.min_interval
+
+
+def test_invalid_budget() -> None:
+    """Test a non-positive budget is rejected."""
+    with pytest.raises(ValueError):
+        Scheduler(MockService(MockClock()), concurrency=0)
+
+
+class MockClock:
+    """Clock advanced by hand."""
+
+    def __init__(self) -> None:
+        self.now = datetime(2020, 4, 11)
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+class MockService(Service):
+    """Mock service module, whose bookmarks answer with scripted statuses."""
+
+    def __init__(self, clock: MockClock) -> None:
+        super().__init__(None)
+        self.clock = clock
+        self.bookmarks: Dict[UUID, BookmarkRecord] = {}
+        self.statuses: Dict[UUID, List[int]] = {}
+        self.n_checks: Dict[UUID, int] = {}
+        self.history: Dict[UUID, List[int]] = {}
+        self.batches: List[int] = []
+        self.max_page_bytes: Optional[int] = None
+        self.raising: Set[UUID] = set()
+
+    def add(self, url: str, statuses: List[int], checked: bool = False) -> UUID:
+        """Add a bookmark, which answers with the statuses in turn.
+
+        If `checked`, the bookmark is checked once on adding, as when added
+        through the API, and otherwise left unchecked, as when imported.
+        """
+        bookmark_id = uuid4()
+        self.bookmarks[bookmark_id] = BookmarkRecord(id=bookmark_id, url=url)
+        self.statuses[bookmark_id] = statuses
+        self.n_checks[bookmark_id] = 0
+        self.history[bookmark_id] = []
+        if checked:
+            self.check_bookmarks([BookmarkParameterCheck(id=bookmark_id, url=url)])
+        return bookmark_id
+
+    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[BookmarkRecord]:
+        return list(self.bookmarks.values())
+
+    def get_changes(self, since: int) -> BookmarkChanges:
+        return BookmarkChanges(version=since)
+
+    def query_bookmarks(self, query: BookmarkQuery) -> List[BookmarkRecord]:
+        return []
+
+    def iter_bookmarks(self) -> Iterator[BookmarkRecord]:
+        return iter([])
+
+    def search_bookmarks(self, query: str, limit: int) -> List[BookmarkRecord]:
+        return []
+
+    def add_bookmarks(self, parameters: List[BookmarkParameterAdd]) -> List[BookmarkRecord]:
+        return []
+
+    def update_bookmarks(
+        self, parameters: List[BookmarkParameterEdit]
+    ) -> List[BookmarkRecord]:
+        return []
+
+    def check_bookmarks(
+        self,
+        parameters: List[BookmarkParameterCheck],
+        max_page_bytes: Optional[int] = None,
+    ) -> List[BookmarkRecord]:
+        self.batches.append(len(parameters))
+        self.max_page_bytes = max_page_bytes
+        checked = []
+        for parameter in parameters:
+            if parameter.id in self.raising:
+                raise ConnectionError("Connection refused")
+            if parameter.id not in self.bookmarks:
+                # Deleted while checking.
+                continue
+            statuses = self.statuses[parameter.id]
+            n_checks = self.n_checks[parameter.id]
+            self.n_checks[parameter.id] += 1
+            bookmark = self.bookmarks[parameter.id].replace(
+                statusCode=statuses[n_checks % len(statuses)],
+                checkedDatetime=self.clock(),
+            )
+            self.bookmarks[parameter.id] = bookmark
+            self.history[parameter.id].append(bookmark.statusCode)
+            checked.append(bookmark)
+        return checked
+
+    def delete_bookmarks(self, parameters: List[BookmarkParameterDelete]) -> None:
+        return None
+
+    def import_bookmarks(self, bookmarks: Iterable[Bookmark]) -> ImportReport:
+        return ImportReport()
+
+    def add_visits(self, visits: Dict[UUID, Tuple[int, datetime]]) -> None:
+        return None
+
+    def get_latency_report(
+        self, start: datetime, end: datetime, bookmark_ids: List[UUID] = None
+    ) -> LatencyReport:
+        return LatencyReport(start=start, end=end)
+
+    def get_statuses(
+        self, limit: int, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        return {
+            bookmark_id: self.history[bookmark_id][::-1][:limit]
+            for bookmark_id in bookmark_ids or list(self.history)
+            if self.history.get(bookmark_id)
+        }
+
+    def visit_bookmark(self, parameter: BookmarkParameterVisit) -> BookmarkRecord:
+        return self.bookmarks[parameter.id]
@@ -1,22 +1,45 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+# pylint: disable=protected-access
 """api_bookmarks.test.test_service."""
 
-from collections import namedtuple
 from datetime import datetime
+from datetime import timedelta
+from pathlib import Path
+from threading import Thread
+from time import sleep
+from typing import Dict
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
 from uuid import UUID
+from uuid import uuid4
+import json
 
 import pytest
+import requests
 
 from api_bookmarks.database import Database
+from api_bookmarks.database import SQLite
 from api_bookmarks.model import Bookmark
+from api_bookmarks.model import BookmarkChanges
 from api_bookmarks.model import BookmarkParameterAdd
 from api_bookmarks.model import BookmarkParameterCheck
 from api_bookmarks.model import BookmarkParameterDelete
 from api_bookmarks.model import BookmarkParameterEdit
 from api_bookmarks.model import BookmarkParameterVisit
+from api_bookmarks.model import BookmarkQuery
+from api_bookmarks.model import BookmarkRecord
+from api_bookmarks.model import CheckResult
+from api_bookmarks.model import DEFAULT_TAGS
+from api_bookmarks.model import MaintenanceReport
+from api_bookmarks.model import Validator
+from api_bookmarks.service import Cached
 from api_bookmarks.service import Live
+from api_bookmarks.service import get_percentiles
+from api_bookmarks.service import serialize_bookmarks
 
 
 def test_getting() -> None:
@@ -106,6 +129,165 @@ def test_checking() -> None:
         assert parameter.url == bookmark.url
 
 
+def test_checking_conditionally(monkeypatch) -> None:
+    """Test the previous title is kept when the page is not modified."""
+    database = MockDatabase()
+    service = Live(database)
+
+    bookmark = service.get_bookmarks()[0]
+    database.validators[bookmark.id] = Validator(etag='"v1"')
+
+    def mock_get(_session, url, headers, **_kwargs):
+        assert headers["If-None-Match"] == '"v1"'
+        return MockResponse(url=url, content=b"<title>New</title>", status_code=304)
+
+    monkeypatch.setattr("api_bookmarks.service.requests.Session.get", mock_get)
+
+    checked, validator, result = service._construct_bookmark(
+        requests.Session(), bookmark.url, bookmark, database.validators[bookmark.id]
+    )
+    assert checked.title == bookmark.title
+    assert checked.statusCode == 200
+    assert validator.etag == '"v1"'
+    assert result.statusCode == 200
+    assert result.bytesRead == 0
+
+
+def test_checking_unreachable(monkeypatch) -> None:
+    """Test a failed request fails its own check only, within the timeout."""
+    database = MockDatabase()
+    service = Live(database, timeout=(1.0, 2.0))
+
+    def mock_get(_session, url, timeout, **_kwargs):
+        assert timeout == (1.0, 2.0)
+        if url == "https://www.python.org/":
+            raise requests.ConnectionError("Connection refused")
+        return MockResponse(url=url, content=b"<title>Test</title>")
+
+    monkeypatch.setattr("api_bookmarks.service.requests.Session.get", mock_get)
+
+    bookmarks = service.get_bookmarks()
+    updated = service.check_bookmarks(
+        [
+            BookmarkParameterCheck(id=bookmark.id, url=bookmark.url)
+            for bookmark in bookmarks
+        ]
+    )
+    assert [bookmark.statusCode for bookmark in updated] == [0, 200]
+    assert updated[0].title == bookmarks[0].title
+    assert updated[0].checkedDatetime > bookmarks[0].checkedDatetime
+    assert [result.statusCode for result in database.check_results] == [0, 200]
+
+
+def test_checking_same_url(monkeypatch) -> None:
+    """Test the bookmarks checked with the same URL keep their own ids and
+    previous titles."""
+    database = MockDatabase()
+    service = Live(database)
+
+    def mock_get(_session, url, **_kwargs):
+        raise requests.ConnectionError("Connection refused")
+
+    monkeypatch.setattr("api_bookmarks.service.requests.Session.get", mock_get)
+
+    bookmarks = service.get_bookmarks()
+    updated = service.check_bookmarks(
+        [
+            BookmarkParameterCheck(id=bookmark.id, url="https://example.com/")
+            for bookmark in bookmarks
+        ]
+    )
+    assert [bookmark.id for bookmark in updated] == [
+        bookmark.id for bookmark in bookmarks
+    ]
+    assert [bookmark.title for bookmark in updated] == [
+        bookmark.title for bookmark in bookmarks
+    ]
+    assert [result.bookmarkId for result in database.check_results] == [
+        bookmark.id for bookmark in bookmarks
+    ]
+
+
+def test_storing_validators() -> None:
+    """Test the validators of a successful response are stored."""
+    database = MockDatabase()
+    service = Live(database)
+
+    bookmarks = service.get_bookmarks()
+    service.check_bookmarks(
+        [BookmarkParameterCheck(id=bookmarks[0].id, url=bookmarks[0].url)]
+    )
+    assert database.validators[bookmarks[0].id].etag == ""
+
+    response = MockResponse(headers={"ETag": '"v2"', "Last-Modified": "yesterday"})
+    validator = service._get_validator(response, None)
+    assert validator.etag == '"v2"'
+    assert validator.lastModified == "yesterday"
+
+
+def test_recording_checks() -> None:
+    """Test every check is recorded, and summarized by percentiles."""
+    database = MockDatabase()
+    service = Live(database)
+
+    bookmarks = service.get_bookmarks()
+    parameters = [
+        BookmarkParameterCheck(id=bookmark.id, url=bookmark.url)
+        for bookmark in bookmarks
+    ]
+    start = datetime.now()
+    service.check_bookmarks(parameters)
+    service.check_bookmarks(parameters)
+    end = datetime.now() + timedelta(seconds=1)
+
+    assert len(database.check_results) == 2 * len(bookmarks)
+    assert {result.bookmarkId for result in database.check_results} == {
+        bookmark.id for bookmark in bookmarks
+    }
+
+    report = service.get_latency_report(start, end)
+    assert report.overall.nChecks == 2 * len(bookmarks)
+    assert len(report.bookmarks) == len(bookmarks)
+
+    future = end + timedelta(days=1)
+    assert service.get_latency_report(end, future).overall is None
+
+
+def test_recording_failed_checks(tmp_path: Path, monkeypatch) -> None:
+    """Test the checks that get no response are recorded, and reported."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    service = Live(SQLite(filepath))
+    start = datetime.now() - timedelta(seconds=1)
+
+    def mock_get(_session, url, *_args, **_kwargs):
+        sleep(0.05)
+        raise requests.ConnectTimeout("Timed out connecting to %s" % url)
+
+    monkeypatch.setattr("api_bookmarks.service.requests.Session.get", mock_get)
+
+    added = service.add_bookmarks([BookmarkParameterAdd(url="http://127.0.0.1:9/")])
+    assert added[0].statusCode == 0
+
+    report = service.get_latency_report(start, datetime.now() + timedelta(seconds=1))
+    assert report.overall is not None
+    assert report.overall.nChecks == 1
+    assert report.overall.p50 >= 50
+    assert [percentiles.bookmarkId for percentiles in report.bookmarks] == [
+        added[0].id
+    ]
+
+
+def test_computing_percentiles() -> None:
+    """Test the nearest-rank percentiles."""
+    percentiles = get_percentiles(list(range(1, 101)))
+    assert percentiles.nChecks == 100
+    assert (percentiles.p50, percentiles.p90, percentiles.p99) == (50, 90, 99)
+    assert percentiles.max == 100
+
+    percentiles = get_percentiles([7])
+    assert (percentiles.p50, percentiles.p99, percentiles.max) == (7, 7, 7)
+
+
 def test_deleting() -> None:
     """Test deleting bookmarks."""
     database = MockDatabase()
@@ -131,15 +313,251 @@ def test_visiting() -> None:
     assert parameter.id == new_bookmark.id
 
 
+def test_reading_title() -> None:
+    """Test the body is read only up to the end of the title."""
+    service = Live(MockDatabase())
+    head = b"<html><head><title>Test</title></head>"
+    response = MockResponse(content=head + b"<body>" + b"x" * 100000 + b"</body>")
+
+    title, n_bytes = service._read_title(response)
+    assert title == "Test"
+    assert n_bytes == response.n_read < len(response.content)
+
+
+def test_reading_title_of_non_html() -> None:
+    """Test the body of a non-HTML resource is not read."""
+    service = Live(MockDatabase())
+    response = MockResponse(
+        content=b"%PDF-1.4" + b"x" * 100000,
+        headers={"Content-Type": "application/pdf"},
+    )
+
+    assert service._read_title(response) == ("", 0)
+    assert response.n_read == 0
+
+
+def test_reading_title_up_to_limit() -> None:
+    """Test no more than max_page_bytes bytes are parsed."""
+    service = Live(MockDatabase(), max_page_bytes=1000)
+    response = MockResponse(
+        content=b"<html><head><script>" + b"x" * 100000 + b"</script><title>Test"
+    )
+
+    title, n_bytes = service._read_title(response)
+    assert title == ""
+    assert n_bytes == 1000
+    assert response.n_read < len(response.content)
+
+    # A lower limit is given by the scheduler, and a higher one is ignored.
+    assert service._read_title(MockResponse(content=response.content), 500)[1] == 500
+    assert service._read_title(MockResponse(content=response.content), 2000)[1] == 1000
+
+
+class MockResponse:
+    """Mock response of the streaming request."""
+
+    def __init__(
+        self,
+        url: str = "http://example.com",
+        content: bytes = b"",
+        status_code: int = 200,
+        headers: Dict[str, str] = None,
+    ) -> None:
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.headers = (
+            headers if headers is not None else {"Content-Type": "text/html"}
+        )
+        self.n_read = 0
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        """Yield the content in chunks, keeping count of the bytes read."""
+        for start in range(0, len(self.content), chunk_size):
+            chunk = self.content[start : start + chunk_size]
+            self.n_read += len(chunk)
+            yield chunk
+
+    def close(self) -> None:
+        """Release the connection."""
+
+
+def test_caching() -> None:
+    """Test the bookmarks are read from the database only once."""
+    database = MockDatabase()
+    service = Cached(Live(database))
+
+    bookmarks = service.get_bookmarks()
+    content = service.get_bookmarks_json()
+    assert service.get_bookmarks() == bookmarks
+    assert service.get_bookmarks([bookmarks[1].id]) == bookmarks[1:]
+    assert service.get_bookmarks_json() is content
+    assert database.n_reads == 1
+
+    assert [Bookmark(**item) for item in json.loads(content)] == [
+        Bookmark.from_orm(bookmark) for bookmark in bookmarks
+    ]
+
+
+def test_revising() -> None:
+    """Test the writes change the revision."""
+    service = Cached(Live(MockDatabase()))
+    bookmarks = service.get_bookmarks()
+
+    revisions = [service.get_revision()]
+    service.update_bookmarks(
+        [BookmarkParameterEdit(id=bookmarks[0].id, description="", tags=[])]
+    )
+    revisions.append(service.get_revision())
+    service.delete_bookmarks([BookmarkParameterDelete(id=bookmarks[0].id)])
+    revisions.append(service.get_revision())
+
+    assert len(set(revisions)) == len(revisions)
+    assert Cached(Live(MockDatabase())).get_revision() not in revisions
+
+
+def test_invalidating_cache() -> None:
+    """Test the writes update the cached bookmarks."""
+    database = MockDatabase()
+    service = Cached(Live(database))
+
+    bookmarks = service.get_bookmarks()
+    content = service.get_bookmarks_json()
+
+    added = service.add_bookmarks([BookmarkParameterAdd(url="python.org")])
+    assert service.get_bookmarks() == bookmarks + added
+    assert service.get_bookmarks_json() != content
+
+    service.delete_bookmarks([BookmarkParameterDelete(id=bookmarks[0].id)])
+    assert service.get_bookmarks() == bookmarks[1:] + added
+    assert len(json.loads(service.get_bookmarks_json())) == len(bookmarks)
+
+    n_reads = database.n_reads
+    visited = service.visit_bookmark(
+        BookmarkParameterVisit(id=bookmarks[1].id, visitCount=bookmarks[1].visitCount)
+    )
+    assert visited.visitCount == bookmarks[1].visitCount + 1
+    assert service.get_bookmarks([bookmarks[1].id]) == [visited]
+    assert service.get_url(bookmarks[1].id) == bookmarks[1].url
+    assert service.get_url(bookmarks[0].id) is None
+    assert database.n_reads == n_reads
+    assert database.visits == []
+
+
+def test_writing_visits_behind() -> None:
+    """Test the visits are buffered, and written in one batch."""
+    database = MockDatabase()
+    service = Cached(Live(database), flush_seconds=60)
+    bookmarks = service.get_bookmarks()
+
+    for _ in range(3):
+        service.visit_bookmark(BookmarkParameterVisit(id=bookmarks[0].id))
+    service.visit_bookmark(BookmarkParameterVisit(id=bookmarks[1].id))
+    assert database.visits == []
+
+    service.close()
+    assert len(database.visits) == 1
+    assert {
+        bookmark_id: count for bookmark_id, (count, _) in database.visits[0].items()
+    } == {bookmarks[0].id: 3, bookmarks[1].id: 1}
+
+    with pytest.raises(KeyError):
+        service.visit_bookmark(BookmarkParameterVisit(id=uuid4()))
+
+
+def test_revising_on_flush(tmp_path: Path) -> None:
+    """Test the pages read from the database change revision once the visits
+    are written."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    service = Cached(Live(SQLite(filepath)), flush_seconds=60)
+    service.import_bookmarks([Bookmark(url="https://python.org/")])
+    bookmark = service.get_bookmarks()[0]
+    query = BookmarkQuery(fields=["visitCount"])
+
+    service.visit_bookmark(BookmarkParameterVisit(id=bookmark.id))
+    revision = service.get_revision()
+    content = service.get_bookmarks_json(query)
+    service.flush()
+    assert service.get_revision() != revision
+    assert service.get_bookmarks_json(query) != content
+
+    revision = service.get_revision()
+    service.flush()
+    assert service.get_revision() == revision
+    service.close()
+
+
+def test_keeping_last_visit() -> None:
+    """Test a visit reported late does not move the last visit earlier."""
+    database = MockDatabase()
+    service = Cached(Live(database), flush_seconds=60)
+    bookmark = service.get_bookmarks()[0]
+
+    visited = service.visit_bookmark(BookmarkParameterVisit(id=bookmark.id))
+    earlier = datetime(2000, 1, 1)
+    service.add_visits({bookmark.id: (1, earlier)})
+    cached = service.get_bookmarks([bookmark.id])[0]
+    assert cached.visitCount == visited.visitCount + 1
+    assert cached.lastVisitDatetime == visited.lastVisitDatetime
+
+    service.close()
+    assert database.visits[0][bookmark.id] == (2, visited.lastVisitDatetime)
+
+
+def test_visiting_concurrently(tmp_path: Path) -> None:
+    """Test no visit is lost, when many are made at once."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    service = Cached(Live(SQLite(filepath)))
+    bookmark = service.add_bookmarks([BookmarkParameterAdd(url="python.org")])[0]
+
+    def visit() -> None:
+        for _ in range(50):
+            service.visit_bookmark(BookmarkParameterVisit(id=bookmark.id))
+
+    threads = [Thread(target=visit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    service.close()
+
+    assert service.get_bookmarks([bookmark.id])[0].visitCount == 400
+    assert SQLite(filepath).get_bookmarks([bookmark.id])[0].visitCount == 400
+
+
+def test_importing(tmp_path: Path) -> None:
+    """Test importing in batches, skipping the bookmarks already added."""
+    filepath = tmp_path.joinpath("bookman.sqlite3").as_posix()
+    service = Cached(Live(SQLite(filepath), import_batch_size=2))
+    existing = service.add_bookmarks([BookmarkParameterAdd(url="https://python.org/")])
+    revision = service.get_revision()
+
+    report = service.import_bookmarks(
+        [
+            Bookmark(url="https://python.org/", title="Python"),
+            Bookmark(url="https://fastapi.tiangolo.com/", tags=["Dev"]),
+            Bookmark(url="https://archlinux.org/"),
+            Bookmark(url="https://fastapi.tiangolo.com/"),
+            Bookmark(url="https://developer.mozilla.org/", tags=["Web", "Dev"]),
+        ]
+    )
+    assert (report.added, report.skipped) == (3, 2)
+    assert service.get_revision() != revision
+
+    bookmarks = {bookmark.url: bookmark for bookmark in service.get_bookmarks()}
+    assert len(bookmarks) == 4
+    assert bookmarks["https://python.org/"] == existing[0]
+    assert bookmarks["https://fastapi.tiangolo.com/"].tags == ("Dev",)
+    assert list(bookmarks["https://archlinux.org/"].tags) == DEFAULT_TAGS
+    assert bookmarks["https://developer.mozilla.org/"].checkedDatetime is None
+    assert bookmarks["https://developer.mozilla.org/"].statusCode == 0
+
+
 @pytest.fixture(autouse=True)
 def mock_response(monkeypatch):
     """Prevent the actual http request from being sent."""
 
-    MockResponse = namedtuple(
-        "MockResponse", ["url", "content", "status_code", "args", "kwargs"]
-    )
-
-    def mock_get(url, *args, **kwargs):
+    def mock_get(_session, url, *_args, **_kwargs):
         return MockResponse(
             url=url,
             content=b"""
@@ -150,20 +568,37 @@ def mock_response(monkeypatch):
                 </html>
             """,
             status_code=401,
-            args=args,
-            kwargs=kwargs,
         )
 
-    monkeypatch.setattr("api_bookmarks.service.requests.get", mock_get)
+    monkeypatch.setattr("api_bookmarks.service.requests.Session.get", mock_get)
 
 
 class MockDatabase(Database):
     """Mock database module, which does not access the actual database."""
 
-    def _execute_sql_file(self, script: str) -> None:
+    def __init__(self) -> None:
+        super().__init__()
+        self.validators: Dict[UUID, Validator] = {}
+        self.check_results: List[CheckResult] = []
+        self.visits: List[Dict[UUID, Tuple[int, datetime]]] = []
+        self.n_reads = 0
+
+    def _get_applied_versions(self) -> Set[int]:
+        return set()
+
+    def _apply_migrations(self, scripts: List[Path]) -> None:
         return None
 
-    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[Bookmark]:
+    def get_bookmarks(self, bookmark_ids: List[UUID] = None) -> List[BookmarkRecord]:
+        self.n_reads += 1
+        records = self._make_records()
+        if not bookmark_ids:
+            return records
+
+        return [record for record in records if record.id in bookmark_ids]
+
+    @staticmethod
+    def _make_records() -> List[BookmarkRecord]:
         datetime_iso_str = "2020-04-11T10:48:07.008968"
         bookmarks = [
             Bookmark(
@@ -189,16 +624,90 @@ class MockDatabase(Database):
                 statusCode=200,
             ),
         ]
-        if not bookmark_ids:
-            return bookmarks
-
-        return [bookmark for bookmark in bookmarks if bookmark.id in bookmark_ids]
+        return [BookmarkRecord.from_bookmark(bookmark) for bookmark in bookmarks]
+
+    def add_bookmarks(
+        self, bookmarks: List[Bookmark], skip_existing: bool = False
+    ) -> List[Bookmark]:
+        return bookmarks
+
+    def update_bookmarks(
+        self, bookmarks: List[Bookmark], fields: List[str]
+    ) -> List[BookmarkRecord]:
+        records = {record.id: record for record in self._make_records()}
+        return [
+            records[bookmark.id].replace(
+                **{field: getattr(bookmark, field) for field in fields}
+            )
+            for bookmark in bookmarks
+            if bookmark.id in records
+        ]
 
-    def add_bookmarks(self, bookmarks: List[Bookmark]) -> None:
+    def delete_bookmarks(self, bookmark_ids: List[UUID]) -> None:
         return None
 
-    def update_bookmarks(self, bookmarks: List[Bookmark], fields: List[str]) -> None:
-        return None
+    def get_changes(self, since: int) -> BookmarkChanges:
+        return BookmarkChanges(version=since + 1, bookmarks=self.get_bookmarks())
 
-    def delete_bookmarks(self, bookmark_ids: List[UUID]) -> None:
-        return None
+    def query_bookmarks(self, query: BookmarkQuery) -> List[BookmarkRecord]:
+        return self.get_bookmarks()[: query.limit]
+
+    def get_bookmarks_json(self, query: Optional[BookmarkQuery] = None) -> bytes:
+        if query is None:
+            return serialize_bookmarks(self.get_bookmarks())
+        return serialize_bookmarks(self.query_bookmarks(query), query.fields)
+
+    def iter_bookmarks(self) -> Iterator[BookmarkRecord]:
+        return iter(self.get_bookmarks())
+
+    def search_bookmarks(self, query: str, limit: int) -> List[BookmarkRecord]:
+        return self.get_bookmarks()[:limit]
+
+    def add_visits(self, visits: Dict[UUID, Tuple[int, datetime]]) -> None:
+        self.visits.append(visits)
+
+    def get_validators(self, bookmark_ids: List[UUID]) -> Dict[UUID, Validator]:
+        return {
+            bookmark_id: self.validators[bookmark_id]
+            for bookmark_id in bookmark_ids
+            if bookmark_id in self.validators
+        }
+
+    def update_validators(self, validators: Dict[UUID, Validator]) -> None:
+        self.validators.update(validators)
+
+    def add_check_results(self, results: List[CheckResult]) -> None:
+        self.check_results += results
+
+    def compact_check_results(self, before: datetime) -> int:
+        compacted = [r for r in self.check_results if r.checkedDatetime < before]
+        self.check_results = [
+            r for r in self.check_results if r.checkedDatetime >= before
+        ]
+        return len(compacted)
+
+    def get_response_times(
+        self, start: datetime, end: datetime, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        response_times: Dict[UUID, List[int]] = {}
+        for result in self.check_results:
+            if start <= result.checkedDatetime < end:
+                response_times.setdefault(result.bookmarkId, []).append(
+                    result.responseMs
+                )
+        return {key: sorted(times) for key, times in response_times.items()}
+
+    def get_statuses(
+        self, limit: int, bookmark_ids: List[UUID] = None
+    ) -> Dict[UUID, List[int]]:
+        statuses: Dict[UUID, List[int]] = {}
+        for result in sorted(
+            self.check_results, key=lambda result: result.checkedDatetime, reverse=True
+        ):
+            latest = statuses.setdefault(result.bookmarkId, [])
+            if len(latest) < limit:
+                latest.append(result.statusCode)
+        return statuses
+
+    def maintain(self, vacuum: bool = False) -> MaintenanceReport:
+        return MaintenanceReport()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.test.test_title."""
+
+from html.parser import HTMLParser
+from typing import List
+from typing import Optional
+from unicodedata import normalize
+
+import pytest
+
+from api_bookmarks.title import TitleExtractor
+from api_bookmarks.title import get_charset
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_extracting(chunk_size: int) -> None:
+    """Test the title is extracted however the page is chunked."""
+    page = b"""
+        <!DOCTYPE html>
+        <html>
+            <head>
+                <meta property="og:title" content="Open Graph">
+                <title lang="en">Tom &amp; Jerry\xc2\xa0</title>
+            </head>
+            <body><title>Body</title></body>
+        </html>
+    """
+    extractor = _extract(_split(page, chunk_size))
+    assert extractor.title == "Tom & Jerry"
+    assert extractor.done
+
+
+def test_stopping_at_head_end() -> None:
+    """Test the title in the body is not picked up."""
+    extractor = _extract([b"<html><head></head><body><title>Body</title></body>"])
+    assert extractor.title == ""
+    assert extractor.done
+
+
+def test_falling_back_to_og_title() -> None:
+    """Test og:title is used when the page does not have a title."""
+    extractor = _extract(
+        [b'<html><head><meta property="og:title" content="Open Graph"></head>']
+    )
+    assert extractor.title == "Open Graph"
+
+
+def test_honoring_meta_charset() -> None:
+    """Test the page is decoded with the charset in <meta>."""
+    page = '<html><head><meta charset="shift_jis"><title>日本語</title></head>'
+    extractor = _extract([page.encode("shift_jis")])
+    assert extractor.title == "日本語"
+    assert extractor.charset == "shift_jis"
+
+
+def test_honoring_header_charset() -> None:
+    """Test the charset from the header takes precedence over <meta>."""
+    page = '<html><head><meta charset="utf-8"><title>Café</title></head>'
+    extractor = _extract([page.encode("latin-1")], charset="ISO-8859-1")
+    assert extractor.title == normalize("NFKD", "Café")
+
+
+def test_extracting_unclosed_title() -> None:
+    """Test the page ending inside the title."""
+    extractor = _extract([b"<html><head><title>Unclosed"])
+    assert extractor.title == "Unclosed"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 16 * 1024])
+def test_skipping_raw_text(chunk_size: int) -> None:
+    """Test scripts, styles and comments are skipped, not tokenized."""
+    page = b"""
+        <html><head>
+            <!-- <title>Comment</title> --!>
+            <script>if (a</b) { c("</title>") }</SCRIPT >
+            <style>a > b { }</style>
+            <title>After</title>
+        </head>
+    """
+    assert _extract(_split(page, chunk_size)).title == "After"
+
+
+def test_skipping_large_script(monkeypatch) -> None:
+    """Test a multi-megabyte inline script is not scanned by the parser again
+    on every chunk."""
+    n_scanned = [0]
+    goahead = HTMLParser.goahead
+
+    def count_goahead(parser: HTMLParser, end: bool) -> None:
+        n_scanned[0] += len(parser.rawdata)
+        goahead(parser, end)
+
+    monkeypatch.setattr(HTMLParser, "goahead", count_goahead)
+    script = b"if(a>b){c()}" * (4 * 1024 * 1024 // 12)
+    page = b"<html><head><script>%s</script><title>SPA</title>" % script
+
+    assert _extract(_split(page, 16 * 1024)).title == "SPA"
+    assert n_scanned[0] < len(page)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_feeding_without_raw_text(monkeypatch, chunk_size: int) -> None:
+    """Test the skipped sections are cut out before the parser is fed, through
+    its documented interface only."""
+    fed: List[str] = []
+
+    class RecordingParser:
+        """Parser with only the methods of HTMLParser meant to be called."""
+
+        title = og_title = None
+        done = False
+
+        def feed(self, data: str) -> None:
+            fed.append(data)
+
+        def close(self) -> None:
+            pass
+
+    monkeypatch.setattr("api_bookmarks.title._Parser", RecordingParser)
+    page = (
+        b"<html><head><!-- <title>Comment</title> -->"
+        b'<meta content="<!--"><script src="a.js"></script>'
+        b"<STYLE>a > b { }</style ><title>a < b</title>"
+    )
+    _extract(_split(page, chunk_size))
+    assert "".join(fed) == '<html><head><meta content="<!--"><title>a < b</title>'
+
+
+@pytest.mark.parametrize(
+    "content_type,charset",
+    [
+        ("text/html", None),
+        ("text/html; charset=UTF-8", "UTF-8"),
+        ('text/html;Charset="euc-jp"', "euc-jp"),
+    ],
+)
+def test_getting_charset(content_type: str, charset: Optional[str]) -> None:
+    """Test parsing the charset parameter of Content-Type."""
+    assert get_charset(content_type) == charset
+
+
+def _extract(chunks: List[bytes], charset: Optional[str] = None) -> TitleExtractor:
+    extractor = TitleExtractor(charset)
+    for chunk in chunks:
+        extractor.feed(chunk)
+        if extractor.done:
+            break
+    extractor.close()
+    return extractor
+
+
+def _split(content: bytes, chunk_size: int) -> List[bytes]:
+    return [
+        content[start : start + chunk_size]
+        for start in range(0, len(content), chunk_size)
+    ]
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""api_bookmarks.title.
+
+This module extracts the title of an HTML page, while the page is being
+downloaded. The page is tokenized by the standard library's HTML parser.
+The parser searches an unclosed <script>, <style> or comment again from its
+start on every feed, so those sections are cut out of the text before it is
+fed to the parser: their starts are searched for outside of the tags, and
+their ends in the text as it arrives. So a multi-megabyte inline script in
+the head takes time linear in its size.
+"""
+
+from html.parser import HTMLParser
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Pattern
+from typing import Tuple
+from unicodedata import normalize
+import codecs
+import re
+
+
+DEFAULT_CHARSET = "utf-8"
+
+# As in the HTML standard, <meta charset> is looked for in the first 1024 bytes
+# of the page.
+PRESCAN_BYTES = 1024
+SLICE_SIZE = 2048
+META_CHARSET = re.compile(
+    rb"""<meta[^>]{0,512}?charset\s*=\s*["']?\s*([a-z0-9_.:-]+)""", re.IGNORECASE
+)
+# A tag up to its end, with its attributes quoted.
+TAG = r"""<[a-z/!?](?:[^>"']|"[^"]*"|'[^']*')*"""
+# The start of a skipped section, a whole other tag, or the start of a tag cut
+# at the end of the text, whichever comes first.
+SKIPPED_OPEN = re.compile(
+    r"""(?P<comment><!--)"""
+    r"""|<(?P<raw>script|style)(?=[\t\n\r\f />\x00])"""
+    r"""|%(tag)s>"""
+    r"""|(?P<partial>(?:%(tag)s(?:"[^"]*|'[^']*)?|<)\Z)""" % {"tag": TAG},
+    re.IGNORECASE,
+)
+COMMENT_CLOSE = re.compile(r"--!?\s*>")
+# As the end tags of the raw text are found by the parser.
+RAW_CLOSE = {
+    name: re.compile(r"</\s*%s\s*>" % name, re.IGNORECASE)
+    for name in ["script", "style"]
+}
+# The end of a skipped section is searched for in the text fed since the last
+# search, and in as many characters before it, in case the end is split.
+SKIPPED_TAIL = 256
+
+
+class TitleExtractor:
+    """Incremental title extractor.
+
+    Feed the page in chunks of bytes, until `done` becomes True or the page
+    ends. The page is decoded with `charset` (typically taken from the
+    Content-Type header) if given, otherwise with the charset declared in
+    <meta>, and otherwise as UTF-8.
+
+    The content of <title> in the head is preferred. When the page does not
+    have one, the og:title property is used instead.
+
+    The content of <script>, <style> and comments is skipped without being
+    tokenized.
+    """
+
+    def __init__(self, charset: Optional[str] = None) -> None:
+        self._parser = _Parser()
+        self._decoder: Optional[codecs.IncrementalDecoder] = None
+        self._pending = b""
+        # The end of the section being skipped, and the last characters
+        # searched. The start of a tag not whole yet is held back.
+        self._skip_end: Optional[Pattern[str]] = None
+        self._skipped = ""
+        self._held = ""
+        self.charset = _lookup_charset(charset)
+
+        if self.charset is not None:
+            self._set_decoder(self.charset)
+
+    @property
+    def done(self) -> bool:
+        """Whether the rest of the page can no longer affect the title."""
+        return self._parser.done
+
+    @property
+    def title(self) -> str:
+        """Title of the page, or an empty string if not found."""
+        if self._parser.title is not None:
+            title = self._parser.title
+        elif self._parser.og_title is not None:
+            title = self._parser.og_title
+        else:
+            return ""
+
+        # Normalize to unicode string: for example, "\xa0" to " " (white
+        # space). The HTML escape sequences are already unescaped by the
+        # parser.
+        return normalize("NFKD", title.strip())
+
+    def feed(self, chunk: bytes) -> None:
+        """Parse the next chunk of the page."""
+        if self.done:
+            return
+
+        if self._decoder is None:
+            self._pending += chunk
+            if len(self._pending) < PRESCAN_BYTES:
+                return
+            self._set_decoder(self._prescan(self._pending))
+            chunk, self._pending = self._pending, b""
+
+        assert self._decoder is not None
+        text = self._decoder.decode(chunk)
+        # The parser tokenizes all the text it is fed, so feed it in slices,
+        # to stop soon after the title is found.
+        for start in range(0, len(text), SLICE_SIZE):
+            self._feed_text(text[start : start + SLICE_SIZE])
+            if self.done:
+                break
+
+    def close(self) -> None:
+        """Parse whatever remains of the page."""
+        if self._decoder is None:
+            self._set_decoder(self._prescan(self._pending))
+            chunk, self._pending = self._pending, b""
+        else:
+            chunk = b""
+
+        assert self._decoder is not None
+        if not self.done:
+            self._feed_text(self._decoder.decode(chunk, final=True))
+        if not self.done and self._skip_end is None:
+            self._parser.feed(self._held)
+        self._parser.close()
+
+    def _feed_text(self, text: str) -> None:
+        """Feed the text to the parser, without the sections it would search
+        again and again until they end."""
+        text = self._held + text
+        self._held = ""
+        while text and not self.done:
+            if self._skip_end is not None:
+                text = self._skip(text)
+                continue
+            for match in SKIPPED_OPEN.finditer(text):
+                if match.lastgroup is not None:
+                    break
+            else:
+                self._parser.feed(text)
+                return
+            self._parser.feed(text[: match.start()])
+            if match.lastgroup == "partial":
+                self._held = text[match.start() :]
+                return
+            if match.lastgroup == "comment":
+                self._skip_end = COMMENT_CLOSE
+            else:
+                self._skip_end = RAW_CLOSE[match.group("raw").lower()]
+            text = text[match.end() :]
+
+    def _skip(self, text: str) -> str:
+        """Search for the end of the skipped section, and return the text
+        after the end, or an empty string if not found yet."""
+        assert self._skip_end is not None
+        text = self._skipped + text
+        match = self._skip_end.search(text)
+        if match is None:
+            self._skipped = text[-SKIPPED_TAIL:]
+            return ""
+        self._skip_end = None
+        self._skipped = ""
+        return text[match.end() :]
+
+    def _set_decoder(self, charset: str) -> None:
+        self.charset = charset
+        self._decoder = codecs.getincrementaldecoder(charset)(errors="ignore")
+
+    @staticmethod
+    def _prescan(content: bytes) -> str:
+        match = META_CHARSET.search(content[:PRESCAN_BYTES])
+        if match is None:
+            return DEFAULT_CHARSET
+        charset = _lookup_charset(match.group(1).decode("ascii"))
+        return charset if charset is not None else DEFAULT_CHARSET
+
+
+def get_charset(content_type: str) -> Optional[str]:
+    """Extract the charset parameter from the Content-Type header value."""
+    for parameter in content_type.split(";")[1:]:
+        name, _, value = parameter.partition("=")
+        if name.strip().lower() == "charset":
+            return value.strip().strip("\"'") or None
+    return None
+
+
+def _lookup_charset(charset: Optional[str]) -> Optional[str]:
+    """Return the canonical name of the charset, or None if unknown."""
+    if not charset:
+        return None
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return None
+
+
+class _Parser(HTMLParser):  # pylint: disable=abstract-method
+    """Tokenizer callbacks that collect the title and og:title."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.title: Optional[str] = None
+        self.og_title: Optional[str] = None
+        self.done = False
+        self._title_parts: List[str] = []
+        self._in_title = False
+
+    def handle_starttag(
+        self, tag: str, attrs: List[Tuple[str, Optional[str]]]
+    ) -> None:
+        if self.done:
+            return
+
+        if tag == "title" and self.title is None:
+            self._in_title = True
+        elif tag == "meta" and self.og_title is None:
+            attributes: Dict[str, Optional[str]] = dict(attrs)
+            if attributes.get("property") == "og:title":
+                self.og_title = attributes.get("content") or None
+        elif tag == "body":
+            # Anything after the head belongs to the document body.
+            self.done = True
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "title" and self._in_title:
+            self._in_title = False
+            self.title = "".join(self._title_parts)
+            self.done = True
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data: str) -> None:
+        if self._in_title:
+            self._title_parts.append(data)
+
+    def close(self) -> None:
+        super().close()
+        # The page ended inside an unclosed title.
+        if self._in_title:
+            self._in_title = False
+            self.title = "".join(self._title_parts)
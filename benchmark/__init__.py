@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks for api_bookmarks.
+
+Run each module from the repository root, e.g.
+`python -m benchmark.check_bookmarks`.
+"""
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the memory held by the bookmarks read from the SQLite backend.
+
+The whole collection is read, as the cache in front of the service holds it,
+and the memory still allocated afterwards is reported per bookmark, together
+with the peak while reading and the time to read. The bookmarks have been
+checked and visited, so their datetimes are set.
+
+    python -m benchmark.bookmark_memory --bookmarks 100000
+"""
+
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import argparse
+import gc
+import tracemalloc
+
+from api_bookmarks.database import SQLite
+from benchmark.database_latency import make_bookmarks
+
+
+def main() -> None:
+    """Print the memory held by the bookmarks, and the time to read them."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--bookmarks", type=int, default=100000)
+    args = parser.parse_args()
+
+    bookmarks = make_bookmarks(args.bookmarks)
+    for bookmark in bookmarks:
+        bookmark.checkedDatetime = datetime.now()
+        bookmark.lastVisitDatetime = datetime.now()
+
+    with TemporaryDirectory() as tmp:
+        database = SQLite("%s/bookmarks.sqlite3" % tmp)
+        database.add_bookmarks(bookmarks)
+        del bookmarks
+
+        start = perf_counter()
+        retrieved = database.get_bookmarks()
+        elapsed = perf_counter() - start
+        del retrieved
+
+        gc.collect()
+        tracemalloc.start()
+        retrieved = database.get_bookmarks()
+        held, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print("%i bookmarks" % len(retrieved))
+        print(
+            "held   %8.1f MB  (%i bytes per bookmark)"
+            % (held / 1e6, held / len(retrieved))
+        )
+        print("peak   %8.1f MB" % (peak / 1e6))
+        print("read   %8.2f s" % elapsed)
+        database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the link checks against local HTTP servers with injected latency.
+
+Each server stands in for one host. Every response is delayed by `--latency`
+seconds, and the bookmarks are spread evenly over `--hosts` servers.
+
+    python -m benchmark.check_bookmarks --bookmarks 200 --hosts 20
+"""
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter
+from time import sleep
+from typing import Iterator
+from typing import List
+from uuid import uuid4
+import argparse
+
+from api_bookmarks.checker import Checker
+from api_bookmarks.database import SQLite
+from api_bookmarks.model import Bookmark
+from api_bookmarks.model import BookmarkParameterCheck
+from api_bookmarks.service import Live
+
+
+PAGE = b"<html><head><title>Stand-in</title></head><body>%s</body></html>" % (
+    b"x" * 2048
+)
+
+
+def make_handler(latency: float) -> type:
+    """Make a request handler that answers every GET after `latency` seconds."""
+
+    class Handler(BaseHTTPRequestHandler):
+        """Stand-in site."""
+
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Serve the page after the injected latency."""
+            sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(PAGE)))
+            self.end_headers()
+            self.wfile.write(PAGE)
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+    return Handler
+
+
+@contextmanager
+def serve(n_hosts: int, latency: float) -> Iterator[List[str]]:
+    """Start `n_hosts` servers on the loopback and yield their base URLs."""
+    servers = [
+        ThreadingHTTPServer(("127.0.0.1", 0), make_handler(latency))
+        for _ in range(n_hosts)
+    ]
+    for server in servers:
+        Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield ["http://127.0.0.1:%i" % server.server_address[1] for server in servers]
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+def run(service: Live, parameters: List[BookmarkParameterCheck]) -> float:
+    """Check the bookmarks, and return the elapsed seconds."""
+    start = perf_counter()
+    service.check_bookmarks(parameters)
+    return perf_counter() - start
+
+
+def main() -> None:
+    """Compare the sequential checks against the concurrent checks."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--bookmarks", type=int, default=200)
+    parser.add_argument("--hosts", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--concurrency-per-host", type=int, default=2)
+    args = parser.parse_args()
+
+    with serve(args.hosts, args.latency) as hosts, TemporaryDirectory() as tmp:
+        database = SQLite("%s/bookmarks.sqlite3" % tmp)
+        bookmarks = [
+            Bookmark(id=uuid4(), url="%s/%i" % (hosts[i % len(hosts)], i))
+            for i in range(args.bookmarks)
+        ]
+        database.add_bookmarks(bookmarks)
+        parameters = [
+            BookmarkParameterCheck(id=bookmark.id, url=bookmark.url)
+            for bookmark in bookmarks
+        ]
+
+        print(
+            "%i bookmarks on %i hosts, %.0f ms latency"
+            % (args.bookmarks, args.hosts, args.latency * 1000)
+        )
+        for label, checker in [
+            ("sequential", Checker(concurrency=1, concurrency_per_host=1)),
+            (
+                "concurrent",
+                Checker(
+                    concurrency=args.concurrency,
+                    concurrency_per_host=args.concurrency_per_host,
+                ),
+            ),
+        ]:
+            elapsed = run(Live(database, checker), parameters)
+            print(
+                "%-10s %8.3f s %10.1f checks/s"
+                % (label, elapsed, args.bookmarks / elapsed)
+            )
+
+
+if __name__ == "__main__":
+    main()
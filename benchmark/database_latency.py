@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the latency of the SQLite backend, per call and pooled, and of
+the in-memory backend.
+
+GET fetches one bookmark by id (as after a visit or an edit) and the whole
+collection (as on a new tab). PATCH updates the description and tags of one
+bookmark.
+
+    python -m benchmark.database_latency --bookmarks 4000
+"""
+
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+from typing import List
+from typing import Tuple
+from uuid import uuid4
+import argparse
+
+from api_bookmarks.database import Database
+from api_bookmarks.database import Memory
+from api_bookmarks.database import SQLite
+from api_bookmarks.model import Bookmark
+
+
+def make_bookmarks(n_bookmarks: int) -> List[Bookmark]:
+    """Make bookmarks with a few tags each."""
+    return [
+        Bookmark(
+            id=uuid4(),
+            url="https://example.com/%i" % i,
+            title="Example %i" % i,
+            description="Bookmark number %i" % i,
+            tags=["tag%i" % (i % 50), "tag%i" % (i % 7)],
+            statusCode=200,
+        )
+        for i in range(n_bookmarks)
+    ]
+
+
+def measure(function: Callable[[int], None], n_runs: int) -> float:
+    """Return the median latency in milliseconds."""
+    latencies = []
+    for i in range(n_runs):
+        start = perf_counter()
+        function(i)
+        latencies.append(perf_counter() - start)
+    return median(latencies) * 1000
+
+
+def main() -> None:
+    """Print the median latency of each operation in each mode."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--bookmarks", type=int, default=4000)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    bookmarks = make_bookmarks(args.bookmarks)
+    print("%i bookmarks, median of %i runs" % (args.bookmarks, args.runs))
+    print("%-10s %12s %12s %12s" % ("mode", "GET one", "GET all", "PATCH one"))
+
+    modes: List[Tuple[str, Callable[[str], Database]]] = [
+        ("per-call", lambda tmp: SQLite("%s/bookmarks.sqlite3" % tmp, pool_size=0)),
+        ("pooled", lambda tmp: SQLite("%s/bookmarks.sqlite3" % tmp, pool_size=4)),
+        ("memory", lambda tmp: Memory("%s/bookmarks.snapshot" % tmp)),
+    ]
+    for label, open_database in modes:
+        with TemporaryDirectory() as tmp:
+            database = open_database(tmp)
+            database.add_bookmarks(bookmarks)
+
+            def get_one(i: int) -> None:
+                database.get_bookmarks([bookmarks[i % len(bookmarks)].id])
+
+            def get_all(_: int) -> None:
+                database.get_bookmarks()
+
+            def patch_one(i: int) -> None:
+                bookmark = bookmarks[i % len(bookmarks)]
+                bookmark.description = "Edited %i" % i
+                bookmark.tags = ["edited", "tag%i" % i]
+                database.update_bookmarks([bookmark], ["description", "tags"])
+
+            print(
+                "%-10s %9.3f ms %9.3f ms %9.3f ms"
+                % (
+                    label,
+                    measure(get_one, args.runs),
+                    measure(get_all, max(args.runs // 20, 1)),
+                    measure(patch_one, args.runs),
+                )
+            )
+            database.close()
+
+
+if __name__ == "__main__":
+    main()
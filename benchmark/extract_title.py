@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the title extraction on a corpus of pathological pages.
+
+The incremental extractor (api_bookmarks.title) is compared against the
+DOTALL regular expressions it replaced. Each measurement runs in a child
+process and is abandoned after `--timeout` seconds, since some pages take the
+regular expressions minutes or more. The corpus is made in each of the
+sizes, so that a throughput falling with the size shows a superlinear cost.
+
+    python -m benchmark.extract_title --size 65536 4194304
+"""
+
+from html import unescape
+from multiprocessing import Pool
+from multiprocessing import TimeoutError  # pylint: disable=redefined-builtin
+from time import perf_counter
+from typing import Callable
+from typing import Dict
+from unicodedata import normalize
+import argparse
+import re
+
+from api_bookmarks.title import TitleExtractor
+
+
+CHUNK_SIZE = 16 * 1024
+
+
+def make_corpus(size: int) -> Dict[str, bytes]:
+    """Make pages of about `size` bytes each."""
+    return {
+        "plain": (
+            b"<html><head><title>Plain</title></head><body>%s</body></html>"
+            % (b"<p>Lorem ipsum</p>" * (size // 18))
+        ),
+        "spa (inline script in head)": (
+            b"<html><head><script>%s</script><title>SPA</title></head><body></body>"
+            % (b"if(a>b){c()}" * (size // 12))
+        ),
+        "unclosed head": (
+            b"<html><head><title>Unclosed</title><body>%s"
+            % (b"<div>x</div>" * (size // 12))
+        ),
+        "many head tags": b"<head>" * (size // 6),
+        "many title tags": b"<html><head>" + b"<title>>" * (size // 8),
+    }
+
+
+def regex_title(content: bytes) -> str:
+    """Extract the title with the DOTALL regular expressions."""
+    text = content.decode("utf-8", errors="ignore")
+    head = re.search("<head(.*)>(.*)</head>", text, flags=re.IGNORECASE | re.DOTALL)
+    if head is None:
+        return ""
+    title = re.search(
+        "<title(.*)>(.*)</title>", head.group(0), flags=re.IGNORECASE | re.DOTALL
+    )
+    if title is None:
+        return ""
+    return normalize("NFKD", unescape(title.group(2)).strip())
+
+
+def incremental_title(content: bytes) -> str:
+    """Extract the title with the incremental extractor, chunk by chunk."""
+    extractor = TitleExtractor()
+    for start in range(0, len(content), CHUNK_SIZE):
+        extractor.feed(content[start : start + CHUNK_SIZE])
+        if extractor.done:
+            break
+    extractor.close()
+    return extractor.title
+
+
+def measure(function: Callable[[bytes], str], content: bytes, budget: float) -> float:
+    """Return the throughput in MB/s, repeating for at least `budget` seconds."""
+    n_runs = 0
+    start = perf_counter()
+    while True:
+        function(content)
+        n_runs += 1
+        elapsed = perf_counter() - start
+        if elapsed >= budget:
+            return n_runs * len(content) / elapsed / 1e6
+
+
+def measure_with_timeout(
+    function: Callable[[bytes], str], content: bytes, budget: float, timeout: float
+) -> str:
+    """Format the throughput, or report the timeout."""
+    pool = Pool(1)
+    try:
+        result = pool.apply_async(measure, (function, content, budget))
+        return "%9.2f MB/s" % result.get(timeout)
+    except TimeoutError:
+        return "%-14s" % ("  >%.0f s" % timeout)
+    finally:
+        pool.terminate()
+
+
+def main() -> None:
+    """Print the throughput of both extractors on every page in the corpus."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--size", type=int, nargs="+", default=[64 * 1024, 4 * 1024 * 1024]
+    )
+    parser.add_argument("--budget", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    for size in args.size:
+        print("%-30s %12s %12s" % ("page (%i bytes)" % size, "regex", "incremental"))
+        for name, content in make_corpus(size).items():
+            print(
+                "%-30s %s %s"
+                % (
+                    name,
+                    measure_with_timeout(
+                        regex_title, content, args.budget, args.timeout
+                    ),
+                    measure_with_timeout(
+                        incremental_title, content, args.budget, args.timeout
+                    ),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the bulk import of browser exports.
+
+A Netscape bookmark file and a Chrome Bookmarks file (JSON) are generated,
+with the bookmarks spread over nested folders. Each is imported into an empty
+SQLite database, and parsed once more under tracemalloc, for the peak memory
+of the parser.
+
+    python -m benchmark.import_bookmarks --bookmarks 100000
+"""
+
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any
+from typing import Dict
+from typing import List
+import argparse
+import json
+import tracemalloc
+
+from api_bookmarks.database import SQLite
+from api_bookmarks.importer import read_bookmarks
+from api_bookmarks.service import Live
+
+
+FOLDER_SIZE = 100
+
+
+def make_netscape(n_bookmarks: int) -> bytes:
+    """Make a Netscape bookmark file, with FOLDER_SIZE bookmarks per folder."""
+    lines = ["<!DOCTYPE NETSCAPE-Bookmark-file-1>", "<H1>Bookmarks</H1>", "<DL><p>"]
+    for start in range(0, n_bookmarks, FOLDER_SIZE):
+        lines.append("<DT><H3>Folder %i</H3>" % (start // FOLDER_SIZE % 20))
+        lines.append("<DL><p>")
+        for i in range(start, min(start + FOLDER_SIZE, n_bookmarks)):
+            lines.append(
+                '<DT><A HREF="https://example.com/%i" ADD_DATE="1586594887">'
+                "Example %i</A>" % (i, i)
+            )
+            lines.append("<DD>Bookmark number %i" % i)
+        lines.append("</DL><p>")
+    lines.append("</DL>")
+    return "\n".join(lines).encode()
+
+
+def make_chrome(n_bookmarks: int) -> bytes:
+    """Make a Chrome Bookmarks file, with FOLDER_SIZE bookmarks per folder."""
+    folders: List[Dict[str, Any]] = []
+    for start in range(0, n_bookmarks, FOLDER_SIZE):
+        children = [
+            {
+                "date_added": "13231068487000000",
+                "id": str(i),
+                "name": "Example %i" % i,
+                "type": "url",
+                "url": "https://example.com/%i" % i,
+            }
+            for i in range(start, min(start + FOLDER_SIZE, n_bookmarks))
+        ]
+        folders.append(
+            {
+                "children": children,
+                "name": "Folder %i" % (start // FOLDER_SIZE % 20),
+                "type": "folder",
+            }
+        )
+    roots = {"bookmark_bar": {"children": folders, "name": "Bookmarks bar"}}
+    return json.dumps({"roots": roots, "version": 1}, indent=3).encode()
+
+
+def main() -> None:
+    """Print the import time and the peak memory of the parser per format."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--bookmarks", type=int, default=100000)
+    args = parser.parse_args()
+
+    print("%i bookmarks" % args.bookmarks)
+    print("%-10s %10s %12s %14s" % ("format", "size", "import", "parser peak"))
+    for label, content in [
+        ("netscape", make_netscape(args.bookmarks)),
+        ("chrome", make_chrome(args.bookmarks)),
+    ]:
+        with TemporaryDirectory() as tmp:
+            path = "%s/export" % tmp
+            with open(path, "wb") as export:
+                export.write(content)
+            service = Live(SQLite("%s/bookmarks.sqlite3" % tmp))
+
+            start = perf_counter()
+            with open(path, "rb") as export:
+                report = service.import_bookmarks(read_bookmarks(export))
+            elapsed = perf_counter() - start
+            assert report.added == args.bookmarks
+
+            tracemalloc.start()
+            with open(path, "rb") as export:
+                for _ in read_bookmarks(export):
+                    pass
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print(
+                "%-10s %7.1f MB %10.2f s %11.1f MB"
+                % (label, len(content) / 1e6, elapsed, peak / 1e6)
+            )
+            service.database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the maintenance of the SQLite backend.
+
+Bookmarks are added with a tag of their own and a few shared ones, and half
+of them (with their own tags) are deleted, as after a cleanup. The database
+is then maintained, incrementally and with a full vacuum, and the reports
+printed.
+
+    python -m benchmark.maintain_database --bookmarks 100000
+"""
+
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import List
+from uuid import uuid4
+import argparse
+
+from api_bookmarks.database import SQLite
+from api_bookmarks.model import Bookmark
+from api_bookmarks.model import MaintenanceReport
+
+
+def make_bookmarks(n_bookmarks: int) -> List[Bookmark]:
+    """Make bookmarks with a tag of their own, and two shared tags."""
+    return [
+        Bookmark(
+            id=uuid4(),
+            url="https://example.com/%i" % i,
+            title="Example %i" % i,
+            description="Bookmark number %i" % i,
+            tags=["own%i" % i, "tag%i" % (i % 50), "tag%i" % (i % 7)],
+            statusCode=200,
+        )
+        for i in range(n_bookmarks)
+    ]
+
+
+def print_report(label: str, report: MaintenanceReport, seconds: float) -> None:
+    """Print the report on one line."""
+    print(
+        "%-12s %8.2f s %8i %10.1f MB %10.1f ms %10.1f ms"
+        % (
+            label,
+            seconds,
+            report.orphanTags,
+            report.reclaimedPages * report.pageSize / 1e6,
+            report.queryMsBefore,
+            report.queryMsAfter,
+        )
+    )
+
+
+def main() -> None:
+    """Print the reports of the maintenance after a cleanup."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--bookmarks", type=int, default=100000)
+    args = parser.parse_args()
+
+    print("%i bookmarks, half of them deleted" % args.bookmarks)
+    print(
+        "%-12s %10s %8s %13s %13s %13s"
+        % ("mode", "time", "tags", "reclaimed", "list before", "list after")
+    )
+    with TemporaryDirectory() as tmp:
+        database = SQLite("%s/bookmarks.sqlite3" % tmp)
+        bookmarks = make_bookmarks(args.bookmarks)
+        database.add_bookmarks(bookmarks)
+        database.delete_bookmarks([bookmark.id for bookmark in bookmarks[::2]])
+
+        for label, vacuum in [("incremental", False), ("vacuum", True)]:
+            start = perf_counter()
+            report = database.maintain(vacuum)
+            print_report(label, report, perf_counter() - start)
+        database.close()
+
+
+if __name__ == "__main__":
+    main()
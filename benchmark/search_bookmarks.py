@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the full-text search against retrieving and scanning everything.
+
+The scan stands in for filtering in the browser: every bookmark is retrieved
+and matched against the query, which is what the search endpoint replaces.
+
+    python -m benchmark.search_bookmarks --bookmarks 10000 100000
+"""
+
+from random import Random
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+from typing import List
+from uuid import uuid4
+import argparse
+
+from api_bookmarks.database import SQLite
+from api_bookmarks.model import Bookmark
+
+
+WORDS = (
+    "python rust golang javascript typescript database sqlite postgres index "
+    "query search engine browser startpage bookmark recipe travel music news "
+    "weather finance science history design photo video game sport health "
+    "kernel network security privacy cloud storage backup editor terminal"
+).split()
+QUERIES = ["pyth", "sqlite index", "travel photo", "kern net sec", "zzz"]
+
+
+def make_bookmarks(n_bookmarks: int, seed: int = 0) -> List[Bookmark]:
+    """Make bookmarks with random words in the title, description and tags."""
+    random = Random(seed)
+    return [
+        Bookmark(
+            id=uuid4(),
+            url="https://%s.example.com/%i" % (random.choice(WORDS), i),
+            title=" ".join(random.sample(WORDS, 3)),
+            description=" ".join(random.sample(WORDS, 8)),
+            tags=random.sample(WORDS, 2),
+            statusCode=200,
+        )
+        for i in range(n_bookmarks)
+    ]
+
+
+def scan(database: SQLite, query: str, limit: int) -> List[Bookmark]:
+    """Retrieve every bookmark and keep those matching every word."""
+    words = query.lower().split()
+    matches = []
+    for bookmark in database.get_bookmarks():
+        text = " ".join(
+            [bookmark.url, bookmark.title, bookmark.description] + bookmark.tags
+        ).lower()
+        if all(word in text for word in words):
+            matches.append(bookmark)
+    return matches[:limit]
+
+
+def measure(function: Callable[[], object], n_runs: int) -> float:
+    """Return the median latency in milliseconds."""
+    latencies = []
+    for _ in range(n_runs):
+        start = perf_counter()
+        function()
+        latencies.append(perf_counter() - start)
+    return median(latencies) * 1000
+
+
+def main() -> None:
+    """Print the median latency of each query, searched and scanned."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--bookmarks", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    print("%-10s %-16s %12s %12s" % ("bookmarks", "query", "search", "scan"))
+    for n_bookmarks in args.bookmarks:
+        with TemporaryDirectory() as tmp:
+            database = SQLite("%s/bookmarks.sqlite3" % tmp)
+            database.add_bookmarks(make_bookmarks(n_bookmarks))
+
+            for query in QUERIES:
+                print(
+                    "%-10i %-16s %9.3f ms %9.3f ms"
+                    % (
+                        n_bookmarks,
+                        query,
+                        measure(
+                            lambda: database.search_bookmarks(query, args.limit),
+                            args.runs,
+                        ),
+                        measure(
+                            lambda: scan(database, query, args.limit),
+                            max(args.runs // 10, 1),
+                        ),
+                    )
+                )
+            database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark serializing the whole collection for GET /api/v1/bookmarks.
+
+Three read paths are compared, each from the SQLite backend to JSON bytes:
+the response model (the bookmarks are built, then validated again and encoded
+by FastAPI), the models (the bookmarks are built and serialized by pydantic),
+and the fast path (the records are serialized by orjson as they are read).
+
+    python -m benchmark.serialize_bookmarks --bookmarks 1000 10000 100000
+"""
+
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+from typing import List
+import argparse
+import json
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+
+from api_bookmarks.database import SQLite
+from api_bookmarks.model import Bookmark
+from benchmark.database_latency import make_bookmarks
+
+
+def measure(function: Callable[[], bytes], n_runs: int) -> float:
+    """Return the best time in seconds."""
+    times = []
+    for _ in range(n_runs):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    """Print the rows per second of each read path."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--bookmarks", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print("rows/s, best of %i runs" % args.runs)
+    print(
+        "%-10s %16s %12s %12s" % ("bookmarks", "response model", "models", "fast path")
+    )
+    for n_bookmarks in args.bookmarks:
+        with TemporaryDirectory() as tmp:
+            database = SQLite("%s/bookmarks.sqlite3" % tmp)
+            database.add_bookmarks(make_bookmarks(n_bookmarks))
+
+            def response_model() -> bytes:
+                bookmarks = parse_obj_as(List[Bookmark], database.get_bookmarks())
+                return json.dumps(jsonable_encoder(bookmarks)).encode()
+
+            def models() -> bytes:
+                bookmarks = database.get_bookmarks()
+                return (
+                    "[%s]" % ",".join(bookmark.json() for bookmark in bookmarks)
+                ).encode()
+
+            rates = [
+                n_bookmarks / measure(function, args.runs)
+                for function in [response_model, models, database.get_bookmarks_json]
+            ]
+            print("%-10i %16.0f %12.0f %12.0f" % tuple([n_bookmarks] + rates))
+            database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 """API for startpage."""
 
+from os import environ
 from os import getenv
 from os.path import expandvars
 from pathlib import Path
@@ -16,27 +17,55 @@ from fastapi.staticfiles import StaticFiles
 import uvicorn
 
 from api_bookmarks import SQLite
+from api_bookmarks import AsyncService
+from api_bookmarks import Cached
+from api_bookmarks import JobQueue
 from api_bookmarks import Live
+from api_bookmarks import Maintainer
+from api_bookmarks import Memory
 from api_bookmarks import Route
+from api_bookmarks import Scheduler
+from api_bookmarks.database import Database
 
 
 DIST = Path(__file__).parent.joinpath("dist")
 
-app = FastAPI()
-app.mount(
-    "/fonts", StaticFiles(directory=DIST.joinpath("fonts")), name="fonts"
-)
-app.mount("/js", StaticFiles(directory=DIST.joinpath("js")), name="js")
-app.mount("/css", StaticFiles(directory=DIST.joinpath("css")), name="css")
+
+def create_app() -> FastAPI:
+    """Create the app, serving the startpage and the API.
+
+    The app is created by uvicorn, rather than on import, so that the
+    database is only opened where the app is served (and not, for example,
+    along with the one of the "maintain" command: for the in-memory one, the
+    journal would be written by both).
+    """
+    app = FastAPI()
+    app.mount(
+        "/fonts", StaticFiles(directory=DIST.joinpath("fonts")), name="fonts"
+    )
+    app.mount("/js", StaticFiles(directory=DIST.joinpath("js")), name="js")
+    app.mount("/css", StaticFiles(directory=DIST.joinpath("css")), name="css")
+    app.add_api_route("/", root)
+    app.add_api_route("/{resource}", serve_static, include_in_schema=False)
+    app.include_router(_define_bookmark_api_route(app))
+
+    # Allow CORS (Cross-Origin Resource Sharing)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:8081",],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["ETag"],
+    )
+    return app
 
 
-@app.get("/")
 async def root():
     """Serve a single HTML file."""
     return FileResponse(path=DIST.joinpath("index.html"))
 
 
-@app.get("/{resource}", include_in_schema=False)
 def serve_static(resource: str):
     """Serve a static file, if it exists."""
     resource_path = DIST.joinpath(resource)
@@ -46,11 +75,42 @@ def serve_static(resource: str):
     return FileResponse(path=DIST.joinpath("index.html"))
 
 
-def _define_bookmark_api_route() -> APIRouter:
-    """Define the API routes."""
-    database = SQLite(_get_data_dir().joinpath("bookmarks.sqlite3").as_posix())
-    service = Live(database)
-    return Route(service)
+def _define_bookmark_api_route(app: FastAPI) -> APIRouter:
+    """Define the API routes of the app.
+
+    The bookmarks are also re-checked on schedule, and the database is
+    maintained while idle, in the background, while the app is running.
+
+    On shutdown, everything that writes to the database is stopped first: the
+    background tasks, the queued jobs and the calls in progress. Then the
+    visits buffered in the cache are written, and the database is closed.
+    """
+    database = _make_database()
+    service = Cached(Live(database))
+    async_service = AsyncService(service)
+    jobs = JobQueue(service)
+
+    scheduler = Scheduler(service)
+    app.add_event_handler("startup", scheduler.start)
+    app.add_event_handler("shutdown", scheduler.stop)
+    maintainer = Maintainer(service)
+    app.add_event_handler("startup", maintainer.start)
+    app.add_event_handler("shutdown", maintainer.stop)
+    app.add_event_handler("shutdown", jobs.close)
+    app.add_event_handler("shutdown", async_service.close)
+    app.add_event_handler("shutdown", service.close)
+    app.add_event_handler("shutdown", database.close)
+
+    return Route(async_service, jobs)
+
+
+def _make_database() -> Database:
+    """Open the database of the backend set in $STARTPAGE_DATABASE: "sqlite"
+    (the default), or "memory" for the bookmarks held in memory, persisted in
+    a journal and a snapshot."""
+    if getenv("STARTPAGE_DATABASE", "sqlite") == "memory":
+        return Memory(_get_data_dir().joinpath("bookmarks.snapshot").as_posix())
+    return SQLite(_get_data_dir().joinpath("bookmarks.sqlite3").as_posix())
 
 
 def _get_data_dir() -> Path:
@@ -64,32 +124,49 @@ def _get_data_dir() -> Path:
     return data_dir
 
 
-app.include_router(_define_bookmark_api_route())
-
-# Allow CORS (Cross-Origin Resource Sharing)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:8081",],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-
 def main():
-    """Start the ASGI server (uvicorn) to serve the startpage."""
+    """Start the ASGI server (uvicorn) to serve the startpage.
+
+    Or, with the "maintain" command, maintain the database and exit.
+    """
     parser = argparse.ArgumentParser(description=getdoc(main))
     parser.add_argument(
         "--development",
         action="store_true",
         help="Run in the development mode.",
     )
+    parser.add_argument(
+        "--database",
+        choices=["sqlite", "memory"],
+        default=getenv("STARTPAGE_DATABASE", "sqlite"),
+        help="Store the bookmarks in SQLite, or in memory (persisted in a "
+        "journal and a snapshot, in the same data directory).",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    maintain_parser = subparsers.add_parser(
+        "maintain",
+        help="Purge the unused tags, analyze and vacuum the database, and exit.",
+    )
+    maintain_parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="Rewrite the whole database, which returns all the unused pages "
+        "(and enables the incremental vacuum on a database created before).",
+    )
     args = parser.parse_args()
+    # The app is created by uvicorn (in another process, when reloading), so
+    # the choice goes through the environment.
+    environ["STARTPAGE_DATABASE"] = args.database
+
+    if args.command == "maintain":
+        _maintain(args.vacuum)
+        return
 
     # Note that the port number has to be the same as the one hard-coded in
     # src/services/BookmarkService.js.
     uvicorn.run(
-        "main:app",
+        "main:create_app",
+        factory=True,
         host="127.0.0.1",
         port=33875,
         log_level="info",
@@ -98,5 +175,21 @@ def main():
     )
 
 
+def _maintain(vacuum: bool) -> None:
+    """Maintain the database, and print the report."""
+    database = _make_database()
+    report = database.maintain(vacuum)
+    database.close()
+    print("Purged %i unused tag(s)." % report.orphanTags)
+    print(
+        "Reclaimed %i page(s) of %i bytes, %i page(s) left unused."
+        % (report.reclaimedPages, report.pageSize, report.freePages)
+    )
+    print(
+        "Listed all the bookmarks in %.1f ms, from %.1f ms."
+        % (report.queryMsAfter, report.queryMsBefore)
+    )
+
+
 if __name__ == "__main__":
     main()
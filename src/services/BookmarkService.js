@@ -10,9 +10,41 @@ const apiClient = axios.create({
   timeout: 10000
 });
 
+// The last retrieved bookmarks and their ETag, to revalidate with the server
+// instead of downloading the unchanged bookmarks again.
+let lastBookmarks = null;
+let lastETag = null;
+
 export default {
   getBookmarks() {
-    return apiClient.get("/v1/bookmarks");
+    let headers = lastETag ? { "If-None-Match": lastETag } : {};
+    return apiClient
+      .get("/v1/bookmarks", {
+        headers: headers,
+        validateStatus: status =>
+          (status >= 200 && status < 300) || status === 304
+      })
+      .then(response => {
+        if (response.status === 304) {
+          response.data = lastBookmarks.slice();
+        } else {
+          lastBookmarks = response.data.slice();
+          lastETag = response.headers.etag || null;
+        }
+        return response;
+      });
+  },
+
+  /**
+   * Search bookmarks by the words in their url, title, description and tags.
+   * Each word matches as a prefix, and the best matches come first.
+   * @param { string } query
+   * @param { number } limit
+   */
+  searchBookmarks(query, limit = 20) {
+    return apiClient.get("/v1/bookmarks/search", {
+      params: { q: query, limit: limit }
+    });
   },
 
   /**
@@ -26,12 +58,63 @@ export default {
     return apiClient.post("/v1/bookmarks", parameters);
   },
 
-  putBookmarks(bookmarks) {
-    // Sync bookmarks
+  /**
+   * Sync bookmarks: queue the checks as a job in the background, and resolve
+   * to the job right away. Follow the job with followJob.
+   */
+  putBookmarksInBackground(bookmarks) {
     let parameters = bookmarks.map(bookmark => {
       return { id: bookmark.id, url: bookmark.url };
     });
-    return apiClient.put("/v1/bookmarks", parameters);
+    return apiClient.put("/v1/bookmarks", parameters, {
+      params: { background: true }
+    });
+  },
+
+  /**
+   * Follow the events of the job, until it ends. Returns the EventSource, to
+   * close it early.
+   * @param { string } jobId
+   * @param { Object } handlers
+   * @param { function } handlers.onResult - called with each checked bookmark
+   * @param { function } handlers.onProgress - called with the job
+   * @param { function } handlers.onEnd - called with the finished job
+   */
+  followJob(jobId, { onResult, onProgress, onEnd }) {
+    let source = new EventSource(
+      `${apiClient.defaults.baseURL}/v1/jobs/${jobId}/events`
+    );
+    let listen = (name, handler) =>
+      source.addEventListener(name, event => {
+        if (handler) {
+          handler(JSON.parse(event.data));
+        }
+      });
+    listen("result", onResult);
+    listen("progress", onProgress);
+    listen("end", job => {
+      source.close();
+      if (onEnd) {
+        onEnd(job);
+      }
+    });
+    return source;
+  },
+
+  cancelJob(jobId) {
+    return apiClient.delete(`/v1/jobs/${jobId}`);
+  },
+
+  /**
+   * Import the bookmarks exported from a browser: a bookmark file (HTML), or
+   * a JSON export of Firefox or Chrome. The folders become tags.
+   * @param { File } file
+   */
+  importBookmarks(file) {
+    return apiClient.post("/v1/bookmarks/import", file, {
+      headers: { "Content-Type": file.type || "application/octet-stream" },
+      timeout: 0
+    });
   },
 
   /**
@@ -52,7 +135,25 @@ export default {
   },
 
   visitBookmark(bookmark) {
-    let parameter = { id: bookmark.id, visitCount: bookmark.visitCount };
+    let parameter = { id: bookmark.id };
     return apiClient.patch("/v1/visit/bookmark", parameter);
+  },
+
+  /**
+   * URL that redirects to the bookmarked site, and counts the visit on the
+   * way. Opening the bookmark through it takes a single request.
+   */
+  getGoUrl(bookmark) {
+    // /go is served next to /api, rather than under it.
+    return new URL(`/go/${bookmark.id}`, apiClient.defaults.baseURL).href;
+  },
+
+  /**
+   * URL to download all the bookmarks, streamed from the server.
+   * @param { string } format "jsonl", or "html" for a bookmark file which the
+   * browsers import
+   */
+  getExportUrl(format = "html") {
+    return `${apiClient.defaults.baseURL}/v1/bookmarks/export?format=${format}`;
   }
 };